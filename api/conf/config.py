@@ -1,8 +1,16 @@
+from pathlib import Path
+from tempfile import gettempdir
+
 from pydantic_settings import BaseSettings
 
 
 class Settings(BaseSettings):
     sqlalchemy_database_url: str
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
 
     secret_key: str
     algorithm: str
@@ -16,17 +24,70 @@ class Settings(BaseSettings):
     mail_starttls: bool
     mail_ssl_tls: bool
 
-    # redis_host: str = 'localhost'
-    # redis_port: int = 6379
+    redis_host: str = 'localhost'
+    redis_port: int = 6379
+    redis_db: int = 0
 
     cors_origins: str = '*'
 
-    cloudinary_name: str
-    cloudinary_api_key: str
-    cloudinary_api_secret: str
+    # 'cloudinary', 'local' or 's3', see storage
+    storage_backend: str = 'cloudinary'
+
+    cloudinary_name: str = ''
+    cloudinary_api_key: str = ''
+    cloudinary_api_secret: str = ''
+
+    s3_endpoint_url: str = ''
+    s3_bucket: str = 'picturest'
+    s3_access_key: str = ''
+    s3_secret_key: str = ''
+    s3_region: str = 'us-east-1'
+    # URL the bucket is served at, the endpoint and bucket by default
+    s3_public_url: str = ''
 
     max_tags: int = 5
 
+    max_concurrent_uploads: int = 8
+    upload_chunk_size: int = 6 * 1024 * 1024
+    upload_spool_dir: str = str(Path(gettempdir()) / 'picturest_spool')
+    upload_job_workers: int = 4
+    upload_job_queue_size: int = 1000
+    batch_upload_max_files: int = 100
+    batch_upload_concurrency: int = 4
+
+    qrcode_cache_size: int = 4096
+    qrcode_cache_dir: str = ''
+    qrcode_max_age: int = 86400
+
+    blacklist_sync_interval: float = 2.0
+    blacklist_sync_overlap: float = 60
+    blacklist_purge_interval: float = 3600
+    blacklist_bloom_bits: int = 1 << 20
+    blacklist_bloom_hashes: int = 4
+
+    user_cache_ttl: float = 30
+
+    # 'memory', 'redis' or '' to switch the cache off, see response_cache
+    response_cache_backend: str = 'memory'
+    response_cache_ttl: float = 30
+    response_cache_size: int = 1024
+
+    password_hash_rounds: int = 12
+    password_hash_workers: int = 2
+    password_hash_max_pending: int = 64
+
+    # 'cloudinary' or 'local', see transform_engine
+    transform_backend: str = 'cloudinary'
+    transform_workers: int = 2
+    # the largest picture made by a transformation, a side and the whole area
+    transform_max_side: int = 4096
+    transform_max_pixels: int = 4096 * 4096
+    # the largest source picture decoded for a transformation, a photo of a camera is bigger than a result
+    transform_max_source_side: int = 16384
+    transform_max_source_pixels: int = 100_000_000
+    local_store_dir: str = 'static/media'
+    local_store_url: str = '/static/media'
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -1,19 +1,35 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from api.conf.config import settings
+from api.database.pool import MeteredQueuePool, pool_metrics
 
 
-engine = create_engine(settings.sqlalchemy_database_url)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def get_engine_options(database_url: str) -> dict:
+    """
+    The get_engine_options function builds pool arguments for create_async_engine from the settings.
+    SQLite dialects use NullPool or StaticPool which do not accept sizing arguments.
+
+    :param database_url: str: Database URL the engine is created for
+    :return: A dictionary of keyword arguments for create_async_engine
+    """
+    options = {"pool_pre_ping": settings.db_pool_pre_ping, "pool_recycle": settings.db_pool_recycle}
+    if make_url(database_url).get_backend_name() != "sqlite":
+        options.update(poolclass=MeteredQueuePool,
+                       pool_size=settings.db_pool_size,
+                       max_overflow=settings.db_max_overflow,
+                       pool_timeout=settings.db_pool_timeout)
+    return options
+
+
+engine = create_async_engine(settings.sqlalchemy_database_url, **get_engine_options(settings.sqlalchemy_database_url))
+pool_metrics.bind(engine)
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 
 # Dependency
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 class NotUniqueException(Exception):
@@ -0,0 +1,35 @@
+"""
+Full-text index of the picture descriptions.
+
+Postgres keeps a generated tsvector column with a GIN index (created by the migration),
+SQLite keeps an external content FTS5 table synchronized by triggers (created with the pictures table).
+"""
+from sqlalchemy import DDL
+
+FTS_CONFIG = 'simple'
+
+POSTGRES_SEARCH_VECTOR = 'search_vector'
+
+SQLITE_FTS_TABLE = 'pictures_fts'
+
+SQLITE_FTS_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5("
+    f"description, content='pictures', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_ai AFTER INSERT ON pictures BEGIN "
+    f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, description) VALUES (new.id, new.description); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_ad AFTER DELETE ON pictures BEGIN "
+    f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, description) "
+    f"VALUES ('delete', old.id, old.description); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_au AFTER UPDATE OF description ON pictures BEGIN "
+    f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, description) "
+    f"VALUES ('delete', old.id, old.description); "
+    f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, description) VALUES (new.id, new.description); END",
+]
+
+
+def sqlite_fts_create() -> list[DDL]:
+    return [DDL(statement).execute_if(dialect='sqlite') for statement in SQLITE_FTS_DDL]
+
+
+def sqlite_fts_drop() -> DDL:
+    return DDL(f"DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}").execute_if(dialect='sqlite')
@@ -1,9 +1,12 @@
 import enum
-from sqlalchemy import Column, Integer, String, func, ForeignKey, Boolean, Table, Numeric
-from sqlalchemy import UniqueConstraint
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy import Column, Integer, String, func, ForeignKey, Boolean, Table, Numeric, JSON
+from sqlalchemy import UniqueConstraint, Index
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.sql.sqltypes import DateTime
-from sqlalchemy_utils import aggregated
+
+from api.database.fulltext import sqlite_fts_create, sqlite_fts_drop
 
 
 Base = declarative_base()
@@ -49,6 +52,8 @@ class Role(Base):
 
 class User(Base):
     __tablename__ = "users"
+    # keyset pagination of the admin listing walks the (created_at, id) index
+    __table_args__ = (Index('ix_users_created_at_id', 'created_at', 'id'),)
 
     id = Column(Integer, primary_key=True)
     username = Column(String(100))
@@ -60,9 +65,14 @@ class User(Base):
     is_active = Column(Boolean, default=False)
     slug = Column(String(255), unique=True, nullable=False)
     avatar = Column(String(1024), nullable=True)
-    created_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    # the listings paged by (created_at, id) set it in Python, see api.repository.pagination.paginate
+    created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
-    role = relationship("Role", backref="users")
+    # kept up to date by the repositories, see api.repository.counters
+    pictures_count = Column(Integer, nullable=False, default=0, server_default='0')
+    comments_count = Column(Integer, nullable=False, default=0, server_default='0')
+    ratings_received = Column(Integer, nullable=False, default=0, server_default='0')
+    role = relationship("Role", backref="users", lazy="joined")
 
 
 picture_m2m_tag = Table(
@@ -76,43 +86,64 @@ picture_m2m_tag = Table(
 
 class Tag(Base):
     __tablename__ = "tags"
+    # keyset pagination of the listings walks the (created_at, id) indexes
+    __table_args__ = (Index('ix_tags_created_at_id', 'created_at', 'id'),)
 
     id = Column(Integer, primary_key=True)
     name = Column(String(100), unique=True)
-    created_at = Column(DateTime, default=func.now())
+    created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
 
 
 class Picture(Base):
     __tablename__ = "pictures"
+    __table_args__ = (
+        Index('ix_pictures_created_at_id', 'created_at', 'id'),
+        Index('ix_pictures_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+        # "top rated" walks the index instead of sorting the pictures
+        Index('ix_pictures_avg_rating_id', 'avg_rating', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     picture_url = Column(String(1024))
     description = Column(String(10000))
     user_id = Column('user_id', Integer, ForeignKey('users.id', ondelete="CASCADE"))
     shared = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=func.now())
+    created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     update = Column(Boolean, default=False)
-    tags = relationship("Tag", secondary=picture_m2m_tag, backref="pictures")
+    # tags are part of every picture response, other relationships are loaded by the options of the query
+    tags = relationship("Tag", secondary=picture_m2m_tag, backref="pictures", lazy="selectin")
     user = relationship("User", backref="pictures")
 
-    @aggregated('rating', Column(Numeric))
-    def avg_rating(self):
-        return func.avg(Rating.rate)
-    
+    # kept up to date by the votes, see api.repository.rating.change_rating
+    rating_count = Column(Integer, nullable=False, default=0, server_default='0')
+    rating_sum = Column(Integer, nullable=False, default=0, server_default='0')
+    avg_rating = Column(Numeric, default=0)
+
     rating = relationship('Rating')
-   
+
+
+for statement in sqlite_fts_create():
+    event.listen(Picture.__table__, 'after_create', statement)
+event.listen(Picture.__table__, 'before_drop', sqlite_fts_drop())
+
 
 class TransformedPicture(Base):
     __tablename__ = 'transformed_pictures'
+    __table_args__ = (
+        Index('ix_transformed_pictures_picture_id_created_at_id', 'picture_id', 'created_at', 'id'),
+        Index('ix_transformed_pictures_picture_id_signature', 'picture_id', 'signature', unique=True),
+        UniqueConstraint('picture_id', 'url', name='pic_trans_url_uniq'),
+    )
     id = Column(Integer, primary_key=True)
     url = Column(String, nullable=False)
+    # sha256 of the canonical transformation, see transform_signature
+    signature = Column(String(64), nullable=True)
     picture_id = Column(Integer, ForeignKey(Picture.id, ondelete="CASCADE"), nullable=False)
-    created_at = Column(DateTime, default=func.now())
+    created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     picture = relationship('Picture', backref="transformed_pictures")
-    UniqueConstraint('picture_id', 'url', name='pic_trans_url_uniq')
 
 
 class Comment(Base):
@@ -134,12 +165,16 @@ class BlacklistToken(Base):
     __tablename__ = 'blacklist_tokens'
 
     id = Column(Integer, primary_key=True)
-    token = Column(String(500), unique=True, nullable=False, index=True)
-    blacklisted_on = Column(DateTime, default=func.now())
+    token_hash = Column(String(64), unique=True, nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    # time of the database, the workers sync by it, see TokenBlacklist.sync
+    blacklisted_on = Column(DateTime, default=func.now(), index=True)
 
 
 class Rating(Base):
     __tablename__ = 'rating'
+    # one vote of a user for a picture, create_rate relies on it under concurrency
+    __table_args__ = (Index('ix_rating_picture_id_user_id', 'picture_id', 'user_id', unique=True),)
 
     id = Column(Integer, primary_key=True)
     picture_id = Column('picture_id', ForeignKey(Picture.id, ondelete='CASCADE'), nullable=False)
@@ -148,3 +183,30 @@ class Rating(Base):
     created_at = Column(DateTime, default=func.now())
 
     user = relationship('User', backref="rating")
+
+
+class UploadJobStatus(enum.Enum):
+    queued: str = 'queued'
+    uploading: str = 'uploading'
+    saving: str = 'saving'
+    done: str = 'done'
+    failed: str = 'failed'
+
+
+class UploadJob(Base):
+    __tablename__ = 'upload_jobs'
+
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey(User.id, ondelete='CASCADE'), nullable=False)
+    status = Column(String(20), default=UploadJobStatus.queued.name, nullable=False)
+    picture_id = Column(Integer, ForeignKey(Picture.id, ondelete='SET NULL'), nullable=True)
+    error = Column(String(1024), nullable=True)
+    # parameters of the job, an unfinished job is queued again from them after a restart
+    description = Column(String(10000), nullable=True)
+    tags = Column(JSON, nullable=True)
+    shared = Column(Boolean, default=True)
+    spool_path = Column(String(1024), nullable=True)
+    # host:pid of the process which queued the job
+    worker = Column(String(255), nullable=True)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
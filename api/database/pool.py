@@ -0,0 +1,82 @@
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class PoolMetrics:
+    """
+    Live counters of the connection pool usage. Checkouts are counted by pool events for any pool class,
+    wait time is measured only by MeteredQueuePool because other pools never make a caller wait.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked_out = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def on_checkout(self, *args):
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+
+    def on_checkin(self, *args):
+        with self._lock:
+            self.checked_out -= 1
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.wait_time_total += seconds
+            self.wait_time_max = max(self.wait_time_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def bind(self, engine: AsyncEngine):
+        event.listen(engine.sync_engine, "checkout", self.on_checkout)
+        event.listen(engine.sync_engine, "checkin", self.on_checkin)
+
+    def snapshot(self, engine: AsyncEngine) -> dict:
+        """
+        The snapshot function collects the counters together with the current state of the engine's pool.
+
+        :param engine: AsyncEngine: The engine whose pool is described
+        :return: A dictionary suitable for PoolStatusResponse
+        """
+        pool = engine.pool
+        with self._lock:
+            status = {
+                "pool_class": type(pool).__name__,
+                "checked_out": self.checked_out,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_time_total": round(self.wait_time_total, 6),
+                "wait_time_max": round(self.wait_time_max, 6),
+                "wait_time_avg": round(self.wait_time_total / self.checkouts, 6) if self.checkouts else 0.0,
+            }
+        if isinstance(pool, QueuePool):
+            status.update(size=pool.size(), checked_in=pool.checkedin(), overflow=pool.overflow(),
+                          timeout=pool.timeout())
+        return status
+
+
+pool_metrics = PoolMetrics()
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that reports the time callers wait for a free connection to pool_metrics."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_metrics.record_wait(time.perf_counter() - started)
+        return connection
@@ -1,14 +1,17 @@
 from typing import Type
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import api.repository.pictures as pict_repo
+from api.repository.counters import change_user_counters
 from api.database.models import Comment, User
 from api.schemas.essential import CommentCreate, CommentBase
+from api.services.response_cache import PICTURES, picture_label, response_cache
 from datetime import datetime
 
 
-async def create_comment(db: Session, comment_data: CommentCreate, user: User):
+async def create_comment(db: AsyncSession, comment_data: CommentCreate, user: User):
     picture = await pict_repo.get_picture(comment_data.picture_id, db)
     if not picture:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -18,13 +21,15 @@ async def create_comment(db: Session, comment_data: CommentCreate, user: User):
                             detail="You are not allowed to leave comments!")
     comment = Comment(**comment_data.model_dump(), user_id=user.id)
     db.add(comment)
-    db.commit()
-    db.refresh(comment)
+    await db.execute(change_user_counters(user.id, comments=1))
+    await db.commit()
+    await response_cache.invalidate(PICTURES, picture_label(comment.picture_id))
+    await db.refresh(comment)
     return comment
 
 
-async def update_comment(db: Session, comment_data: CommentBase, comment_id: int, user: User):
-    comment = db.query(Comment).filter(Comment.id == comment_id).first()
+async def update_comment(db: AsyncSession, comment_data: CommentBase, comment_id: int, user: User):
+    comment = await db.scalar(select(Comment).filter(Comment.id == comment_id))
     if not comment:
         return None
     picture = await pict_repo.get_picture(comment.picture_id, db)
@@ -40,13 +45,14 @@ async def update_comment(db: Session, comment_data: CommentBase, comment_id: int
     comment.text = comment_data.text
     comment.edited = True
     comment.edited_at = datetime.now()
-    db.commit()
-    db.refresh(comment)
+    await db.commit()
+    await response_cache.invalidate(PICTURES, picture_label(comment.picture_id))
+    await db.refresh(comment)
     return comment
 
 
-async def delete_comment_by_id(db: Session, comment_id: int, user: User):
-    comment = db.query(Comment).filter(Comment.id == comment_id).first()
+async def delete_comment_by_id(db: AsyncSession, comment_id: int, user: User):
+    comment = await db.scalar(select(Comment).filter(Comment.id == comment_id))
     if not comment:
         return None
     if comment.user_id != user.id and not user.role.can_del_not_own_comment:
@@ -55,14 +61,17 @@ async def delete_comment_by_id(db: Session, comment_id: int, user: User):
     if not user.role.can_del_own_comment:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="You are not allowed to delete your comments!")
-    db.delete(comment)
-    db.commit()
+    await db.execute(change_user_counters(comment.user_id, comments=-1))
+    await db.delete(comment)
+    await db.commit()
+    await response_cache.invalidate(PICTURES, picture_label(comment.picture_id))
     return comment
 
 
-async def get_comment_by_id(db: Session, comment_id: int):
-    return db.query(Comment).filter(Comment.id == comment_id).first()
+async def get_comment_by_id(db: AsyncSession, comment_id: int):
+    return await db.scalar(select(Comment).filter(Comment.id == comment_id))
 
 
-async def get_comments_by_picture_id(db: Session, picture_id: int) -> list[Type[Comment]]:
-    return db.query(Comment).filter(Comment.picture_id == picture_id).all()
+async def get_comments_by_picture_id(db: AsyncSession, picture_id: int) -> list[Type[Comment]]:
+    comments = await db.scalars(select(Comment).filter(Comment.picture_id == picture_id))
+    return comments.all()
@@ -0,0 +1,90 @@
+"""
+Counters of the users kept in the users table: pictures_count, comments_count and ratings_received.
+
+They are changed in the transactions which create and delete the pictures, comments and votes,
+reconcile_user_counters recounts them if they drifted, e.g. after rows were changed by hand::
+
+    python -m api.repository.counters
+"""
+import asyncio
+
+from sqlalchemy import Update, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.database.db import SessionLocal
+from api.database.models import Comment, Picture, Rating, User
+
+
+def _pinned_timestamps() -> dict:
+    # a counter is not an edit of the user
+    return {'updated_at': User.updated_at}
+
+
+def change_user_counters(user_id, pictures: int = 0, comments: int = 0, ratings: int = 0) -> Update:
+    """
+    The change_user_counters function builds the update of the counters of a user.
+    The database adds the changes to the stored values, so concurrent requests do not overwrite each other.
+
+    :param user_id: Id of the user or a scalar subquery selecting it
+    :param pictures: int: Change of pictures_count
+    :param comments: int: Change of comments_count
+    :param ratings: int: Change of ratings_received
+    :return: The update statement
+    """
+    return (update(User).where(User.id == user_id)
+            .values(pictures_count=User.pictures_count + pictures, comments_count=User.comments_count + comments,
+                    ratings_received=User.ratings_received + ratings, **_pinned_timestamps())
+            .execution_options(synchronize_session=False))
+
+
+def picture_owner(picture_id: int):
+    return select(Picture.user_id).filter(Picture.id == picture_id).scalar_subquery()
+
+
+def remove_picture_counters(picture: Picture) -> list[Update]:
+    """
+    The remove_picture_counters function builds the updates of the counters for the removal of a picture:
+    the owner loses the picture and its votes, every commenter loses the comments on the picture.
+    They have to run before the comments and votes of the picture are deleted, see remove_picture.
+
+    :param picture: Picture: Removed picture
+    :return: The update statements
+    """
+    comments_on_picture = select(func.count(Comment.id)).filter(Comment.picture_id == picture.id,
+                                                                Comment.user_id == User.id).scalar_subquery()
+    return [
+        change_user_counters(picture.user_id, pictures=-1, ratings=-picture.rating_count),
+        update(User).where(User.id.in_(select(Comment.user_id).filter(Comment.picture_id == picture.id)))
+        .values(comments_count=User.comments_count - comments_on_picture, **_pinned_timestamps())
+        .execution_options(synchronize_session=False),
+    ]
+
+
+async def reconcile_user_counters(db: AsyncSession) -> int:
+    """
+    The reconcile_user_counters function recounts the counters of the users whose stored values differ
+    from the rows of their pictures, comments and received votes.
+
+    :param db: AsyncSession: Access the database
+    :return: Number of the fixed users
+    """
+    actual = {
+        'pictures_count': select(func.count(Picture.id)).filter(Picture.user_id == User.id).scalar_subquery(),
+        'comments_count': select(func.count(Comment.id)).filter(Comment.user_id == User.id).scalar_subquery(),
+        'ratings_received': select(func.count(Rating.id)).join(Picture, Picture.id == Rating.picture_id)
+        .filter(Picture.user_id == User.id).scalar_subquery(),
+    }
+    drifted = or_(*[getattr(User, name) != count for name, count in actual.items()])
+    result = await db.execute(update(User).where(drifted).values(**actual, **_pinned_timestamps())
+                              .execution_options(synchronize_session=False))
+    await db.commit()
+    return result.rowcount
+
+
+async def main():
+    async with SessionLocal() as db:
+        print(f"Counters of {await reconcile_user_counters(db)} users fixed")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, Response, status
+from sqlalchemy import Select, tuple_
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def encode_cursor(item) -> str:
+    """
+    The encode_cursor function makes an opaque cursor pointing after the given row of a listing.
+
+    :param item: Last row of the page, a model with created_at and id
+    :return: URL safe cursor string
+    """
+    position = json.dumps([item.created_at.isoformat(), item.id])
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """
+    The decode_cursor function returns the (created_at, id) position stored in the cursor.
+
+    :param cursor: str: Cursor received from the client
+    :return: created_at and id of the last row of the previous page
+    """
+    try:
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), int(item_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def paginate(query: Select, model, limit: int, offset: int = 0, cursor: str | None = None) -> Select:
+    """
+    The paginate function orders the listing from the newest rows and cuts one page of it.
+    With a cursor the page starts right after the cursor position, so the database walks the
+    (created_at, id) index from that point and a deep page costs the same as the first one.
+    Without a cursor the page is cut by offset.
+    The created_at of the paged models is set in Python, not by now() of the database: SQLite compares
+    the stored text, and CURRENT_TIMESTAMP has no fraction of a second while the bound cursor has one,
+    so the rows of the cursor's second would come back on every page.
+
+    :param query: Select: Query of the listing
+    :param model: Model of the listing rows
+    :param limit: int: Size of the page
+    :param offset: int: Number of rows to skip when there is no cursor
+    :param cursor: str | None: Cursor returned with the previous page
+    :return: Query of the page
+    """
+    query = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit)
+    if cursor:
+        return query.filter(tuple_(model.created_at, model.id) < tuple_(*decode_cursor(cursor)))
+    return query.offset(offset)
+
+
+def next_cursor(items: list, limit: int) -> str | None:
+    """
+    The next_cursor function returns the cursor of the page after the given one.
+    A page shorter than the limit is the last one and has no next cursor.
+
+    :param items: list: Rows of the page
+    :param limit: int: Size of the page
+    :return: Cursor of the next page or None
+    """
+    if items and len(items) == limit:
+        return encode_cursor(items[-1])
+    return None
+
+
+def set_next_cursor(response: Response, items: list, limit: int):
+    """
+    The set_next_cursor function passes the cursor of the next page to the client in the X-Next-Cursor header.
+
+    :param response: Response: Response of the listing
+    :param items: list: Rows of the page
+    :param limit: int: Size of the page
+    """
+    cursor = next_cursor(items, limit)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
@@ -1,15 +1,34 @@
 from typing import List, Type
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
 from fastapi import HTTPException, status
 
-from api.database.models import Picture, Tag, User
-from api.repository.tags import get_or_create_tag
+from api.database.models import Comment, Picture, Rating, Tag, TransformedPicture, User
+from api.repository.counters import change_user_counters, remove_picture_counters
+from api.repository.pagination import paginate
+from api.repository.tags import get_or_create_tags
 from api.schemas.essential import PictureCreate
 from api.services.cloud_picture import CloudImage
+from api.services.response_cache import PICTURES, TAGS, picture_label, response_cache, tag_label
 from api.conf.config import settings
 
 
-async def create_picture(description: str, tags: List[str], file_path: str, shared: bool, db: Session, user: User):
+# Loading profiles: the route chooses the relationships its response needs, each one is loaded
+# for the whole page by a single query. The options are built on call, because backrefs
+# (comments, transformed_pictures) exist only after the mappers are configured.
+def picture_comments_loading() -> tuple:
+    # relationships serialized by PictureResponseWithComments
+    return selectinload(Picture.comments),
+
+
+def picture_page_loading() -> tuple:
+    # relationships rendered by parts/pictures_list.html
+    return (joinedload(Picture.user), selectinload(Picture.comments).joinedload(Comment.user),
+            selectinload(Picture.transformed_pictures))
+
+
+async def create_picture(description: str, tags: List[str], file_path: str, shared: bool, db: AsyncSession, user: User):
     """
     The create_picture function creates a new picture in the database.
         Args:
@@ -21,7 +40,7 @@ async def create_picture(description: str, tags: List[str], file_path: str, shar
     :param tags: List[str]: Create a list of tags
     :param file_path: str: Store the file path of the picture in the database
     :param shared: bool: can or not sharing the picture
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param user: User: Get the user id from the database
     :return: The picture object
     """
@@ -32,26 +51,54 @@ async def create_picture(description: str, tags: List[str], file_path: str, shar
 
     picture = Picture(picture_url=file_path, description=description, tags=tags_list, shared=shared, user_id=user.id)
     db.add(picture)
-    db.commit()
-    db.refresh(picture)
+    await db.execute(change_user_counters(user.id, pictures=1))
+    await db.commit()
+    await response_cache.invalidate(PICTURES, TAGS, *[tag_label(tag.name) for tag in tags_list])
+    await db.refresh(picture)
 
     return picture
 
 
-def get_tag_by_name(tag_name: str, db: Session) -> Tag | None:
+async def create_pictures(pictures_data: List[dict], shared: bool, db: AsyncSession, user: User) -> List[Picture]:
+    """
+    The create_pictures function creates the pictures of a batch upload in one transaction.
+    The tags of all the pictures are resolved by one query.
+
+    :param pictures_data: List[dict]: picture_url, description and tags (list of names) of every picture
+    :param shared: bool: can or not sharing the pictures
+    :param db: AsyncSession: Access the database
+    :param user: User: Owner of the pictures
+    :return: The picture objects with their tags, in the order of pictures_data
+    """
+    tags = await get_or_create_tags([name for data in pictures_data for name in data['tags']], db)
+    pictures = [Picture(picture_url=data['picture_url'], description=data['description'], shared=shared,
+                        user_id=user.id, tags=[tags[name] for name in dict.fromkeys(data['tags'])])
+                for data in pictures_data]
+    db.add_all(pictures)
+    await db.execute(change_user_counters(user.id, pictures=len(pictures)))
+    await db.commit()
+    await response_cache.invalidate(PICTURES, TAGS, *[tag_label(name) for name in tags])
+    # server defaults (created_at) are loaded with the pictures
+    loaded = {picture.id: picture for picture in await db.scalars(
+        select(Picture).filter(Picture.id.in_([picture.id for picture in pictures]))
+        .execution_options(populate_existing=True))}
+    return [loaded[picture.id] for picture in pictures]
+
+
+async def get_tag_by_name(tag_name: str, db: AsyncSession) -> Tag | None:
     """
     The get_tag_by_name function takes a tag name and returns the corresponding Tag object from the database.
     If no such tag exists, it returns None.
 
     :param tag_name: str: Specify the name of the tag we want to retrieve from our database
-    :param db: Session: Pass in the database session
+    :param db: AsyncSession: Pass in the database session
     :return: The tag with the given name from the database
     """
-    tag = db.query(Tag).filter(Tag.name == tag_name).first()
+    tag = await db.scalar(select(Tag).filter(Tag.name == tag_name))
     return tag
 
 
-async def transformation_list_to_tag(tags: list, user: User, db: Session) -> List[Tag]:
+async def transformation_list_to_tag(tags: list, user: User, db: AsyncSession) -> List[Tag]:
     """
     The transformation_list_to_tag function takes a list of tags and a database session as input.
     It then creates the tag if it does not exist in the database, and returns a list of Tag objects.
@@ -59,65 +106,72 @@ async def transformation_list_to_tag(tags: list, user: User, db: Session) -> Lis
     :param tags: list: Pass in the list of tags that are associated with a particular post
     :param user: current user to check permissions
     :type user: User
-    :param db: Session
+    :param db: AsyncSession
     :return: A list of tags with type Tag
     """
 
     if not user.role.can_post_tag:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not allowed to add tags")
 
-    list_tags = []
-    if tags:
-        for tag_name in tags:
-            tag = await get_or_create_tag(tag_name.strip(), db)
-            list_tags.append(tag)
-    return list_tags
+    names = list(dict.fromkeys(tag_name.strip() for tag_name in tags or [] if tag_name.strip()))
+    tags_by_name = await get_or_create_tags(names, db)
+    return [tags_by_name[name] for name in names]
 
 
-async def get_picture(picture_id: int, db: Session) -> Picture | None:
+async def get_picture(picture_id: int, db: AsyncSession, options: tuple = ()) -> Picture | None:
     """
     The get_picture function takes in a picture_id, user and db.
     It then queries the database for a picture with the given id.
     If it finds one, it returns that picture.
 
     :param picture_id: int: Specify the id of the picture we want to get from the database
-    :param db: Session
+    :param db: AsyncSession
+    :param options: tuple: Loading profile of the relationships
     :return: A picture object if it exists, otherwise returns none
     """
-    picture = db.query(Picture).filter(Picture.id == picture_id).first()
+    picture = await db.scalar(select(Picture).filter(Picture.id == picture_id).options(*options))
 
     return picture
 
 
-async def get_user_pictures(user_id: int, db: Session, limit: int = 10, offset: int = 0) -> list[Type[Picture]]:
+async def get_user_pictures(user_id: int, db: AsyncSession, limit: int = 10, offset: int = 0,
+                            options: tuple = (), cursor: str | None = None) -> list[Type[Picture]]:
     """
-    The get_user_pictures function returns a list of pictures for the user with the given id.
+    The get_user_pictures function returns a list of pictures for the user with the given id, the newest first.
 
     :param user_id: int: Identify the user
-    :param db: Session: Pass in the database session
+    :param db: AsyncSession: Pass in the database session
     :param limit: int: Limit the number of pictures returned
-    :param offset: int: Specify the number of pictures to skip
+    :param offset: int: Specify the number of pictures to skip, used when there is no cursor
+    :param options: tuple: Loading profile of the relationships
+    :param cursor: str | None: Cursor of the page returned with the previous page
     :return: A list of picture objects
     """
-    pictures = db.query(Picture).filter(Picture.user_id == user_id).limit(limit).offset(offset).all()
-    return pictures
+    query = select(Picture).filter(Picture.user_id == user_id).options(*options)
+    pictures = await db.scalars(paginate(query, Picture, limit, offset, cursor))
+    return pictures.all()
 
 
-async def get_all_pictures(db: Session, limit: int = 10, offset: int = 0) -> list[Type[Picture]]:
+async def get_all_pictures(db: AsyncSession, limit: int = 10, offset: int = 0,
+                           options: tuple = (), cursor: str | None = None) -> list[Type[Picture]]:
     """
-    The get_all_pictures function returns a list of all pictures in the database which is allowed for sharing
+    The get_all_pictures function returns a list of all pictures in the database which is allowed for sharing,
+    the newest first
 
-    :param db: Session: Pass in the database session
+    :param db: AsyncSession: Pass in the database session
     :param limit: int: Limit the number of pictures returned
-    :param offset: int: Specify the number of records to skip before returning results
+    :param offset: int: Specify the number of records to skip before returning results, used when there is no cursor
+    :param options: tuple: Loading profile of the relationships
+    :param cursor: str | None: Cursor of the page returned with the previous page
     :return: A list of picture objects
     """
-    pictures = db.query(Picture).filter(Picture.shared.is_(True)).limit(limit).offset(offset).all()
+    query = select(Picture).filter(Picture.shared.is_(True)).options(*options)
+    pictures = await db.scalars(paginate(query, Picture, limit, offset, cursor))
 
-    return pictures
+    return pictures.all()
 
 
-async def remove_picture(picture_id: int, user: User, db: Session):
+async def remove_picture(picture_id: int, user: User, db: AsyncSession):
     """
     The remove_picture function removes a picture from the database.
         Args:
@@ -127,24 +181,31 @@ async def remove_picture(picture_id: int, user: User, db: Session):
 
     :param picture_id: int: Find the picture in the database
     :param user: User: Check if the user is authorized to delete the picture
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The removed picture
     """
-    picture = db.query(Picture).filter(Picture.id == picture_id).first()
+    picture = await db.scalar(select(Picture).filter(Picture.id == picture_id))
     if picture:
 
         if picture.user_id != user.id and not user.role.can_del_not_own_pict:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail="This picture belong's to another person. You are not allowed to remove it!")
         if picture.user_id == user.id:
-            public_id = picture.picture_url.split("/")[-1]
-            CloudImage.destroy(public_id)
-            db.delete(picture)
-            db.commit()
+            await CloudImage.destroy_async(picture.picture_url)
+            for statement in remove_picture_counters(picture):
+                await db.execute(statement)
+            # the ORM would set picture_id of the rows to NULL instead, the database cascade is not relied on
+            for model in (Comment, Rating, TransformedPicture):
+                await db.execute(delete(model).where(model.picture_id == picture.id)
+                                 .execution_options(synchronize_session=False))
+            await db.delete(picture)
+            await db.commit()
+            await response_cache.invalidate(PICTURES, picture_label(picture.id),
+                                            *[tag_label(tag.name) for tag in picture.tags])
             return picture
 
 
-async def update_picture(picture_id: int, body: PictureCreate, user: User, db: Session):
+async def update_picture(picture_id: int, body: PictureCreate, user: User, db: AsyncSession):
     """
     The update_picture function updates a picture from the database.
         Args:
@@ -155,15 +216,16 @@ async def update_picture(picture_id: int, body: PictureCreate, user: User, db: S
     :param picture_id: int: Find the picture in the database
     :param body: PictureCreate: data for updating
     :param user: User: Check if the user is authorized to delete the picture
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The removed picture
     """
-    picture = db.query(Picture).filter(Picture.id == picture_id and Picture.user_id == user.id).first()
+    picture = await db.scalar(select(Picture).filter(Picture.id == picture_id and Picture.user_id == user.id))
     if picture:
         if picture.user_id != user.id and not user.role.can_mod_not_own_pict:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail="This picture belong's to another person. You are not allowed to update it!")
 
+        old_tag_names = [t.name for t in picture.tags]
         if body.tags is None:
             picture.tags = []
         elif body.tags:
@@ -178,17 +240,21 @@ async def update_picture(picture_id: int, body: PictureCreate, user: User, db: S
         picture.description = body.description
         picture.update = True
         picture.shared = body.shared
-        db.commit()
-        db.refresh(picture)
+        await db.commit()
+        await response_cache.invalidate(PICTURES, picture_label(picture.id),
+                                        *[tag_label(name) for name in old_tag_names + [t.name for t in picture.tags]])
+        await db.refresh(picture)
         return picture
 
 
-async def get_picture_by_tag(tag_name: str, db: Session) -> list[Type[Picture]]:
+async def get_picture_by_tag(tag_name: str, db: AsyncSession, options: tuple = ()) -> list[Type[Picture]]:
     """
     The get_picture_by_tag returns a list of pictures for tag with name tag_name
 
     :param tag_name: str: Specify the tag name to search for
-    :param db: Session: Pass in the database session
+    :param db: AsyncSession: Pass in the database session
+    :param options: tuple: Loading profile of the relationships
     :return: A list of picture objects
     """
-    return db.query(Picture).join(Picture.tags).filter(Tag.name == tag_name).all()
+    pictures = await db.scalars(select(Picture).join(Picture.tags).filter(Tag.name == tag_name).options(*options))
+    return pictures.all()
@@ -1,63 +1,123 @@
 from typing import Type
 
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import and_, select, update, case, literal, Integer, Select, Update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
 from api.database.models import Rating, User, Picture, RoleNames
+from api.repository.counters import change_user_counters, picture_owner
 
 
-async def create_rate(picture_id: int, rate: int, db: Session, user: User) -> Rating:
-   
-    self_picture = db.query(Picture).filter(and_(Picture.id == picture_id, Picture.user_id == user.id)).first()
-    already_voted = db.query(Rating).filter(and_(Rating.picture_id == picture_id, Rating.user_id == user.id)).first()
-    picture_exists = db.query(Picture).filter(Picture.id == picture_id).first()
-    if self_picture:
-        raise HTTPException(status_code=status.HTTP_423_LOCKED, detail='You cannot vote on your own picture')
-    elif already_voted:
+def change_rating(picture_id: int, count: int, rate: int) -> Update:
+    """
+    The change_rating function builds the update of the rating aggregates of a picture.
+    The new values are computed by the database from the stored ones, so concurrent votes do not
+    overwrite each other and a vote costs one row update whatever the number of votes of the picture.
+
+    :param picture_id: int: Voted picture
+    :param count: int: Change of the number of votes: 1, 0 or -1
+    :param rate: int: Change of the sum of the votes
+    :return: The update statement
+    """
+    rating_count = Picture.rating_count + count
+    rating_sum = Picture.rating_sum + rate
+    return (update(Picture).where(Picture.id == picture_id)
+            .values(rating_count=rating_count, rating_sum=rating_sum,
+                    avg_rating=case((rating_count > 0, rating_sum * 1.0 / rating_count), else_=0),
+                    # a vote is not an edit of the picture
+                    updated_at=Picture.updated_at)
+            .execution_options(synchronize_session=False))
+
+
+def locked_rate(rate_id: int) -> Select:
+    """
+    The locked_rate function builds the select of a vote for its edit or removal. The row is locked
+    until the commit, so a concurrent edit or removal of the vote waits and then reads the committed rate,
+    the change of the rating aggregates is computed from the rate which is replaced.
+    SQLite has no row locks, it lets only one transaction write and fails the other one.
+
+    :param rate_id: int: Id of the vote
+    :return: The select statement
+    """
+    return select(Rating).filter(Rating.id == rate_id).with_for_update().execution_options(populate_existing=True)
+
+
+async def create_rate(picture_id: int, rate: int, db: AsyncSession, user: User) -> Rating | None:
+    """
+    The create_rate function saves the vote of the user by one INSERT ... SELECT: the row is selected only
+    if the picture exists and belongs to another user, and ON CONFLICT of the unique (picture_id, user_id)
+    index skips a second vote, also when two votes of the user come at the same time.
+    Only a rejected vote reads the picture to tell which rule rejected it.
+
+    :param picture_id: int: Voted picture
+    :param rate: int: Rate in the range of one to five
+    :param db: AsyncSession: Access the database
+    :param user: User: Voting user
+    :return: The new rating or None if there is no such picture
+    """
+    insert = postgresql_insert if db.bind.dialect.name == 'postgresql' else sqlite_insert
+    vote = (select(Picture.id, literal(rate, Integer), literal(user.id, Integer))
+            .filter(and_(Picture.id == picture_id, Picture.user_id.is_distinct_from(user.id))))
+    new_rate = await db.scalar(insert(Rating).from_select(['picture_id', 'rate', 'user_id'], vote)
+                               .on_conflict_do_nothing(index_elements=['picture_id', 'user_id']).returning(Rating))
+    if new_rate is None:
+        owner = (await db.execute(select(Picture.user_id).filter(Picture.id == picture_id))).first()
+        if owner is None:
+            return None
+        if owner.user_id == user.id:
+            raise HTTPException(status_code=status.HTTP_423_LOCKED, detail='You cannot vote on your own picture')
         raise HTTPException(status_code=status.HTTP_423_LOCKED, detail='Sorry, you have already voted')
-    elif picture_exists:
-        new_rate = Rating(picture_id=picture_id, rate=rate, user_id=user.id)
-        db.add(new_rate)
-        db.commit()
-        db.refresh(new_rate)
-        return new_rate
+    await db.execute(change_rating(picture_id, 1, rate))
+    await db.execute(change_user_counters(picture_owner(picture_id), ratings=1))
+    await db.commit()
+    return new_rate
+
+
+def may_change_rate(rate: Rating, user: User) -> bool:
+    # a vote is changed by its author, administrators and moderators
+    return rate.user_id == user.id or user.role.name in (RoleNames.admin.name, RoleNames.moderator.name)
 
 
-async def edit_rate(rate_id: int, new_rate: int, db: Session, user: User) -> Type[Rating] | None:
+async def edit_rate(rate_id: int, new_rate: int, db: AsyncSession, user: User) -> Type[Rating] | None:
     
-    rate = db.query(Rating).filter(Rating.id == rate_id).first()
-    if user.role in [RoleNames.admin, RoleNames.moderator] or rate.user_id == user.id:
-        if rate:
-            rate.rate = new_rate
-            db.commit()
+    rate = await db.scalar(locked_rate(rate_id))
+    if rate is None or not may_change_rate(rate, user):
+        return None
+    await db.execute(change_rating(rate.picture_id, 0, new_rate - rate.rate))
+    rate.rate = new_rate
+    await db.commit()
     return rate
 
 
-async def delete_rate(rate_id: int, db: Session, user: User) -> Type[Rating]:
+async def delete_rate(rate_id: int, db: AsyncSession, user: User) -> Type[Rating] | None:
    
-    rate = db.query(Rating).filter(Rating.id == rate_id).first()
-    if rate:
-        db.delete(rate)
-        db.commit()
+    rate = await db.scalar(locked_rate(rate_id))
+    if rate is None or not may_change_rate(rate, user):
+        return None
+    await db.execute(change_rating(rate.picture_id, -1, -rate.rate))
+    await db.execute(change_user_counters(picture_owner(rate.picture_id), ratings=-1))
+    await db.delete(rate)
+    await db.commit()
     return rate
 
 
-async def get_all_ratings(db: Session, user: User) -> list[Type[Rating]]:
+async def get_all_ratings(db: AsyncSession, user: User) -> list[Type[Rating]]:
     
-    all_ratings = db.query(Rating).all()
-    return all_ratings
+    all_ratings = await db.scalars(select(Rating))
+    return all_ratings.all()
 
 
-async def get_my_rating(db: Session, user: User) -> list[Type[Rating]]:
+async def get_my_rating(db: AsyncSession, user: User) -> list[Type[Rating]]:
    
-    my_rating = db.query(Rating).filter(Rating.user_id == user.id).all()
-    return my_rating
+    my_rating = await db.scalars(select(Rating).filter(Rating.user_id == user.id))
+    return my_rating.all()
 
 
-async def get_user_rate_picture(user_id: int, picture_id: int, db: Session, user: User) -> Type[Rating] | None:
+async def get_user_rate_picture(user_id: int, picture_id: int, db: AsyncSession, user: User) -> Type[Rating] | None:
     
-    user_rate_picture = db.query(Rating)\
-        .filter(and_(Rating.picture_id == picture_id, Rating.user_id == user_id)).first()
+    user_rate_picture = await db.scalar(select(Rating)
+                                        .filter(and_(Rating.picture_id == picture_id, Rating.user_id == user_id)))
     return user_rate_picture
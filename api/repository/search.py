@@ -1,24 +1,136 @@
+import re
 from datetime import datetime, timedelta
 from typing import Type, Any
 
-from sqlalchemy import or_, and_, Row
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, and_, Row, select, Select, func, literal, literal_column, table, column, event, inspect
+from sqlalchemy import union_all
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from api.database.models import Picture, User, Tag
+from api.database.fulltext import FTS_CONFIG, POSTGRES_SEARCH_VECTOR, SQLITE_FTS_TABLE
+from api.database.models import Picture, User, Tag, picture_m2m_tag
+from api.services.trigram_index import TrigramIndex
 
+user_trigram_index = TrigramIndex()
 
-async def search_pictures_by_query(db: Session, search_query: str = None,
-                                   rating: int = None, date_added: str = None) -> list[Type[Picture]]:
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_delete')
+def _invalidate_user_trigram_index(mapper, connection, target):
+    user_trigram_index.invalidate()
+
+
+@event.listens_for(User, 'after_update')
+def _invalidate_user_trigram_index_on_rename(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.username.history.has_changes() or state.attrs.email.history.has_changes():
+        user_trigram_index.invalidate()
+
+
+async def user_candidates(db: AsyncSession, search_query: str) -> set[int] | None:
+    """
+    The user_candidates function narrows the substring search of users down with the in-memory trigram index.
+    The index is rebuilt when the users table has changed since it was built.
+
+    :param db: AsyncSession: Access the database
+    :param search_query: str: Searched substring
+    :return: Ids of the users which may match or None if the query is too short for the index
+    """
+    signature = tuple((await db.execute(select(func.count(User.id), func.max(User.id),
+                                               func.max(User.updated_at)))).one())
+    if signature != user_trigram_index.signature:
+        rows = await db.execute(select(User.id, User.username, User.email))
+        user_trigram_index.rebuild(rows.all(), signature)
+    return user_trigram_index.candidates(search_query)
+
+
+async def match_users(query: Select, search_query: str, columns: list, db: AsyncSession) -> Select:
+    """
+    The match_users function filters the query by the substring of the user columns.
+    Postgres serves the ILIKE through the pg_trgm GIN indexes of the columns,
+    SQLite checks only the candidates found by the in-memory trigram index.
+
+    :param query: Select: Query joined with the users
+    :param search_query: str: Searched substring
+    :param columns: list: User columns to search in
+    :param db: AsyncSession: Access the database
+    :return: The filtered query
+    """
+    pattern = "%" + re.sub(r"([\\%_])", r"\\\1", search_query) + "%"
+    query = query.filter(or_(*[user_column.ilike(pattern, escape="\\") for user_column in columns]))
+    if db.bind.dialect.name == 'sqlite':
+        candidates = await user_candidates(db, search_query)
+        if candidates is not None:
+            query = query.filter(User.id.in_(candidates))
+    return query
+
+
+def search_terms(search_query: str) -> list[str]:
+    """
+    The search_terms function splits the search query into words, dropping punctuation and operators,
+    so the query can be passed to the full-text search of any database safely.
+
+    :param search_query: str: Query typed by the user
+    :return: Lowercase words of the query
+    """
+    return re.findall(r'[^\W_]+', search_query.lower())
+
+
+def match_description(query: Select, terms: list[str], dialect: str) -> tuple[Select, Any]:
+    """
+    The match_description function filters the pictures by the full-text index of their descriptions:
+    every term has to match the beginning of a word of the description.
+    Postgres uses the GIN indexed tsvector column, SQLite uses the FTS5 table,
+    other databases fall back to scanning the descriptions.
+
+    :param query: Select: Query of pictures
+    :param terms: list[str]: Words returned by search_terms
+    :param dialect: str: Name of the database dialect
+    :return: The filtered query and the ordering of the pictures by relevance
+    """
+    if dialect == 'postgresql':
+        vector = literal_column(f'pictures.{POSTGRES_SEARCH_VECTOR}')
+        ts_query = func.to_tsquery(FTS_CONFIG, ' & '.join(f'{term}:*' for term in terms))
+        return query.filter(vector.op('@@')(ts_query)), func.ts_rank_cd(vector, ts_query).desc()
+    if dialect == 'sqlite':
+        fts = table(SQLITE_FTS_TABLE, column('rowid'))
+        match = ' '.join(f'"{term}"*' for term in terms)
+        query = query.join(fts, fts.c.rowid == Picture.id).filter(literal_column(SQLITE_FTS_TABLE).op('MATCH')(match))
+        return query, func.bm25(literal_column(SQLITE_FTS_TABLE))
+    return query.filter(and_(*[Picture.description.ilike(f"%{term}%") for term in terms])), Picture.created_at.desc()
+
+
+async def search_pictures_by_query(db: AsyncSession, search_query: str = None, rating: int = None,
+                                   date_added: str = None, limit: int | None = None,
+                                   offset: int = 0) -> list[Type[Picture]]:
+    """
+    The search_pictures_by_query function finds the pictures by the full-text index of their descriptions,
+    the minimal rating and the day they were added. The most relevant pictures go first,
+    without the words the newest ones do.
+
+    :param db: AsyncSession: Access the database
+    :param search_query: str: Words to search for
+    :param rating: int: Minimal average rating
+    :param date_added: str: Day the pictures were added, YYYY-MM-DD
+    :param limit: int | None: Size of the page
+    :param offset: int: Number of the pictures to skip
+    :return: A page of the found pictures
+    """
     # Починаємо з базового запиту, що вибирає всі світлини
-    query = db.query(Picture)
+    query = select(Picture)
 
-    # Пошук за ключовим словом
+    # Повнотекстовий пошук за ключовими словами
     if search_query:
-        query = query.filter(or_(Picture.description.ilike(f"%{search_query}%")))
+        terms = search_terms(search_query)
+        if not terms:
+            return []
+        query, relevance = match_description(query, terms, db.bind.dialect.name)
+        query = query.order_by(relevance, Picture.id.desc())
+    else:
+        query = query.order_by(Picture.created_at.desc(), Picture.id.desc())
 
     # Фільтрація за рейтингом
     if rating is not None:
-        query = query.filter(Picture.rating >= rating)
+        query = query.filter(Picture.avg_rating >= rating)
 
     # Фільтрація за датою додавання
     if date_added:
@@ -30,21 +142,22 @@ async def search_pictures_by_query(db: Session, search_query: str = None,
             pass
 
     # Виконуємо запит та повертаємо результат
-    return query.all()
+    result = await db.scalars(query.limit(limit).offset(offset))
+    return result.all()
 
 
 # def search_by_tag(db, search_query):
 #     return db.query(Picture).filter(Picture.tags.any(text(search_query)))
 
 
-async def search_by_tag(db: Session, tag_name: str,
-                        rating: int = None, date_added: str = None) -> list[Type[Picture]]:
+async def search_by_tag(db: AsyncSession, tag_name: str,
+                        rating: int = None, date_added: str = None, options: tuple = ()) -> list[Type[Picture]]:
     # Починаємо з базового запиту, що вибирає всі світлини з вказаним тегом
-    query = db.query(Picture).join(Picture.tags).filter(Tag.name == tag_name)
+    query = select(Picture).join(Picture.tags).filter(Tag.name == tag_name).options(*options)
 
     # Фільтрація за рейтингом
     if rating is not None:
-        query = query.filter(Picture.rating >= rating)
+        query = query.filter(Picture.avg_rating >= rating)
 
     # Фільтрація за датою додавання
     if date_added:
@@ -56,18 +169,21 @@ async def search_by_tag(db: Session, tag_name: str,
             pass
 
     # Виконуємо запит та повертаємо результат
-    return query.all()
+    result = await db.scalars(query)
+    return result.all()
 
 
-async def search_users(db: Session, search_query: str = None,
+async def search_users(db: AsyncSession, search_query: str = None,
                        date_added: str = None) -> list[Type[User]]:
     # Починаємо з базового запиту, що вибирає всіх користувачів
-    query = db.query(User)
+    query = select(User)
 
     # Пошук за іменем або електронною поштою
     if search_query:
-        query = query.filter(or_(User.username.ilike(f"%{search_query}%"),
-                                 User.email.ilike(f"%{search_query}%")))
+        query = await match_users(query, search_query, [User.username, User.email], db)
+        if db.bind.dialect.name == 'postgresql':
+            query = query.order_by(func.greatest(func.similarity(User.username, search_query),
+                                                 func.similarity(User.email, search_query)).desc())
 
     # Фільтрація за датою додавання - за атрибутом `created_at`
     if date_added:
@@ -79,15 +195,83 @@ async def search_users(db: Session, search_query: str = None,
             pass
 
     # Виконуємо запит та повертаємо результат
-    return query.all()
+    result = await db.scalars(query)
+    return result.all()
+
 
+async def search_by_description(db: AsyncSession, search_query: str, order_by=None, options: tuple = (),
+                                limit: int | None = None, offset: int = 0) -> list[Type[Picture]]:
+    """
+    The search_by_description function finds the pictures by the full-text index of their descriptions.
 
-def search_by_description(db, search_query):
-    return db.query(Picture).filter(Picture.description.ilike(f"%{search_query}%"))
+    :param db: AsyncSession: Access the database
+    :param search_query: str: Words to search for
+    :param order_by: Ordering of the results, the most relevant pictures go first by default
+    :param options: tuple: Loading profile of the relationships
+    :param limit: int | None: Size of the page
+    :param offset: int: Number of the pictures to skip
+    :return: A page of the found pictures
+    """
+    terms = search_terms(search_query)
+    if not terms:
+        return []
+    query, relevance = match_description(select(Picture).options(*options), terms, db.bind.dialect.name)
+    query = query.order_by(relevance if order_by is None else order_by, Picture.id.desc())
+    pictures = await db.scalars(query.limit(limit).offset(offset))
+    return pictures.all()
 
 
-def search_pictures_by_user(db: Session, user_query: str):
+async def search_pictures_by_user(db: AsyncSession, user_query: str, options: tuple = ()):
     # Ваша логіка пошуку зображень за вказаними користувачами
     # result = db.query(Picture).join(User).filter(User.username.ilike(f"%{user_query}%")).all()
     # pictures = db.query(Picture)
-    return db.query(Picture).join(User).filter(User.username.ilike(f"%{user_query}%")).all()
+    query = await match_users(select(Picture).join(User).options(*options), user_query, [User.username], db)
+    pictures = await db.scalars(query)
+    return pictures.all()
+
+
+# вага збігу з кожним джерелом пошуку
+TAG_MATCH_SCORE = 3
+USER_MATCH_SCORE = 2
+DESCRIPTION_MATCH_SCORE = 1
+
+
+async def search_pictures(db: AsyncSession, search_query: str, limit: int, offset: int = 0, user: User = None,
+                          options: tuple = ()) -> list[Type[Picture]]:
+    """
+    The search_pictures function searches the pictures by tag, author name and description in one query.
+    Every source gives its matches a score, the database sums the scores of each picture,
+    so a picture found by several sources appears once and higher in the list.
+    Only the requested page of pictures is loaded.
+
+    :param db: AsyncSession: Access the database
+    :param search_query: str: Tag name, part of the author name or words of the description
+    :param limit: int: Size of the page
+    :param offset: int: Number of the pictures to skip
+    :param user: User: Current user, whose not shared pictures are searched too
+    :param options: tuple: Loading profile of the relationships
+    :return: A page of the found pictures
+    """
+    sources = [
+        select(picture_m2m_tag.c.picture_id, literal(TAG_MATCH_SCORE).label('score'))
+        .join(Tag, Tag.id == picture_m2m_tag.c.tag_id).filter(Tag.name == search_query),
+        await match_users(select(Picture.id.label('picture_id'), literal(USER_MATCH_SCORE).label('score'))
+                          .join(User), search_query, [User.username], db),
+    ]
+    terms = search_terms(search_query)
+    if terms:
+        description_matches, _ = match_description(
+            select(Picture.id.label('picture_id'), literal(DESCRIPTION_MATCH_SCORE).label('score')),
+            terms, db.bind.dialect.name)
+        sources.append(description_matches)
+
+    matches = union_all(*sources).subquery()
+    scores = (select(matches.c.picture_id, func.sum(matches.c.score).label('score'))
+              .group_by(matches.c.picture_id).subquery())
+    visible = Picture.shared.is_(True)
+    if user is not None:
+        visible = or_(visible, Picture.user_id == user.id)
+    query = (select(Picture).join(scores, scores.c.picture_id == Picture.id).filter(visible).options(*options)
+             .order_by(scores.c.score.desc(), Picture.id.desc()).limit(limit).offset(offset))
+    pictures = await db.scalars(query)
+    return pictures.all()
@@ -1,32 +1,45 @@
 from typing import Type, List
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
 from fastapi import HTTPException
 
 from api.conf.config import settings
-from api.database.models import Tag, Picture
+from api.database.models import Tag, Picture, picture_m2m_tag
+from api.repository.pagination import paginate
 from api.schemas.essential import TagModel
+from api.services.response_cache import PICTURES, TAGS, picture_label, response_cache, tag_label
 
 
-async def get_or_create_tag(tag_name: str, db: Session):
+async def get_or_create_tags(tag_names: List[str], db: AsyncSession) -> dict[str, Tag]:
     """
-    Creates a new tag if it doesn't exist.
+    The get_or_create_tags function finds the existing tags by one IN query and inserts the missing ones by one
+    INSERT ... ON CONFLICT DO NOTHING RETURNING, so a tag created meanwhile by another request is not an error.
+    The changes are not committed.
 
-    :param tag_name: str: Specify the name of the tag to be created
-    :param db: Session: Pass in the database session
-    :return: The new tag object, or the existing tag object if it already exists
+    :param tag_names: List[str]: Names of the tags, repeated names are allowed
+    :param db: AsyncSession: Pass in the database session
+    :return: The tags by their names
     """
-    existing_tag = db.query(Tag).filter(Tag.name == tag_name).first()
-    if existing_tag is None:
-        new_tag = Tag(name=tag_name)
-        db.add(new_tag)
-        db.commit()
-        db.refresh(new_tag)
-        return new_tag
-    else:
-        return existing_tag
+    names = list(dict.fromkeys(name for name in tag_names if name))
+    if not names:
+        return {}
+    tags = {tag.name: tag for tag in await db.scalars(select(Tag).filter(Tag.name.in_(names)))}
+    missing = [name for name in names if name not in tags]
+    if missing:
+        insert = postgresql_insert if db.bind.dialect.name == 'postgresql' else sqlite_insert
+        inserted = await db.scalars(insert(Tag).values([{'name': name} for name in missing])
+                                    .on_conflict_do_nothing(index_elements=['name']).returning(Tag))
+        tags.update((tag.name, tag) for tag in inserted)
+        # the names skipped by the conflict were inserted by another transaction
+        skipped = [name for name in missing if name not in tags]
+        if skipped:
+            tags.update((tag.name, tag) for tag in await db.scalars(select(Tag).filter(Tag.name.in_(skipped))))
+    return tags
 
 
 def process_tags(tags: List[str]) -> List[str]:
@@ -39,92 +52,85 @@ def process_tags(tags: List[str]) -> List[str]:
     return processed_tags
 
 
-async def get_all_tags(db: Session, skip: int = 0, limit: int = 100):
-    tags = db.query(Tag).offset(skip).limit(limit).all()
-    
-    return tags
+async def get_all_tags(db: AsyncSession, skip: int = 0, limit: int = 100, cursor: str | None = None):
+    tags = await db.scalars(paginate(select(Tag), Tag, limit, skip, cursor))
 
+    return tags.all()
 
-async def get_tag(tag_id: int, db: Session) -> Type[Tag] | None:
+
+async def get_tag(tag_id: int, db: AsyncSession) -> Type[Tag] | None:
     """
     The get_tag function takes in a tag_id and db Session object,
     and returns the Tag object with that id. If no such tag exists,
     it returns None.
 
     :param tag_id: int: Specify the id of the tag to be returned
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A tag object
     """
-    return db.query(Tag).filter(Tag.id == tag_id).first()
-
+    return await db.scalar(select(Tag).filter(Tag.id == tag_id))
 
-async def add_tags_to_picture(picture_id: int, tags: List[str], db: Session):
-    # Start a transaction
-    transaction = db.begin()
 
-    picture = db.query(Picture).get(picture_id)
+async def add_tags_to_picture(picture_id: int, tags: List[str], db: AsyncSession):
+    picture = await db.get(Picture, picture_id)
 
     if not picture:
         raise HTTPException(status_code=404, detail="Picture not found")
 
     processed_tags = process_tags(tags)
 
-    new_tags = []
-
-    for tag_name in processed_tags:
-        tag = db.query(Tag).filter(Tag.name == tag_name).first()
-        if not tag:
-            tag = Tag(name=tag_name)
-            db.add(tag)
-            try:
-                db.flush()  # Just add to the transaction, don't commit yet
-            except IntegrityError:
-                db.rollback()
-                tag = db.query(Tag).filter(Tag.name == tag_name).first()
-            db.refresh(tag)
-        new_tags.append(tag)
+    tags_by_name = await get_or_create_tags(processed_tags, db)
+    new_tags = [tags_by_name[name] for name in dict.fromkeys(processed_tags) if name]
 
     if len(picture.tags) + len(new_tags) > settings.max_tags:
-        transaction.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=f"Too many tags. Only {settings.max_tags} tags allowed.")
 
     picture.tags.extend(new_tags)
     try:
-        transaction.commit()
+        await db.commit()
     except IntegrityError:
         raise HTTPException(status_code=400, detail="Tag already exists.")
+    await response_cache.invalidate(PICTURES, TAGS, picture_label(picture.id),
+                                    *[tag_label(tag.name) for tag in new_tags])
 
     return picture
 
 
-async def delete_tag_from_picture(picture_id: int, tag_id: int, db: Session):
-    picture = db.query(Picture).get(picture_id)
+async def delete_tag_from_picture(picture_id: int, tag_id: int, db: AsyncSession):
+    picture = await db.get(Picture, picture_id)
 
     if not picture:
         raise HTTPException(status_code=404, detail="Picture not found")
 
-    tag = db.query(Tag).get(tag_id)
+    tag = await db.get(Tag, tag_id)
     if not tag:
         raise HTTPException(status_code=404, detail="Tag not found")
 
     if tag in picture.tags:
         picture.tags.remove(tag)
-        db.commit()
-        db.refresh(picture)
+        await db.commit()
+        await response_cache.invalidate(PICTURES, picture_label(picture.id), tag_label(tag.name))
+        await db.refresh(picture)
 
         return picture
     else:
         raise HTTPException(status_code=404, detail="The picture does not have such tag.")
 
 
-async def edit_tag(tag_id: int, tag_update: TagModel, db: Session):
-    tag = db.query(Tag).get(tag_id)
+async def edit_tag(tag_id: int, tag_update: TagModel, db: AsyncSession):
+    tag = await db.get(Tag, tag_id)
     if not tag:
         raise HTTPException(status_code=404, detail="Tag not found")
 
+    old_name = tag.name
+    picture_ids = (await db.scalars(select(picture_m2m_tag.c.picture_id)
+                                    .filter(picture_m2m_tag.c.tag_id == tag.id))).all()
     tag.name = tag_update.name
-    db.commit()
-    db.refresh(tag)
+    await db.commit()
+    await response_cache.invalidate(PICTURES, TAGS, tag_label(old_name), tag_label(tag.name),
+                                    *[picture_label(picture_id) for picture_id in picture_ids])
+    await db.refresh(tag)
 
     return tag
 
@@ -1,53 +1,76 @@
 from typing import List, Type
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, exc
+from sqlalchemy import and_, exc, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from api.database.models import Picture, TransformedPicture, User
+from api.repository.pagination import paginate
 
 
-async def get_picture_for_transformation(pict_id: int, user: User, db: Session) -> str | None:
+async def get_picture_for_transformation(pict_id: int, user: User, db: AsyncSession) -> str | None:
     # TODO roles
 
-    picture = db.query(Picture).filter(and_(Picture.id == pict_id, Picture.user_id == user.id)).first()
+    picture = await db.scalar(select(Picture).filter(and_(Picture.id == pict_id, Picture.user_id == user.id)))
     picture_path = None
     if picture:
         picture_path = picture.picture_url
     return picture_path
 
 
-async def set_transform_picture(picture_id: int, modify_url: str, user: User, db: Session) -> TransformedPicture | None:
+async def get_transform_by_signature(picture_id: int, signature: str, user: User,
+                                     db: AsyncSession) -> TransformedPicture | None:
+    """
+    The get_transform_by_signature function returns the transformation of the user's picture
+    which was already made with the same steps, by one lookup of the picture_id and signature index.
+
+    :param picture_id: int: Id of the base picture
+    :param signature: str: Signature of the transformation, see transform_signature
+    :param user: User: Owner of the picture
+    :param db: AsyncSession: Access the database
+    :return: The transformed picture object or None
+    """
+    return await db.scalar(select(TransformedPicture).join(Picture).filter(
+        and_(TransformedPicture.picture_id == picture_id, TransformedPicture.signature == signature,
+             Picture.user_id == user.id)))
+
+
+async def set_transform_picture(picture_id: int, modify_url: str, user: User,
+                                db: AsyncSession, signature: str = None) -> TransformedPicture | None:
     """
     The set_transform_picture function queries the Picture in DB with the given picture_id and user.
-    If it finds one, it will create a new TransformedPicture object with url and id.
-    It will add this to the database and commit it. If there is an integrity error when we try to commit this change
-    to our database (i.e., if there already exists such an entry), we rollback these changes so as not
+    If it finds one, it will create a new TransformedPicture object with url, signature and id.
+    The same transformation is normally found by get_transform_by_signature before, so the integrity error
+    (i.e., the same transformation is saved by a concurrent request or was saved before signatures)
+    only happens in a race, then the changes are rolled back and the existing transformation is returned.
 
     :param picture_id: int: Specify the picture to be modified
     :param modify_url: str: Store the url of the transformed picture
     :param user: User: Check if the user is allowed to delete the picture
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
+    :param signature: str: Signature of the transformation, see transform_signature
     :return: A transformed picture object
 
     """
 
     # TODO roles
 
-    picture = db.query(Picture).filter(and_(Picture.id == picture_id, Picture.user_id == user.id)).first()
+    picture = await db.scalar(select(Picture).filter(and_(Picture.id == picture_id, Picture.user_id == user.id)))
     if picture:
-        image = TransformedPicture(url=modify_url, picture_id=picture.id)
+        image = TransformedPicture(url=modify_url, signature=signature, picture_id=picture.id)
         db.add(image)
         try:
-            db.commit()
+            await db.commit()
         except exc.IntegrityError:
-            db.rollback()
-            image = db.query(TransformedPicture) \
-                .filter(and_(TransformedPicture.picture_id == picture_id,
-                             TransformedPicture.url == modify_url)).first()
+            await db.rollback()
+            same = TransformedPicture.url == modify_url
+            if signature is not None:
+                same = or_(same, TransformedPicture.signature == signature)
+            image = await db.scalar(select(TransformedPicture)
+                                    .filter(and_(TransformedPicture.picture_id == picture_id, same)))
         else:
-            db.refresh(image)
+            await db.refresh(image)
         return image
 
 
-async def get_transform_picture(picture_id: int, current_user: User, db: Session) -> TransformedPicture | None:
+async def get_transform_picture(picture_id: int, current_user: User, db: AsyncSession) -> TransformedPicture | None:
     #
     # TODO roles - If the user is an admin, then it will return all transformations the picture with the id
     """
@@ -58,39 +81,61 @@ async def get_transform_picture(picture_id: int, current_user: User, db: Session
 
     :param picture_id: int: Get the picture id from the database
     :param current_user: User: Check if the user is an admin or not
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A picture from the database
     """
 
-    pict = db.query(TransformedPicture).join(Picture).filter(
-        and_(TransformedPicture.id == picture_id, Picture.user_id == current_user.id)).first()
+    pict = await db.scalar(select(TransformedPicture).join(Picture).filter(
+        and_(TransformedPicture.id == picture_id, Picture.user_id == current_user.id)))
 
     return pict
 
 
-async def remove_transformation(transformation_id: int, current_user: User, db: Session) -> TransformedPicture | None:
-    pict = db.query(TransformedPicture).join(Picture).filter(
-        and_(TransformedPicture.id == transformation_id, Picture.user_id == current_user.id)).first()
+async def get_visible_transform_picture(picture_id: int, current_user: User | None,
+                                        db: AsyncSession) -> tuple[str, bool] | None:
+    """
+    The get_visible_transform_picture function returns the URL of the transformed picture
+    if the base picture is shared or belongs to the current user.
+
+    :param picture_id: int: Id of the transformed picture
+    :param current_user: User | None: Logged in user or None for a guest
+    :param db: AsyncSession: Access the database
+    :return: URL of the transformed picture and the shared flag of the base picture
+    """
+    visible = Picture.shared.is_(True)
+    if current_user is not None:
+        visible = or_(visible, Picture.user_id == current_user.id)
+    row = (await db.execute(select(TransformedPicture.url, Picture.shared).join(Picture).filter(
+        and_(TransformedPicture.id == picture_id, visible)))).first()
+    return tuple(row) if row else None
+
+
+async def remove_transformation(transformation_id: int, current_user: User,
+                                db: AsyncSession) -> TransformedPicture | None:
+    pict = await db.scalar(select(TransformedPicture).join(Picture).filter(
+        and_(TransformedPicture.id == transformation_id, Picture.user_id == current_user.id)))
     if pict:
-        db.delete(pict)
-        db.commit()
+        await db.delete(pict)
+        await db.commit()
     return pict
 
 
-async def get_all_tr_pict(base_id: int, skip: int, limit: int, user: User, db: Session) -> List[Type[TransformedPicture]]:
+async def get_all_tr_pict(base_id: int, skip: int, limit: int, user: User,
+                          db: AsyncSession, cursor: str | None = None) -> List[Type[TransformedPicture]]:
     """
-    The get_all_tr_pict function returns a list of all transform pictures for the given picture id.
+    The get_all_tr_pict function returns a list of all transform pictures for the given picture id, the newest first.
 
     :param base_id: int: Get the picture id of the picture that was transformed
-    :param skip: int: Skip the first n number of items in a list
+    :param skip: int: Skip the first n number of items in a list, used when there is no cursor
     :param limit: int: Limit the number of images returned
     :param user: User: current user
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
+    :param cursor: str | None: Cursor of the page returned with the previous page
     :return: A list of all the transformations for the picture
     """
 
-    t_pictures = db.query(TransformedPicture)\
-        .filter(TransformedPicture.picture_id == base_id).offset(skip).limit(limit).all()
+    query = select(TransformedPicture).filter(TransformedPicture.picture_id == base_id)
+    t_pictures = await db.scalars(paginate(query, TransformedPicture, limit, skip, cursor))
 
-    return t_pictures
+    return t_pictures.all()
 
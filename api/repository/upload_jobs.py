@@ -0,0 +1,91 @@
+import uuid
+
+from sqlalchemy import select, and_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.database.models import UploadJob, UploadJobStatus, User
+
+
+async def create_upload_job(user: User, db: AsyncSession, description: str = None, tags: list[str] = None,
+                            shared: bool = True, spool_path: str = None, worker: str = None) -> UploadJob:
+    """
+    The create_upload_job function registers a new upload job of the user in the queued state.
+    The parameters of the job are kept with it, so the job can be queued again after a restart.
+
+    :param user: User: Owner of the uploaded picture
+    :param db: AsyncSession: Access the database
+    :param description: str: Description of the picture
+    :param tags: list[str]: Tag names of the picture
+    :param shared: bool: Indicate if the picture is shared or not
+    :param spool_path: str: Path of the spooled file
+    :param worker: str: host:pid of the process which queues the job
+    :return: The upload job object
+    """
+    job = UploadJob(id=uuid.uuid4().hex, user_id=user.id, status=UploadJobStatus.queued.name,
+                    description=description, tags=tags, shared=shared, spool_path=spool_path, worker=worker)
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+
+async def get_upload_job(job_id: str, user: User, db: AsyncSession) -> UploadJob | None:
+    """
+    The get_upload_job function returns the upload job with the given id if it belongs to the user.
+
+    :param job_id: str: Id of the job
+    :param user: User: Current user
+    :param db: AsyncSession: Access the database
+    :return: The upload job object or None
+    """
+    return await db.scalar(select(UploadJob).filter(and_(UploadJob.id == job_id, UploadJob.user_id == user.id)))
+
+
+async def set_upload_job_status(job_id: str, status: UploadJobStatus, db: AsyncSession,
+                                picture_id: int = None, error: str = None) -> UploadJob | None:
+    """
+    The set_upload_job_status function moves the upload job to the next stage of processing.
+
+    :param job_id: str: Id of the job
+    :param status: UploadJobStatus: New state of the job
+    :param db: AsyncSession: Access the database
+    :param picture_id: int: Id of the created picture when the job is done
+    :param error: str: Reason of the failure when the job is failed
+    :return: The upload job object
+    """
+    job = await db.get(UploadJob, job_id)
+    if job:
+        job.status = status.name
+        job.picture_id = picture_id
+        job.error = error[:1024] if error else None
+        await db.commit()
+    return job
+
+
+async def get_unfinished_upload_jobs(db: AsyncSession) -> list[UploadJob]:
+    """
+    The get_unfinished_upload_jobs function returns the jobs which are neither done nor failed.
+
+    :param db: AsyncSession: Access the database
+    :return: A list of upload jobs
+    """
+    finished = [UploadJobStatus.done.name, UploadJobStatus.failed.name]
+    jobs = await db.scalars(select(UploadJob).filter(UploadJob.status.not_in(finished)))
+    return jobs.all()
+
+
+async def claim_upload_job(job_id: str, worker: str | None, claimant: str, db: AsyncSession) -> bool:
+    """
+    The claim_upload_job function hands the upload job over to the claimant if it still belongs to the worker.
+    The check and the change are one UPDATE, so of several processes claiming the same job only one succeeds.
+
+    :param job_id: str: Id of the job
+    :param worker: str: host:pid of the process the job belongs to, as read before the claim
+    :param claimant: str: host:pid of the process which takes the job over
+    :param db: AsyncSession: Access the database
+    :return: True if the job is claimed
+    """
+    result = await db.execute(update(UploadJob).where(and_(UploadJob.id == job_id, UploadJob.worker == worker))
+                              .values(worker=claimant).execution_options(synchronize_session=False))
+    await db.commit()
+    return result.rowcount == 1
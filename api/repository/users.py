@@ -3,28 +3,33 @@ from typing import Type, List
 import uuid
 
 from fastapi import HTTPException, status
+from pydantic import BaseModel
 from libgravatar import Gravatar
 from slugify import slugify
-from sqlalchemy.orm import Session
+from sqlalchemy import Row, Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from api.database.models import User, BlacklistToken, RoleNames, Role, Picture, Comment
-from api.schemas.essential import UserModel, UserProfileModel, UserUpdate
+from api.database.models import User, BlacklistToken, RoleNames, Role
+from api.repository.pagination import paginate
+from api.schemas.essential import UserDbStatus, UserModel, UserProfileModel, UserUpdate
+from api.services.token_blacklist import to_datetime, token_blacklist, token_expiry, token_hash
 
 
-async def get_users_count(db: Session):
-    return len(db.query(User).limit(1).all())
+async def get_users_count(db: AsyncSession):
+    users = await db.scalars(select(User.id).limit(1))
+    return len(users.all())
 
 
-async def get_user_by_email(email: str, db: Session) -> Type[User]:
-    return db.query(User).filter(User.email == email).first()
+async def get_user_by_email(email: str, db: AsyncSession) -> Type[User]:
+    return await db.scalar(select(User).filter(User.email == email))
 
 
-async def user_exists(user_id: int, db: Session):
-    user = db.query(User).filter(User.id == user_id).first()
+async def user_exists(user_id: int, db: AsyncSession):
+    user = await db.scalar(select(User).filter(User.id == user_id))
     return bool(user)
 
 
-async def create_user(body: UserModel, db: Session):
+async def create_user(body: UserModel, db: AsyncSession):
     avatar = None
     try:
         g = Gravatar(body.email)
@@ -34,7 +39,7 @@ async def create_user(body: UserModel, db: Session):
 
     # first registered user is always admin
     default_role = RoleNames.user.name if await get_users_count(db) else RoleNames.admin.name
-    role = db.query(Role).filter(Role.name == default_role).first()
+    role = await db.scalar(select(Role).filter(Role.name == default_role))
     new_user = User(
         username=body.username,
         email=body.email,
@@ -46,35 +51,35 @@ async def create_user(body: UserModel, db: Session):
     new_user.slug = str(uuid.uuid4().hex)
 
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     new_user.slug = slugify(f"{body.username}-{new_user.id}")
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
 
     return new_user
 
 
-async def update_token(user: User, token: str | None, db: Session):
+async def update_token(user: User, token: str | None, db: AsyncSession):
     user.refresh_token = token
-    db.commit()
+    await db.commit()
 
 
-async def confirm_email(email: str, db: Session) -> None:
+async def confirm_email(email: str, db: AsyncSession) -> None:
     user = await get_user_by_email(email, db)
     user.confirmed = True
     user.is_active = True
-    db.commit()
+    await db.commit()
 
 
-async def update_avatar(email, url: str, db: Session) -> Type[User] | None:
+async def update_avatar(email, url: str, db: AsyncSession) -> Type[User] | None:
     user = await get_user_by_email(email, db)
     user.avatar = url
-    db.commit()
+    await db.commit()
     return user
 
 
-async def ban_user(email: str, current_user_id: int, db: Session, is_active=False) -> type[User]:
+async def ban_user(email: str, current_user_id: int, db: AsyncSession, is_active=False) -> type[User]:
     user = await get_user_by_email(email, db)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='User not found.')
@@ -83,64 +88,95 @@ async def ban_user(email: str, current_user_id: int, db: Session, is_active=Fals
 
     user.is_active = is_active
     user.updated_at = datetime.now()
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return user
 
 
-async def add_to_blacklist(token: str, db: Session) -> None:
-    blacklist_token = BlacklistToken(token=token, blacklisted_on=datetime.now())
+async def add_to_blacklist(token: str, db: AsyncSession) -> None:
+    blacklist_token = BlacklistToken(token_hash=token_hash(token), expires_at=to_datetime(token_expiry(token)))
     db.add(blacklist_token)
-    db.commit()
+    await db.commit()
+    # other workers get the token with the next sync of their blacklists
+    token_blacklist.add(token)
     
     
-async def find_blacklisted_token(token: str, db: Session) -> None:
-    blacklist_token = db.query(BlacklistToken).filter(BlacklistToken.token == token).first()
+async def find_blacklisted_token(token: str, db: AsyncSession) -> None:
+    blacklist_token = await db.scalar(select(BlacklistToken).filter(BlacklistToken.token_hash == token_hash(token)))
     return blacklist_token
     
     
-async def remove_from_blacklist(token: str, db: Session) -> None:
-    blacklist_token = db.query(BlacklistToken).filter(BlacklistToken.token == token).first()
-    db.delete(blacklist_token)
+async def remove_from_blacklist(token: str, db: AsyncSession) -> None:
+    blacklist_token = await db.scalar(select(BlacklistToken).filter(BlacklistToken.token_hash == token_hash(token)))
+    await db.delete(blacklist_token)
+    token_blacklist.discard(token)
 
 
-async def get_user_profile(slug: str, db: Session) -> User | None:
-    user = db.query(User).filter(User.slug == slug).first()  # slug or username  ??
+async def get_user_profile(slug: str, db: AsyncSession) -> User | None:
+    user = await db.scalar(select(User).filter(User.slug == slug))  # slug or username  ??
     user_profile = None
     if user:
-        picture_count = db.query(Picture).filter(Picture.user_id == user.id).count()
-        comment_count = db.query(Comment).filter(Comment.user_id == user.id).count()
-        picture_count = 0 if not picture_count else picture_count
         user_profile = UserProfileModel(
             id=user.id, username=user.username, email=user.email, created_at=user.created_at, is_active=user.is_active,
-            number_pictures=picture_count, number_comments=comment_count)
+            number_pictures=user.pictures_count, number_comments=user.comments_count)
     return user_profile
 
 
-async def get_all_users(limit: int, offset: int, user: User, db: Session) -> List[Type[User]]:
-    if not user.role != RoleNames.admin.name:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail="This action only for admin person. You don't have a permission!")
-
-    all_users = db.query(User).order_by(User.id).all()
-
-    if all_users:
-        return all_users
-
-
-async def update_user_self(body: UserModel, user: User, db: Session) -> User | None:
-
-    user = db.query(User).filter(User.id == user.id).first()
+def filter_users(query: Select, is_active: bool | None = None, confirmed: bool | None = None,
+                 role: str | None = None) -> Select:
+    """
+    The filter_users function narrows a listing of users down by their status and role, None means any.
+
+    :param query: Select: Query of the users
+    :param is_active: bool | None: Active or banned users
+    :param confirmed: bool | None: Users with or without a confirmed email
+    :param role: str | None: Name of the role
+    :return: The filtered query
+    """
+    if is_active is not None:
+        query = query.filter(User.is_active.is_(is_active))
+    if confirmed is not None:
+        query = query.filter(User.confirmed.is_(confirmed))
+    if role is not None:
+        query = query.filter(User.role_id == select(Role.id).filter(Role.name == role).scalar_subquery())
+    return query
+
+
+async def get_users_status(limit: int, offset: int, db: AsyncSession, cursor: str | None = None,
+                           fields: Type[BaseModel] = UserDbStatus, **filters) -> List[Row]:
+    """
+    The get_users_status function returns a page of the users, the newest first, see paginate.
+    Only the columns of the fields are selected, role_name is the name of the role of the user:
+    neither the password hashes and tokens nor the relationships are read.
+
+    :param limit: int: Size of the page
+    :param offset: int: Number of the users to skip when there is no cursor
+    :param db: AsyncSession: Access the database
+    :param cursor: str | None: Cursor returned with the previous page
+    :param fields: Type[BaseModel]: Schema of the rows, UserDbStatus or UserDbAdmin
+    :param filters: is_active, confirmed and role of filter_users
+    :return: Rows with the fields of the schema
+    """
+    role_name = select(Role.name).filter(Role.id == User.role_id).scalar_subquery().label('role_name')
+    columns = [role_name if name == 'role_name' else getattr(User, name) for name in fields.model_fields]
+    query = filter_users(select(*columns), **filters)
+    rows = await db.execute(paginate(query, User, limit, offset, cursor))
+    return rows.all()
+
+
+async def update_user_self(body: UserModel, user: User, db: AsyncSession) -> User | None:
+
+    user = await db.scalar(select(User).filter(User.id == user.id))
     if user:
         user.username = body.username
         user.email = body.email
         user.updated_at = datetime.now()
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
     return user
 
 
-async def update_user_as_admin(body: UserUpdate, user: User, db: Session) -> Type[User] | None:
+async def update_user_as_admin(body: UserUpdate, user: User, db: AsyncSession) -> Type[User] | None:
     pass
 #
 #     user_to_update = db.query(User).filter(User.username == body.username).first()
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Security, BackgroundTasks, Request, Response
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from api.database.db import get_db
 from api.database.models import User, RoleNames
@@ -16,21 +16,22 @@ security = HTTPBearer()
 
 
 @router.post('/register', response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def register(body: UserModel, request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+async def register(body: UserModel, request: Request, background_tasks: BackgroundTasks,
+                   db: AsyncSession = Depends(get_db)):
     """
      Register new user. If user with this email exists, raise 409 error
 
     :param body: UserModel: Get the data from the request body
     :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base url of the application
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A dictionary with the user. Response with 201 status code.
     """
     exist_user = await repository_users.get_user_by_email(body.email, db)
     if exist_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='Account already exists')
 
-    body.password = auth_service.get_password_hash(body.password)
+    body.password = await auth_service.get_password_hash(body.password)
     new_user = await repository_users.create_user(body, db)
     access_token = await auth_service.create_access_token(data={'sub': body.email}, expires_delta=86400)
     refresh_token = await auth_service.create_refresh_token(data={'sub': body.email})
@@ -40,7 +41,7 @@ async def register(body: UserModel, request: Request, background_tasks: Backgrou
 
 
 @router.post('/login', response_model=TokenModel)
-async def login(response: Response, body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(response: Response, body: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """
     The login function is used to authenticate a user.
 
@@ -49,7 +50,7 @@ async def login(response: Response, body: OAuth2PasswordRequestForm = Depends(),
 
     :param response: Response
     :param body: OAuth2PasswordRequestForm: Get the username and password from the request body
-    :param db: Session: Get a database session
+    :param db: AsyncSession: Get a database session
     :return: Access and refresh tokens
     """
     user = await repository_users.get_user_by_email(body.username, db)
@@ -59,7 +60,7 @@ async def login(response: Response, body: OAuth2PasswordRequestForm = Depends(),
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Email not confirmed')
     if not user.is_active:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='The user is deactivated.')
-    if not auth_service.verify_password(body.password, user.password):
+    if not await auth_service.verify_password(body.password, user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Incorrect login or password')
 
     access_token = await auth_service.create_access_token(data={'sub': user.email}, expires_delta=86400)
@@ -74,7 +75,7 @@ async def login(response: Response, body: OAuth2PasswordRequestForm = Depends(),
 
 @router.get('/refresh_token', response_model=TokenModel)
 async def refresh_tokens(response: Response, credentials: HTTPAuthorizationCredentials = Security(security),
-                         db: Session = Depends(get_db)):
+                         db: AsyncSession = Depends(get_db)):
     """
     The refresh_token function is used to refresh the access token.
         The function takes in a refresh token and returns a new access_token,
@@ -82,7 +83,7 @@ async def refresh_tokens(response: Response, credentials: HTTPAuthorizationCrede
 
     :param response: Response
     :param credentials: HTTPAuthorizationCredentials: Get the token from the authorization header
-    :param db: Session: Get a database session
+    :param db: AsyncSession: Get a database session
     :return: A dict with the access_token, refresh_token and token type
     """
     token = credentials.credentials
@@ -99,7 +100,7 @@ async def refresh_tokens(response: Response, credentials: HTTPAuthorizationCrede
 
 
 @router.get('/confirm_email/{token}')
-async def confirm_email(token: str, db: Session = Depends(get_db)):
+async def confirm_email(token: str, db: AsyncSession = Depends(get_db)):
     """
     The confirmed_email function is used to confirm a user's email address.
     It takes the token from the URL and uses it to get the user's email address.
@@ -109,7 +110,7 @@ async def confirm_email(token: str, db: Session = Depends(get_db)):
     IF user is already confirmed, return message 'Your email has already been confirmed'
 
     :param token: str: Get the token from the url
-    :param db: Session: Get a database session
+    :param db: AsyncSession: Get a database session
     :return: A message that the email is already confirmed or a message that the email has been confirmed
     """
     email = await auth_service.get_email_from_token(token)
@@ -124,7 +125,7 @@ async def confirm_email(token: str, db: Session = Depends(get_db)):
 
 @router.post('/request_email_confirmation')
 async def request_email_confirmation(body: RequestEmail, background_tasks: BackgroundTasks, request: Request,
-                                     db: Session = Depends(get_db)):
+                                     db: AsyncSession = Depends(get_db)):
     """
     The request_email_confirmation function is used to send a confirmation email to the user.
     It takes in an email address and sends a confirmation link to that address.
@@ -133,7 +134,7 @@ async def request_email_confirmation(body: RequestEmail, background_tasks: Backg
     :param body: RequestEmail: Get the email from the request body
     :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base_url of the request
-    :param db: Session: Get a database session
+    :param db: AsyncSession: Get a database session
     :return: A message to the user
     """
     user = await repository_users.get_user_by_email(body.email, db)
@@ -146,12 +147,12 @@ async def request_email_confirmation(body: RequestEmail, background_tasks: Backg
 
 @router.post("/logout")
 async def logout(credentials: HTTPAuthorizationCredentials = Security(security),
-                 db: Session = Depends(get_db)):
+                 db: AsyncSession = Depends(get_db)):
     """
     The logout function is used to log out a user.
 
     :param credentials: HTTPAuthorizationCredentials: Get the token from the request header
-    :param db: Session: Create a database session
+    :param db: AsyncSession: Create a database session
     :return: A message that the user has been logged out
     """
     token = credentials.credentials
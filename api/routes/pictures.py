@@ -1,16 +1,22 @@
+import asyncio
+import uuid
 from typing import List
 from faker import Faker
-from fastapi import APIRouter, Depends, status, UploadFile, File, HTTPException, Form, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, status, UploadFile, File, HTTPException, Form, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from api.database.db import get_db
 from api.database.models import User
 from api.repository import pictures as repository_pictures
-from api.repository.comments import get_comments_by_picture_id
+from api.repository.pagination import NEXT_CURSOR_HEADER, next_cursor, set_next_cursor
+from api.repository import upload_jobs as repository_upload_jobs
 
-from api.schemas.essential import PictureResponse, PictureCreate, PictureResponseWithComments
+from api.schemas.essential import PictureResponse, PictureCreate, PictureResponseWithComments, UploadJobResponse, \
+    BatchUploadResult
 from api.services.auth import auth_service
-from api.services.cloud_picture import CloudImage
+from api.services.cloud_picture import CloudImage, UploadLimitExceeded
+from api.services.response_cache import PICTURES, response_cache
+from api.services.upload_jobs import upload_queue, UploadQueueFull
 from api.conf.config import settings
 
 router = APIRouter(prefix='/pictures', tags=["pictures"])
@@ -18,7 +24,7 @@ router = APIRouter(prefix='/pictures', tags=["pictures"])
 
 @router.post("/", response_model=PictureResponse, status_code=status.HTTP_201_CREATED)
 async def create_picture(description: str = Form(None), tags: List = Form(None),
-                         file: UploadFile = File(None), shared: bool = True, db: Session = Depends(get_db),
+                         file: UploadFile = File(None), shared: bool = True, db: AsyncSession = Depends(get_db),
                          current_user: User = Depends(auth_service.get_current_user)):
     """
     The create_picture function creates a new picture in the database.
@@ -27,7 +33,7 @@ async def create_picture(description: str = Form(None), tags: List = Form(None),
     :param tags: List: Get the tags from the request
     :param file: UploadFile: Receive the file from the client
     :param shared: bool: Indicate if the picture is shared or not
-    :param db: Session: Get the database session if user has permission
+    :param db: AsyncSession: Get the database session if user has permission
     :param current_user: User: Get the user that is currently logged in
     :return: A picture object as a json object
     """
@@ -40,7 +46,10 @@ async def create_picture(description: str = Form(None), tags: List = Form(None),
 
     public_id = Faker().first_name().lower()
     try:
-        r = CloudImage.upload(file.file, public_id)
+        r = await CloudImage.upload_async(file.file, public_id)
+    except UploadLimitExceeded as limit_err:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(limit_err),
+                            headers={'Retry-After': '1'})
     except (ValueError, AttributeError) as v_err:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(v_err))
     else:
@@ -48,8 +57,123 @@ async def create_picture(description: str = Form(None), tags: List = Form(None),
         return await repository_pictures.create_picture(description, tags, picture_url, shared, db, current_user)
 
 
+@router.post("/batch/", response_model=List[BatchUploadResult], status_code=status.HTTP_201_CREATED)
+async def create_pictures_batch(files: List[UploadFile] = File(...), descriptions: List[str] = Form(None),
+                                tags: List[str] = Form(None), shared: bool = True,
+                                db: AsyncSession = Depends(get_db),
+                                current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The create_pictures_batch function creates a picture for every uploaded file.
+    The descriptions and tags (comma separated) are given for the files in the same order, they may be omitted.
+    Up to settings.batch_upload_concurrency files are uploaded to the storage at a time, then the pictures
+    of all uploaded files are created in one transaction. A file which fails does not fail the others,
+    its result has the error instead of the picture.
+
+    :param files: List[UploadFile]: Receive the files from the client
+    :param descriptions: List[str]: Descriptions of the files
+    :param tags: List[str]: Comma separated tags of the files
+    :param shared: bool: Indicate if the pictures are shared or not
+    :param db: AsyncSession: Get the database session
+    :param current_user: User: Get the user that is currently logged in
+    :return: Results of the files in the order of the files
+    """
+    if len(files) > settings.batch_upload_max_files:
+        raise HTTPException(status_code=400,
+                            detail=f"Too many files. The maximum is {settings.batch_upload_max_files}.")
+    descriptions, tags = descriptions or [], tags or []
+    files_tags = [[name.strip() for name in tags[i].split(',') if name.strip()] if i < len(tags) else []
+                  for i in range(len(files))]
+    if any(files_tags) and not current_user.role.can_post_tag:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not allowed to add tags")
+
+    results = [BatchUploadResult(filename=file.filename) for file in files]
+    semaphore = asyncio.Semaphore(settings.batch_upload_concurrency)
+
+    async def upload(file: UploadFile) -> str:
+        async with semaphore:
+            # the names of a batch must not overwrite each other
+            public_id = f'{Faker().first_name().lower()}-{uuid.uuid4().hex[:8]}'
+            r = await CloudImage.upload_waiting(file.file, public_id)
+            return CloudImage.get_url_for_picture(public_id, r)
+
+    uploads = {}
+    for i, file in enumerate(files):
+        if len(files_tags[i]) > settings.max_tags:
+            results[i].error = f"Too many tags. The maximum is {settings.max_tags}."
+        else:
+            uploads[i] = upload(file)
+    urls = await asyncio.gather(*uploads.values(), return_exceptions=True)
+
+    pictures_data, created = [], []
+    for i, url in zip(uploads, urls):
+        if isinstance(url, Exception):
+            results[i].error = str(url)
+        else:
+            created.append(i)
+            pictures_data.append({'picture_url': url, 'tags': files_tags[i],
+                                  'description': descriptions[i] if i < len(descriptions) else None})
+    if pictures_data:
+        try:
+            pictures = await repository_pictures.create_pictures(pictures_data, shared, db, current_user)
+        except Exception:
+            await asyncio.gather(*[CloudImage.destroy_async(data['picture_url']) for data in pictures_data],
+                                 return_exceptions=True)
+            raise
+        for i, picture in zip(created, pictures):
+            results[i].picture = PictureResponse.model_validate(picture)
+    return results
+
+
+@router.post("/jobs/", response_model=UploadJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def create_picture_job(description: str = Form(None), tags: List = Form(None),
+                             file: UploadFile = File(...), shared: bool = True, db: AsyncSession = Depends(get_db),
+                             current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The create_picture_job function accepts a picture for the background upload.
+    The file is saved to the local spool and the response is returned at once, the upload to the cloud
+    and creating of the picture are done by the upload workers. Progress is reported by get_picture_job.
+
+    :param description: str: Get the Description of the picture from the request
+    :param tags: List: Get the tags from the request
+    :param file: UploadFile: Receive the file from the client
+    :param shared: bool: Indicate if the picture is shared or not
+    :param db: AsyncSession: Get the database session
+    :param current_user: User: Get the user that is currently logged in
+    :return: The upload job with 202 status code
+    """
+    tags = tags[0].strip().split(',') if tags and tags[0] else []
+
+    if len(tags) > settings.max_tags:
+        raise HTTPException(status_code=400, detail=f"Too many tags. The maximum is {settings.max_tags}.")
+
+    try:
+        job = await upload_queue.submit(file, description, tags, shared, current_user, db)
+    except UploadQueueFull as queue_err:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(queue_err),
+                            headers={'Retry-After': '1'})
+    return job
+
+
+@router.get("/jobs/{job_id}", response_model=UploadJobResponse)
+async def get_picture_job(job_id: str, db: AsyncSession = Depends(get_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The get_picture_job function returns the state of the background upload:
+    queued, uploading, saving, done (with the id of the created picture) or failed (with the error).
+
+    :param job_id: str: Id of the upload job
+    :param db: AsyncSession: Get the database session
+    :param current_user: User: Get the user that is currently logged in
+    :return: The upload job
+    """
+    job = await repository_upload_jobs.get_upload_job(job_id, current_user, db)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload job not found")
+    return job
+
+
 @router.get("/{picture_id}", response_model=PictureResponseWithComments)
-async def get_picture(picture_id: int, with_comments: bool = True, db: Session = Depends(get_db),
+async def get_picture(picture_id: int, with_comments: bool = True, db: AsyncSession = Depends(get_db),
                       current_user: User = Depends(auth_service.get_current_user)):
     """
     The get_picture function returns a picture by its id.
@@ -57,77 +181,90 @@ async def get_picture(picture_id: int, with_comments: bool = True, db: Session =
 
     :param picture_id: int: Get the picture by id
     :param with_comments: bool: Determine whether the comments should be returned or not
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param current_user: User: Get the current user
     :return: A picture object
     """
-    picture = await repository_pictures.get_picture(picture_id, db)
-    
+    options = repository_pictures.picture_comments_loading() if with_comments else ()
+    picture = await repository_pictures.get_picture(picture_id, db, options)
+
     if picture is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Picture not found")
 
     if with_comments:
-        picture_with_comments = picture.__dict__
-        comments = await get_comments_by_picture_id(db, picture_id)
-        picture_with_comments["comments"] = comments
-        return picture_with_comments
+        return picture
 
-    return picture
+    return PictureResponse.model_validate(picture)
 
 
 @router.get("/pictures/", response_model=List[PictureResponseWithComments])
-async def get_all_pictures(limit: int = Query(10, le=100), offset: int = 0, db: Session = Depends(get_db)):
+async def get_all_pictures(request: Request, limit: int = Query(10, le=100), offset: int = 0,
+                           cursor: str = None, db: AsyncSession = Depends(get_db)):
     """
     The get_all_pictures function returns a list of all pictures in the database which is allowed for sharing
-        The limit and offset parameters are used to paginate the results.
+        The limit and cursor parameters are used to paginate the results, the cursor of the next page
+        is returned in the X-Next-Cursor header. The offset is used only for the requests without cursor.
 
+    :param request: Request: Key of the cached response
     :param limit: int: Limit the number of pictures returned
     :param le: Limit the number of pictures returned
     :param offset: int: Skip the first offset number of pictures
-    :param db: Session: Pass the database session to the function
+    :param cursor: str: Cursor of the page from the X-Next-Cursor header of the previous page
+    :param db: AsyncSession: Pass the database session to the function
     :return: A list of pictures
     """
-    pictures = await repository_pictures.get_all_pictures(limit=limit, offset=offset, db=db)
+    cached = await response_cache.get(request)
+    if cached is not None:
+        return cached
+    pictures = await repository_pictures.get_all_pictures(limit=limit, offset=offset, db=db, cursor=cursor,
+                                                          options=repository_pictures.picture_comments_loading())
     if pictures is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail='Picture not found')
-    return pictures
+    cursor = next_cursor(pictures, limit)
+    return await response_cache.set(request, List[PictureResponseWithComments], pictures, labels=[PICTURES],
+                                    headers={NEXT_CURSOR_HEADER: cursor} if cursor else None)
 
 
 @router.get("/user_pictures/", response_model=List[PictureResponse])
-async def get_user_pictures(limit: int = Query(10, le=100), offset: int = 0,
-                            current_user: User = Depends(auth_service.get_current_user),
-                            db: Session = Depends(get_db)):
+async def get_user_pictures(response: Response, limit: int = Query(10, le=100), offset: int = 0,
+                            cursor: str = None, current_user: User = Depends(auth_service.get_current_user),
+                            db: AsyncSession = Depends(get_db)):
     """
     The get_user_pictures function returns a list of pictures posted by the current user.
+        The cursor of the next page is returned in the X-Next-Cursor header.
 
+    :param response: Response: Set the cursor of the next page
     :param limit: int: Limit the number of pictures returned
     :param le: Limit the number of pictures that can be returned in a single request
-    :param offset: int:
+    :param offset: int: Skip the first offset number of pictures, used when there is no cursor
+    :param cursor: str: Cursor of the page from the X-Next-Cursor header of the previous page
     :param current_user: User: Get the current user
-    :param db: Session: Get a database session, which is required for creating and updating pictures
+    :param db: AsyncSession: Get a database session, which is required for creating and updating pictures
     :return: A list of pictures created by the current user
     """
-    pictures = await repository_pictures.get_user_pictures(limit=limit, offset=offset, user_id=current_user.id, db=db)
+    pictures = await repository_pictures.get_user_pictures(limit=limit, offset=offset, user_id=current_user.id, db=db,
+                                                           cursor=cursor)
     if pictures is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f'For {current_user.username} picture not found')
+    set_next_cursor(response, pictures, limit)
     return pictures
 
 
 @router.put("/{picture_id}", response_model=PictureResponse)
-async def update_picture(body: PictureCreate, picture_id: int, db: Session = Depends(get_db),
+async def update_picture(body: PictureCreate, picture_id: int, db: AsyncSession = Depends(get_db),
                          current_user: User = Depends(auth_service.get_current_user)):
     """
     The update_picture function updates a picture in the database.
         The function takes three arguments:
             - body: PictureCreate, which is a Pydantic model that contains all of the information needed to update a picture.
             - picture_id: int, the id of the picture to be updated.  This value comes from path parameters and must be passed into this function as such (see below).
-            - db: Session = Depends(get_db), which is an SQLAlchemy session object
+            - db: AsyncSession = Depends(get_db), which is an SQLAlchemy session object
 
     :param body: PictureCreate: Get the data from the request body
     :param picture_id: int: Identify the picture to be updated
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the current user
     :return: A picture object
 
@@ -139,13 +276,13 @@ async def update_picture(body: PictureCreate, picture_id: int, db: Session = Dep
 
 
 @router.delete("/{picture_id}", response_model=PictureResponse)
-async def remove_picture(picture_id: int, db: Session = Depends(get_db),
+async def remove_picture(picture_id: int, db: AsyncSession = Depends(get_db),
                          current_user: User = Depends(auth_service.get_current_user)):
     """
     The remove_picture function removes a picture from the database.
 
     :param picture_id: int: Specify the picture to be removed
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the current user from the database
     :return: A picture object
     """
@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Security
+from fastapi import APIRouter, Depends, HTTPException, status, Security, Query, Response
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy import func
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from api.database.db import get_db
-from api.database.models import User, Picture, RoleNames, Comment
+from api.database.models import User, RoleNames
 from api.repository import users as repository_users
+from api.repository.pagination import set_next_cursor
 from api.schemas.essential import UserUpdate, UserDb, UserProfileUpdate, UserDbExtra, UserStatusResponse, \
     UserStatusChange, UserDbStatus
 from api.services.auth import auth_service
@@ -13,11 +14,11 @@ router = APIRouter(prefix="/profile", tags=['profile'])
 security = HTTPBearer()
 
 
-async def get_user_by_slug(db: Session, slug: str) -> UserDbExtra | None:
-    return db.query(User).filter(User.slug == slug).first()
+async def get_user_by_slug(db: AsyncSession, slug: str, options: tuple = ()) -> UserDbExtra | None:
+    return await db.scalar(select(User).filter(User.slug == slug).options(*options))
 
 
-async def update_user(db: Session, user_update: UserProfileUpdate, current_user: User) -> UserDbExtra:
+async def update_user(db: AsyncSession, user_update: UserProfileUpdate, current_user: User) -> UserDbExtra:
     user = await get_user_by_slug(db, current_user.slug)
 
     if not user:
@@ -26,77 +27,66 @@ async def update_user(db: Session, user_update: UserProfileUpdate, current_user:
     for field, value in user_update.model_dump(exclude_unset=True).items():
         setattr(user, field, value)
 
-    user.password = auth_service.get_password_hash(user_update.password)
+    user.password = await auth_service.get_password_hash(user_update.password)
 
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
 
     return user
     # return {""}
 
 
-async def get_uploaded_photos_count(user_id: int, db: Session) -> int:
-    # Count the number of uploaded photos for the user
-    photos_count = db.query(func.count(Picture.id)).filter(Picture.user_id == user_id).scalar()
-    return photos_count
-
-
-async def get_comments_count(user_id: int, db: Session) -> int:
-    # Count the number of uploaded photos for the user
-    comments_count = db.query(func.count(Comment.id)).filter(Comment.user_id == user_id).scalar()
-    return comments_count
-
-
 @router.get("/who_am_i", response_model=UserDbExtra)
-async def view_own_profile(db: Session = Depends(get_db),
+async def view_own_profile(db: AsyncSession = Depends(get_db),
                            user: User = Depends(auth_service.get_current_user)):
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="You should be authorized.")
 
-    photos_count = await get_uploaded_photos_count(user_id=user.id, db=db)
-    comments_count = await get_comments_count(user_id=user.id, db=db)
-
-    user_data = user.__dict__
-    user_data["photos_count"] = photos_count
-    user_data["comments_count"] = comments_count
-
-    return user_data
+    # the current user may come from the user cache, the counters are read from the database
+    return await db.get(User, user.id, populate_existing=True)
 
 
 @router.get("/{slug}", response_model=UserDbExtra)
-async def view_user_profile(slug: str, db: Session = Depends(get_db)):
+async def view_user_profile(slug: str, db: AsyncSession = Depends(get_db)):
     user = await get_user_by_slug(db, slug)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    photos_count = await get_uploaded_photos_count(user_id=user.id, db=db)
-    comments_count = await get_comments_count(user_id=user.id, db=db)
-
-    user_data = user.__dict__
-    user_data["photos_count"] = photos_count
-    user_data["comments_count"] = comments_count
-
-    return user_data
+    return user
 
 
 @router.get('/admin/all_users', response_model=list[UserDbStatus])
-async def get_users(skip: int = 0, limit: int = 10, db: Session = Depends(get_db),
-                    current_user: User = Depends(auth_service.get_current_user)):
+async def get_users(response: Response, skip: int = Query(0, ge=0), limit: int = Query(10, ge=1, le=1000),
+                    cursor: str = None, is_active: bool = None, confirmed: bool = None, role: RoleNames = None,
+                    db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The get_users function returns a page of the users for the administrators, the newest first.
+    The cursor of the next page is returned in the X-Next-Cursor header.
+
+    :param response: Response: Set the cursor of the next page
+    :param skip: int: Number of the users to skip, used when there is no cursor
+    :param limit: int: Size of the page
+    :param cursor: str: Cursor of the page from the X-Next-Cursor header of the previous page
+    :param is_active: bool: Only active or only banned users
+    :param confirmed: bool: Only users with or without a confirmed email
+    :param role: RoleNames: Only users of the role
+    :param db: AsyncSession: Access the database
+    :param current_user: User: Current user, who must be an administrator
+    :return: A page of the users
+    """
     if not current_user.role.name == RoleNames.admin.name:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Only administrators can get full list of users.")
 
-    all_users = await repository_users.get_all_users(skip, limit, current_user, db)
-    if all_users is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Users not found.")
-    UserDb.model_validate(all_users[0])
-    return all_users
+    users = await repository_users.get_users_status(limit, skip, db, cursor=cursor, is_active=is_active,
+                                                    confirmed=confirmed, role=role.name if role else None)
+    set_next_cursor(response, users, limit)
+    return users
 
 
 @router.get("/admin/{slug}", response_model=UserDbExtra)
-async def admin_view_user_profile(slug: str, db: Session = Depends(get_db),
+async def admin_view_user_profile(slug: str, db: AsyncSession = Depends(get_db),
                             current_user: User = Depends(auth_service.get_current_user)):
     if not current_user.role.name == RoleNames.admin.name:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -105,18 +95,11 @@ async def admin_view_user_profile(slug: str, db: Session = Depends(get_db),
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    photos_count = await get_uploaded_photos_count(user_id=user.id, db=db)
-    comments_count = await get_comments_count(user_id=user.id, db=db)
-
-    user_data = user.__dict__
-    user_data["photos_count"] = photos_count
-    user_data["comments_count"] = comments_count
-
-    return user_data
+    return user
 
 
 @router.put("/update", response_model=UserDb)
-async def edit_own_profile(user_update: UserProfileUpdate, db: Session = Depends(get_db),
+async def edit_own_profile(user_update: UserProfileUpdate, db: AsyncSession = Depends(get_db),
                            current_user: User = Depends(auth_service.get_current_user)):
     user = await update_user(db, user_update, current_user)
     return user
@@ -124,7 +107,7 @@ async def edit_own_profile(user_update: UserProfileUpdate, db: Session = Depends
 
 @router.put("/deactivate", response_model=UserStatusResponse)
 async def user_deactivate(user_data: UserStatusChange, current_user: User = Depends(auth_service.get_current_user),
-                          db: Session = Depends(get_db)):
+                          db: AsyncSession = Depends(get_db)):
     if current_user.role.name != RoleNames.admin.name:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only administrators can deactivate users!")
 
@@ -137,7 +120,7 @@ async def user_deactivate(user_data: UserStatusChange, current_user: User = Depe
 
 @router.put("/activate", response_model=UserStatusResponse)
 async def user_activate(user_data: UserStatusChange, current_user: User = Depends(auth_service.get_current_user),
-                        db: Session = Depends(get_db)):
+                        db: AsyncSession = Depends(get_db)):
     if current_user.role.name != RoleNames.admin.name:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only administrators can activate users!")
     user = await repository_users.ban_user(user_data.email, current_user.id, db, is_active=True)
@@ -1,7 +1,7 @@
 from typing import List
 
 from fastapi import APIRouter, HTTPException, Depends, status, Path
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from api.database.db import get_db
 from api.schemas.essential import RatingModel
@@ -25,7 +25,7 @@ router = APIRouter(prefix='/rating', tags=["rating"])
 @router.post("/pictures/{picture_id}/{rate}", response_model=RatingModel)
 # , dependencies=[Depends(allowed_create_ratings)])
 async def create_rate(picture_id: int, rate: int = Path(description='Rate in the range of one to five', ge=1, le=5),
-                      db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+                      db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
     
     new_rate = await rating.create_rate(picture_id, rate, db, current_user)
     if new_rate is None:
@@ -34,7 +34,8 @@ async def create_rate(picture_id: int, rate: int = Path(description='Rate in the
 
 
 @router.put("/edit/{rate_id}/{new_rate}", response_model=RatingModel)  # , dependencies=[Depends(allowed_edit_ratings)])
-async def edit_rate(rate_id: int, new_rate: int, db: Session = Depends(get_db),
+async def edit_rate(rate_id: int, new_rate: int = Path(description='Rate in the range of one to five', ge=1, le=5),
+                    db: AsyncSession = Depends(get_db),
                     current_user: User = Depends(auth_service.get_current_user)):
     
     edited_rate = await rating.edit_rate(rate_id, new_rate, db, current_user)
@@ -44,7 +45,7 @@ async def edit_rate(rate_id: int, new_rate: int, db: Session = Depends(get_db),
 
 
 @router.delete("/delete/{rate_id}", response_model=RatingModel)  # , dependencies=[Depends(allowed_remove_ratings)])
-async def delete_rate(rate_id: int, db: Session = Depends(get_db),
+async def delete_rate(rate_id: int, db: AsyncSession = Depends(get_db),
                       current_user: User = Depends(auth_service.get_current_user)):
     
     deleted_rate = await rating.delete_rate(rate_id, db, current_user)
@@ -54,7 +55,7 @@ async def delete_rate(rate_id: int, db: Session = Depends(get_db),
 
 
 @router.get("/all", response_model=List[RatingModel])  # , dependencies=[Depends(allowed_get_all_ratings)])
-async def all_rates(db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+async def all_rates(db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
     
     comments = await rating.get_all_ratings(db, current_user)
     if comments is None:
@@ -63,7 +64,7 @@ async def all_rates(db: Session = Depends(get_db), current_user: User = Depends(
 
 
 @router.get("/all_my", response_model=List[RatingModel])  # , dependencies=[Depends(allowed_commented_by_user)])
-async def my_rates(db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+async def my_rates(db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
 
     comments = await rating.get_my_rating(db, current_user)
     if comments is None:
@@ -73,7 +74,7 @@ async def my_rates(db: Session = Depends(get_db), current_user: User = Depends(a
 
 @router.get("/user_picture/{user_id}/{picture_id}", response_model=RatingModel)
 # , dependencies=[Depends(allowed_user_picture_rate)])
-async def user_rate_picture(user_id: int, picture_id: int, db: Session = Depends(get_db),
+async def user_rate_picture(user_id: int, picture_id: int, db: AsyncSession = Depends(get_db),
                             current_user: User = Depends(auth_service.get_current_user)):
     
     rate = await rating.get_user_rate_picture(user_id, picture_id, db, current_user)
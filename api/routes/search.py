@@ -1,18 +1,19 @@
 from typing import List, Optional, Type
 
-from fastapi import APIRouter, Query, Depends, HTTPException
+from fastapi import APIRouter, Query, Depends, HTTPException, Request
 from fastapi import status
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from api.database.db import get_db
 from api.database.models import User, Picture
-from api.repository.search import search_by_description, search_by_tag, search_pictures_by_user
+from api.repository.search import search_by_description, search_by_tag, search_pictures_by_user, search_pictures, \
+    search_pictures_by_query
 from api.repository.comments import get_comments_by_picture_id
 from api.schemas.essential import PictureResponse, PictureResponseWithComments
 from api.repository import pictures as repository_pictures
-from api.repository.search import search_by_description, search_by_tag, search_pictures_by_user
 # Імпортуємо функцію для отримання поточного користувача із системи авторизації
 from api.services.auth import auth_service
+from api.services.response_cache import picture_label, response_cache, tag_label
 
 # Створюємо новий роутер з префіксом та тегом
 router = APIRouter(prefix='/search', tags=["search"])
@@ -21,25 +22,72 @@ router = APIRouter(prefix='/search', tags=["search"])
 # Ендпоінт для отримання світлини за її ідентифікатором
 
 
+@router.get("/", response_model=List[PictureResponse])
+async def search_pictures_everywhere(search_query: str = Query(..., min_length=1, max_length=100),
+                                     limit: int = Query(10, ge=1, le=100), offset: int = Query(0, ge=0),
+                                     db: AsyncSession = Depends(get_db),
+                                     current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The search_pictures_everywhere function searches the pictures by tag, author name and description at once.
+    The pictures matched by more sources go first.
+
+    :param search_query: str: Tag name, part of the author name or words of the description
+    :param limit: int: Size of the page
+    :param offset: int: Number of the pictures to skip
+    :param db: AsyncSession: Access the database
+    :param current_user: User: Current user, whose not shared pictures are searched too
+    :return: A page of the found pictures
+    """
+    return await search_pictures(db, search_query, limit=limit, offset=offset, user=current_user)
+
+
 @router.get("/description/", response_model=List[PictureResponse])
-def search_pictures_by_description(
+async def search_pictures_by_description(
         search_query: str = Query(..., min_length=1, max_length=100),
-        order_by: Optional[str] = Query(None, regex="^(rating|date_added)$"), db: Session = Depends(get_db),
+        order_by: Optional[str] = Query(None, pattern="^(rating|date_added)$"),
+        limit: int = Query(10, ge=1, le=100), offset: int = Query(0, ge=0), db: AsyncSession = Depends(get_db),
         current_user: str = Depends(auth_service.get_current_user)) -> List[PictureResponse]:
+    # Без order_by найрелевантніші світлини йдуть першими
     if order_by == "rating":
-        results = search_by_description(db, search_query).order_by(Picture.avg_rating.desc()).all()
+        results = await search_by_description(db, search_query, order_by=Picture.avg_rating.desc(),
+                                              limit=limit, offset=offset)
     elif order_by == "date_added":
-        results = search_by_description(db, search_query).order_by(Picture.created_at.desc()).all()
+        results = await search_by_description(db, search_query, order_by=Picture.created_at.desc(),
+                                              limit=limit, offset=offset)
     else:
-        results = search_by_description(db, search_query).all()
+        results = await search_by_description(db, search_query, limit=limit, offset=offset)
     return results
 
 
+@router.get("/filter/", response_model=List[PictureResponse])
+async def search_pictures_with_filters(
+        search_query: Optional[str] = Query(None, min_length=1, max_length=100),
+        rating: Optional[int] = Query(None, ge=0, le=5),
+        date_added: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$"),
+        limit: int = Query(10, ge=1, le=100), offset: int = Query(0, ge=0), db: AsyncSession = Depends(get_db),
+        current_user: User = Depends(auth_service.get_current_user)) -> List[PictureResponse]:
+    """
+    The search_pictures_with_filters function finds the pictures by the words of the description,
+    the minimal rating and the day they were added, page by page.
+
+    :param search_query: str: Words to search for, the most relevant pictures go first
+    :param rating: int: Minimal average rating
+    :param date_added: str: Day the pictures were added, YYYY-MM-DD
+    :param limit: int: Size of the page
+    :param offset: int: Number of the pictures to skip
+    :param db: AsyncSession: Access the database
+    :param current_user: User: Current user
+    :return: A page of the found pictures
+    """
+    return await search_pictures_by_query(db, search_query, rating=rating, date_added=date_added,
+                                          limit=limit, offset=offset)
+
+
 @router.get("/tag/", response_model=List[PictureResponse], include_in_schema=False)
 async def search_pictures_by_tag(
         search_query: str = Query(None, min_length=1, max_length=100),
-        order_by: Optional[str] = Query(None, regex="^(rating|date_added)$"),
-        db: Session = Depends(get_db),
+        order_by: Optional[str] = Query(None, pattern="^(rating|date_added)$"),
+        db: AsyncSession = Depends(get_db),
         current_user: str = Depends(auth_service.get_current_user)
 ) -> list[Type[Picture]]:
     if order_by == "rating":
@@ -55,19 +103,23 @@ async def search_pictures_by_tag(
 # Ендпоінт для пошуку користувачів за іменем, електронною поштою або іншими критеріями GET /pictures/users/search
 @router.get("/search_by_username", response_model=List[PictureResponse])
 async def search_user_by_admin_and_moder(user_query: str = Query(None, min_length=1, max_length=100),
-                                         db: Session = Depends(get_db),
+                                         db: AsyncSession = Depends(get_db),
                                          current_user: User = Depends(auth_service.get_current_user)):
     # Перевіряємо чи користувач є модератором або адміністратором
     if current_user.role.name not in ['admin', 'moderator']:
         raise HTTPException(status_code=403, detail="You don't have permission to perform this action.")
 
-    pictures = search_pictures_by_user(db, user_query)
+    pictures = await search_pictures_by_user(db, user_query)
     return pictures
 
 
 @router.get("/by_tag/{tag_name}", response_model=List[PictureResponse])
-async def get_pictures_by_tag(tag_name: str, db: Session = Depends(get_db)):
+async def get_pictures_by_tag(tag_name: str, request: Request, db: AsyncSession = Depends(get_db)):
+    cached = await response_cache.get(request)
+    if cached is not None:
+        return cached
     pictures = await repository_pictures.get_picture_by_tag(tag_name, db=db)
     if not pictures:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Picture with tag {tag_name} not found")
-    return pictures
+    labels = [tag_label(tag_name)] + [picture_label(picture.id) for picture in pictures]
+    return await response_cache.set(request, List[PictureResponse], pictures, labels=labels)
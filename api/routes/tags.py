@@ -1,44 +1,54 @@
 from typing import List
 
-from fastapi import APIRouter, Depends, status, HTTPException, Form, Body, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, status, HTTPException, Form, Body, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from api.database.db import get_db
 from api.repository import tags as repository_tags
+from api.repository.pagination import NEXT_CURSOR_HEADER, next_cursor
 from api.schemas.essential import TagModel, PictureResponse
 from api.routes.pictures import router as pict_router
+from api.services.response_cache import TAGS, response_cache
 
 
 tags_router = APIRouter(prefix='/tags', tags=["tags"])
 
 
 @tags_router.get("/", response_model=List[TagModel])
-async def get_all_tags(offset: int = Query(0, ge=0), limit: int = Query(100, ge=1), db: Session = Depends(get_db)):
+async def get_all_tags(request: Request, offset: int = Query(0, ge=0), limit: int = Query(100, ge=1),
+                       cursor: str = None, db: AsyncSession = Depends(get_db)):
     """
-    The get_all_tags function returns a list of all tags in the database.
+    The get_all_tags function returns a list of all tags in the database, the newest first.
+    The cursor of the next page is returned in the X-Next-Cursor header.
 
-    :param db: Session: Pass the database connection to the function
-    :param offset: int: skip 'offset' number of tags for pagination
+    :param request: Request: Key of the cached response
+    :param db: AsyncSession: Pass the database connection to the function
+    :param offset: int: skip 'offset' number of tags for pagination, used when there is no cursor
     :param limit: int: limit number of tags to 'limit' value
+    :param cursor: str: Cursor of the page from the X-Next-Cursor header of the previous page
     :return: A list of tag objects
     """
-    tags = await repository_tags.get_all_tags(db, skip=offset, limit=limit)
-
-    return tags
+    cached = await response_cache.get(request)
+    if cached is not None:
+        return cached
+    tags = await repository_tags.get_all_tags(db, skip=offset, limit=limit, cursor=cursor)
+    cursor = next_cursor(tags, limit)
+    return await response_cache.set(request, List[TagModel], tags, labels=[TAGS],
+                                    headers={NEXT_CURSOR_HEADER: cursor} if cursor else None)
 
 
 @pict_router.post("/pictures/{picture_id}/tags", response_model=PictureResponse)
-async def add_tags(picture_id: int, tags: List[str] = Form(None), db: Session = Depends(get_db)):
+async def add_tags(picture_id: int, tags: List[str] = Form(None), db: AsyncSession = Depends(get_db)):
     return await repository_tags.add_tags_to_picture(picture_id, tags, db)
 
 
 @tags_router.get("/{tag_id}", response_model=TagModel)
-async def get_tag(tag_id: int, db: Session = Depends(get_db)):
+async def get_tag(tag_id: int, db: AsyncSession = Depends(get_db)):
     """
     The get_tag function returns a single tag from the database.
 
     :param tag_id: int: Get the tag_id from the url
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The tag with the specified id
     """
     tag = await repository_tags.get_tag(tag_id, db)
@@ -48,17 +58,17 @@ async def get_tag(tag_id: int, db: Session = Depends(get_db)):
 
 
 @tags_router.post("/pictures/{picture_id}/tags", response_model=PictureResponse)
-async def add_tags(picture_id: int, tags: List[str] = Form(None), db: Session = Depends(get_db)):
+async def add_tags(picture_id: int, tags: List[str] = Form(None), db: AsyncSession = Depends(get_db)):
     return await repository_tags.add_tags_to_picture(picture_id, tags, db)
 
 
 @tags_router.delete("/pictures/{picture_id}/tags/{tag_id}", response_model=PictureResponse)
-async def delete_tag_from_picture(picture_id: int, tag_id: int, db: Session = Depends(get_db)):
+async def delete_tag_from_picture(picture_id: int, tag_id: int, db: AsyncSession = Depends(get_db)):
     PictureResponse.model_validate(result := await repository_tags.delete_tag_from_picture(picture_id, tag_id, db))
     return result
 
 
 @tags_router.put("/tags/{tag_id}", response_model=TagModel, include_in_schema=False)
-async def edit_tag(tag_id: int, tag_update: TagModel = Body(...), db: Session = Depends(get_db)):
+async def edit_tag(tag_id: int, tag_update: TagModel = Body(...), db: AsyncSession = Depends(get_db)):
     return await repository_tags.edit_tag(tag_id, tag_update, db)
 
@@ -1,60 +1,88 @@
+import base64
 from typing import List
-from fastapi import HTTPException, status, APIRouter, Depends
-from sqlalchemy.orm import Session
+from fastapi import HTTPException, status, APIRouter, Depends, Query, Request, Response
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from api.database.db import get_db
-from api.database.models import User
+from api.database.models import TransformedPicture, User
 
 from api.services.auth import auth_service
 
-from api.services.cloud_picture import CloudImage
-from api.services.transformation_picture import create_list_transformation
+from api.conf.config import settings
+from api.services.cloud_picture import CloudImage, QRCODE_MEDIA_TYPES
+from api.services.qrcode_cache import conditional_response
+from api.services.transform_engine import get_transform_backend
+from api.services.transformation_picture import create_list_transformation, transform_signature
 
 from api.schemas.transformation import TransformPictureModel, URLTransformPictureResponse, RotatePictureModel, \
-    TransformCropModel, TransformPictureResponse
+    TransformCropModel, TransformPictureResponse, QRCodeFormat, QRCodeErrorCorrection
 
 import api.repository.transformations as repo_transform
+from api.repository.pagination import set_next_cursor
 
 router = APIRouter(prefix='/picture/transforms', tags=['transformation picture'])
 
 
+async def apply_transformation(base_image_id: int, transform_list: List[dict], current_user: User,
+                               db: AsyncSession) -> TransformedPicture:
+    """
+    The apply_transformation function returns the transformation of the picture with the given steps.
+    A transformation made before by the same backend is found by its signature with one query,
+    a new one is built and saved.
+
+    :param base_image_id: int: Id of the picture of the current user
+    :param transform_list: List[dict]: Steps of the transformation
+    :param current_user: User: Owner of the picture
+    :param db: AsyncSession: Access the database
+    :return: The transformed picture
+    """
+    signature = transform_signature(transform_list, settings.transform_backend)
+    img = await repo_transform.get_transform_by_signature(base_image_id, signature, current_user, db)
+    if img is not None:
+        return img
+    image_url = await repo_transform.get_picture_for_transformation(base_image_id, current_user, db)
+    if image_url is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=f"Picture with id {base_image_id} not found")
+    try:
+        url = await get_transform_backend().transform(image_url, transform_list)
+    except (ValueError, OSError) as err:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Picture can not be transformed: {err}")
+    return await repo_transform.set_transform_picture(base_image_id, url, current_user, db, signature)
+
+
 @router.post('/batch', response_model=URLTransformPictureResponse, status_code=status.HTTP_200_OK,
              description="simple_effect = 'grayscale','negative','cartoonify','oil_paint' or 'black_white'")
 async def transformation_for_picture(base_image_id: int, body: TransformPictureModel,
                                      current_user: User = Depends(auth_service.get_current_user),
-                                     db: Session = Depends(get_db)):
+                                     db: AsyncSession = Depends(get_db)):
     """
     The transformation_for_picture function is used to create transformation of picture.
     It takes in the base_image_id, body and current user as parameters.
     Otherwise, a list of transformations are created using create list transformation function which takes in body as
     parameter.
-    Then url is set to transformed url using CloudImage class's get transformed url method which takes in image url
-    and transformation list as parameters
+    Then url is set to transformed url made by the transformation backend (Cloudinary or local, see settings)
+    from the image url and transformation list
 
     :param base_image_id: int: Get the picture from the database
     :param body: TransformPictureModel: Get the parameters from the request body
     :param current_user: User: Get the current user
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The url of the transformed picture
     """
 
-    image_url = await repo_transform.get_picture_for_transformation(base_image_id, current_user, db)
-
-    if image_url is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail=f"Picture with id {base_image_id} not found")
     transform_list = create_list_transformation(body)
-    url = CloudImage.get_transformed_url(image_url, transform_list)
-    img = await repo_transform.set_transform_picture(base_image_id, url, current_user, db)
+    img = await apply_transformation(base_image_id, transform_list, current_user, db)
 
-    return {'id': img.id, 'url': url}
+    return {'id': img.id, 'url': img.url}
 
 
 @router.post('/rotate', response_model=URLTransformPictureResponse, status_code=status.HTTP_200_OK,
              description="Insert rotating angle for Picture- degree: -360<=int <= 360, default=0")
 async def transformation_rotate(base_image_id: int, body: RotatePictureModel,
                                 current_user: User = Depends(auth_service.get_current_user),
-                                db: Session = Depends(get_db)):
+                                db: AsyncSession = Depends(get_db)):
     """
     The transformation_rotate function is used to create transformation of rotate for picture.
     It takes in the base_image_id, body and current user as parameters.
@@ -62,27 +90,19 @@ async def transformation_rotate(base_image_id: int, body: RotatePictureModel,
     :param base_image_id: int: Get the picture from the database
     :param body: RotatePictureModel: Get the parameters from the request body
     :param current_user: User: Get the current user
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The url of the transformed picture
     """
 
-    image_url = await repo_transform.get_picture_for_transformation(base_image_id, current_user, db)
-    transform_list = []
-    if image_url is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail=f"Picture with id {base_image_id} not found")
-
-    transform_list.append({'angle': body.degree})
-    url = CloudImage.get_transformed_url(image_url, transform_list)
-    img = await repo_transform.set_transform_picture(base_image_id, url, current_user, db)
-    return {'url': url, 'id': img.id}
+    img = await apply_transformation(base_image_id, [{'angle': body.degree}], current_user, db)
+    return {'url': img.url, 'id': img.id}
 
 
 @router.post('/resize', response_model=URLTransformPictureResponse, status_code=status.HTTP_200_OK,
              description="'for resizing picture insert width, height and, for example, 'gravity': 'face', 'crop': 'crop'")
 async def transformation_resize(base_image_id: int, body: TransformCropModel,
                                 current_user: User = Depends(auth_service.get_current_user),
-                                db: Session = Depends(get_db)):
+                                db: AsyncSession = Depends(get_db)):
     """
     The transformation_rotate function is used to create transformation of resize for picture.
     It takes in the base_image_id, body and current user as parameters.
@@ -90,54 +110,61 @@ async def transformation_resize(base_image_id: int, body: TransformCropModel,
     :param base_image_id: int: Get the picture from the database
     :param body: TransformCropModel: Get the parameters from the request body
     :param current_user: User: Get the current user
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The url of the transformed picture
     """
 
-    image_url = await repo_transform.get_picture_for_transformation(base_image_id, current_user, db)
-    transform_list = []
-    if image_url is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail=f"Picture with id {base_image_id} not found")
-    t_dict = body.model_dump()
-    transform_list.append(t_dict)
-    url = CloudImage.get_transformed_url(image_url, transform_list)
-    img = await repo_transform.set_transform_picture(base_image_id, url, current_user, db)
-    return {'url': url, 'id': img.id}
+    img = await apply_transformation(base_image_id, [body.model_dump()], current_user, db)
+    return {'url': img.url, 'id': img.id}
 
 
 @router.get('/qrcode/{transform_picture_id}', status_code=status.HTTP_200_OK)
-async def get_qrcode_for_transform_image(transform_picture_id: int,
+async def get_qrcode_for_transform_image(transform_picture_id: int, request: Request,
+                                         image_format: QRCodeFormat = Query(QRCodeFormat.base64, alias='format'),
+                                         box_size: int = Query(10, ge=1, le=40),
+                                         error_correction: QRCodeErrorCorrection = QRCodeErrorCorrection.medium,
                                          current_user: User = Depends(auth_service.get_current_user),
-                                         db: Session = Depends(get_db)):
+                                         db: AsyncSession = Depends(get_db)):
     """
     The get_qrcode_for_transform_image function is used to generate a QR code for the transformed picture.
     The function takes the id of the transform picture (type: integer) and returns a string containing
-    the base64 encoded QR code.
+    the base64 encoded QR code, or the image itself when the format is png or svg.
+    The response has an ETag, so a client which already has the QR code gets 304 status code without the body.
 
     :param transform_picture_id: int: Find the url for picture which was transformed from the DB
+    :param request: Request: Get the If-None-Match header
+    :param image_format: QRCodeFormat: Return base64 encoded PNG in JSON, PNG image or SVG image
+    :param box_size: int: Size of one box of the QR code in pixels
+    :param error_correction: QRCodeErrorCorrection: Error correction level of the QR code
     :param current_user: User: Check authentication data of the current user
-    :param db: Session: Access the database
-    :return: A base64 encoded qr code
+    :param db: AsyncSession: Access the database
+    :return: A base64 encoded qr code or the qr code image
     """
     picture = await repo_transform.get_transform_picture(transform_picture_id, current_user, db)
     if picture is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Transformation not found")
-    qr_code = CloudImage.get_qrcode(picture.url)
-    return qr_code
+    cache_control = f'private, max-age={settings.qrcode_max_age}'
+    if image_format == QRCodeFormat.base64:
+        image, etag = CloudImage.get_qrcode_image(picture.url, box_size=box_size,
+                                                  error_correction=error_correction.value)
+        return conditional_response(request, base64.b64encode(image).decode('ascii'), f'{etag}-base64',
+                                    cache_control, JSONResponse)
+    image, etag = CloudImage.get_qrcode_image(picture.url, image_format.value, box_size, error_correction.value)
+    return conditional_response(request, image, etag, cache_control,
+                                media_type=QRCODE_MEDIA_TYPES[image_format.value])
 
 
 @router.delete('/{transformation_id}', status_code=status.HTTP_204_NO_CONTENT)
 async def remove_transformed_picture(transformation_id: int,
                                      current_user: User = Depends(auth_service.get_current_user),
-                                     db: Session = Depends(get_db)):
+                                     db: AsyncSession = Depends(get_db)):
     """
     The remove_transformed_picture function is used to remove a transformed image from the database.
 
     :param transformation_id: int: Identify the transformation that is to be removed
     :param current_user: User: Get the user that is currently authorised
-    :param db: Session
+    :param db: AsyncSession
     :return: An image object
     """
     el = await repo_transform.remove_transformation(transformation_id, current_user, db)
@@ -147,21 +174,26 @@ async def remove_transformed_picture(transformation_id: int,
 
 
 @router.get('/all/{base_picture_id}', response_model=List[TransformPictureResponse])
-async def get_list_of_picture_transformations(base_picture_id: int, skip: int = 0, limit: int = 10,
+async def get_list_of_picture_transformations(base_picture_id: int, response: Response, skip: int = 0,
+                                              limit: int = 10, cursor: str = None,
                                               current_user: User = Depends(auth_service.get_current_user),
-                                              db: Session = Depends(get_db)):
+                                              db: AsyncSession = Depends(get_db)):
     """
     The get_list_of_picture_transformations function returns a list of transformations (urls) for the given base image.
+    The cursor of the next page is returned in the X-Next-Cursor header.
 
     :param base_picture_id: int: Get the base_picture id from the database
-    :param skip: int: Skip the first n images in the list
+    :param response: Response: Set the cursor of the next page
+    :param skip: int: Skip the first n images in the list, used when there is no cursor
     :param limit: int: Limit the number of results returned
+    :param cursor: str: Cursor of the page from the X-Next-Cursor header of the previous page
     :param current_user: User: Get the current user from the database
-    :param db: Session
+    :param db: AsyncSession
     :return: A list of transformed pictures for a given base image
     """
-    lst = await repo_transform.get_all_tr_pict(base_picture_id, skip, limit, current_user, db)
+    lst = await repo_transform.get_all_tr_pict(base_picture_id, skip, limit, current_user, db, cursor)
     if len(lst) == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Transformation not found")
+    set_next_cursor(response, lst, limit)
     return lst
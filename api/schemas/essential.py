@@ -63,6 +63,23 @@ class PictureResponseWithComments(PictureResponse):
     comments: Optional[List[CommentResponse]] = []
 
 
+class UploadJobResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: str
+    status: str
+    picture_id: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+
+class BatchUploadResult(BaseModel):
+    filename: Optional[str] = None
+    picture: Optional[PictureResponse] = None
+    error: Optional[str] = None
+
+
 class UserModel(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
@@ -90,9 +107,17 @@ class UserDbStatus(UserDb):
     is_active: bool
 
 
+class UserDbAdmin(UserDbStatus):
+    slug: str
+    role_name: Optional[str] = None
+    pictures_count: int = 0
+    comments_count: int = 0
+
+
 class UserDbExtra(UserDb):
-    photos_count: Optional[int] = None
+    photos_count: Optional[int] = Field(None, validation_alias='pictures_count')
     comments_count: Optional[int] = None
+    ratings_received: Optional[int] = None
 
 
 class UserProfileModel(BaseModel):
@@ -148,5 +173,19 @@ class RatingModel(RatingBase):
 
     id: int
     created_at: datetime
-    post_id: int
+    picture_id: int
     user_id: int
+
+
+class PoolStatusResponse(BaseModel):
+    pool_class: str
+    checked_out: int
+    checkouts: int
+    timeouts: int
+    wait_time_total: float
+    wait_time_max: float
+    wait_time_avg: float
+    size: Optional[int] = None
+    checked_in: Optional[int] = None
+    overflow: Optional[int] = None
+    timeout: Optional[float] = None
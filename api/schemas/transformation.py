@@ -2,7 +2,9 @@ from datetime import datetime
 from enum import Enum
 from typing import Optional, List
 
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, model_validator
+
+from api.conf.config import settings
 
 
 class TransformPictureResponse(BaseModel):
@@ -19,11 +21,17 @@ class ScalePicture(float):
 
 
 class TransformCropModel(BaseModel):
-    width: int = Field(ge=0, default=400)
-    height: int = Field(ge=0, default=400)
+    width: int = Field(ge=0, le=settings.transform_max_side, default=400)
+    height: int = Field(ge=0, le=settings.transform_max_side, default=400)
     crop: str = 'fill'
     gravity: str = 'auto'
     background: str = 'lightblue'
+
+    @model_validator(mode='after')
+    def validate_area(self):
+        if self.width * self.height > settings.transform_max_pixels:
+            raise ValueError(f"The picture is too big. The maximum is {settings.transform_max_pixels} pixels.")
+        return self
 # gravity="faces", height=800, width=800, crop="thumb"
 
 
@@ -67,3 +75,16 @@ class URLTransformPictureResponse(BaseModel):
 
 class SaveTransformPictureModel(BaseModel):
     url: str
+
+
+class QRCodeFormat(str, Enum):
+    base64 = 'base64'
+    png = 'png'
+    svg = 'svg'
+
+
+class QRCodeErrorCorrection(str, Enum):
+    low = 'L'
+    medium = 'M'
+    quartile = 'Q'
+    high = 'H'
@@ -2,32 +2,41 @@ from datetime import datetime, timedelta
 from typing import Optional, Type
 
 from fastapi import HTTPException, status, Depends
-from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from api.database.models import BlacklistToken, User
+from sqlalchemy.ext.asyncio import AsyncSession
+from api.database.models import User
 from jose import JWTError, jwt
 
 from api.database.db import get_db
 from api.conf.config import settings
 from api.repository import users as repository_users
+from api.services.password_hashing import PasswordHashingBusy, password_hasher
+from api.services.token_blacklist import token_blacklist
+from api.services.user_cache import user_cache
 
 
 class Auth:
-    pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
     SECRET_KEY = settings.secret_key
     ALGORITHM = settings.algorithm
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl='/api/auth/login')
 
-    def verify_password(self, plain_password, hashed_password):
-        return self.pwd_context.verify(plain_password, hashed_password)
-
-    def get_password_hash(self, password: str):
-        return self.pwd_context.hash(password)
+    async def verify_password(self, plain_password, hashed_password):
+        try:
+            return await password_hasher.verify(plain_password, hashed_password)
+        except PasswordHashingBusy as busy_err:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(busy_err),
+                                headers={'Retry-After': '1'})
 
-    async def jwt_check_and_decode(self, token: str, db: Session):
-        blacklisted_token = db.query(BlacklistToken).filter(token == BlacklistToken.token).first()
-        if not blacklisted_token:
+    async def get_password_hash(self, password: str):
+        try:
+            return await password_hasher.hash(password)
+        except PasswordHashingBusy as busy_err:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(busy_err),
+                                headers={'Retry-After': '1'})
+
+    async def jwt_check_and_decode(self, token: str):
+        # the blacklist is kept in memory of the worker, see token_blacklist
+        if not token_blacklist.is_blacklisted(token):
             return jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
         raise JWTError
 
@@ -63,13 +72,14 @@ class Auth:
         except JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
 
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Type[User]:
+    async def get_current_user(self, token: str = Depends(oauth2_scheme),
+                               db: AsyncSession = Depends(get_db)) -> Type[User]:
         credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                               detail='Could not validate credentials',
                                               headers={'WWW-Authenticate': 'Bearer'})
 
         try:
-            payload = await self.jwt_check_and_decode(token, db)
+            payload = await self.jwt_check_and_decode(token)
             if payload['scope'] == 'access_token':
                 email = payload['sub']
                 if email is None:
@@ -79,9 +89,12 @@ class Auth:
         except JWTError:
             raise credentials_exception
 
-        user = await repository_users.get_user_by_email(email, db)
+        user = await user_cache.get(email, db)
         if user is None:
-            raise credentials_exception
+            user = await repository_users.get_user_by_email(email, db)
+            if user is None:
+                raise credentials_exception
+            user_cache.set(user)
         if not user.is_active:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail='The user is deactivated.',
@@ -99,7 +112,7 @@ class Auth:
 
     async def get_email_from_token(self, token: str):
         try:
-            payload = await self.jwt_check_and_decode(token, next(get_db()))
+            payload = await self.jwt_check_and_decode(token)
             email = payload['sub']
             return email
         except JWTError as e:
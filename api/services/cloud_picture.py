@@ -1,58 +1,164 @@
-import cloudinary
-import cloudinary.uploader
+import asyncio
 import base64
 import io
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from weakref import WeakKeyDictionary
+
 import qrcode
+import qrcode.constants
 import qrcode.image.base
 import qrcode.image.svg
 
 from api.conf.config import settings
+from api.services.qrcode_cache import QRCodeCache
+from api.services.storage import get_storage
+
+
+QRCODE_MEDIA_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+QRCODE_ERROR_CORRECTION = {
+    'L': qrcode.constants.ERROR_CORRECT_L,
+    'M': qrcode.constants.ERROR_CORRECT_M,
+    'Q': qrcode.constants.ERROR_CORRECT_Q,
+    'H': qrcode.constants.ERROR_CORRECT_H,
+}
+
+qrcode_cache = QRCodeCache(settings.qrcode_cache_size, settings.qrcode_cache_dir)
+upload_executor = ThreadPoolExecutor(max_workers=settings.max_concurrent_uploads, thread_name_prefix='cloud-upload')
+
+
+class UploadLimitExceeded(Exception):
+    pass
 
 
 class CloudImage:
-    cloudinary.config(
-        cloud_name=settings.cloudinary_name,
-        api_key=settings.cloudinary_api_key,
-        api_secret=settings.cloudinary_api_secret,
-        secure=True
-    )
+    uploads_in_progress = 0
+    # notified when an upload slot is freed, one condition for every event loop
+    _slot_freed: WeakKeyDictionary = WeakKeyDictionary()
 
     @staticmethod
     def upload(file, public_id: str):
+        """
+        The upload function stores the picture in the storage selected by settings.storage_backend.
+
+        :param file: file-like object or path of the picture
+        :param public_id: str: Public id of the picture in the storage
+        :return: Storage response for the uploaded picture
+        """
+        return get_storage().upload(file, public_id)
+
+    @classmethod
+    def _slot_condition(cls) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if loop not in cls._slot_freed:
+            cls._slot_freed[loop] = asyncio.Condition()
+        return cls._slot_freed[loop]
+
+    @classmethod
+    async def _upload_in_slot(cls, file, public_id: str):
+        # the slot is taken by the caller and freed here
         try:
-            r = cloudinary.uploader.upload(file, public_id=public_id, overwrite=True)
-        except cloudinary.exceptions.Error as cl_error:
-            raise ValueError(str(cl_error))
-        return r
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(upload_executor, partial(cls.upload, file, public_id))
+        finally:
+            cls.uploads_in_progress -= 1
+            condition = cls._slot_condition()
+            async with condition:
+                condition.notify()
+
+    @classmethod
+    async def upload_async(cls, file, public_id: str):
+        """
+        The upload_async function runs the upload in the upload_executor thread pool, so the event loop is not
+        blocked for the time of the upload. If settings.max_concurrent_uploads uploads are already in progress
+        in this worker the function raises UploadLimitExceeded instead of queueing the file.
+
+        :param file: file-like object or path of the picture
+        :param public_id: str: Public id of the picture in the storage
+        :return: Storage response for the uploaded picture
+        """
+        if cls.uploads_in_progress >= settings.max_concurrent_uploads:
+            raise UploadLimitExceeded(f"Too many uploads in progress. "
+                                      f"The maximum is {settings.max_concurrent_uploads}.")
+        cls.uploads_in_progress += 1
+        return await cls._upload_in_slot(file, public_id)
+
+    @classmethod
+    async def upload_waiting(cls, file, public_id: str):
+        """
+        The upload_waiting function is upload_async for the background work: it waits for a free upload slot
+        instead of being rejected as a request would be. The waiting uploads are woken one by one
+        as the uploads in progress finish.
+
+        :param file: file-like object or path of the picture
+        :param public_id: str: Public id of the picture in the storage
+        :return: Storage response for the uploaded picture
+        """
+        condition = cls._slot_condition()
+        async with condition:
+            await condition.wait_for(lambda: cls.uploads_in_progress < settings.max_concurrent_uploads)
+            cls.uploads_in_progress += 1
+        return await cls._upload_in_slot(file, public_id)
 
     @staticmethod
-    def destroy(public_id):
-        cloudinary.uploader.destroy(public_id=public_id)
+    def destroy(picture_url: str):
+        get_storage().destroy(picture_url)
+
+    @classmethod
+    async def destroy_async(cls, picture_url: str):
+        """
+        The destroy_async function deletes the picture from the storage in the upload_executor thread pool,
+        the storage call goes over the network and would block the event loop.
+
+        :param picture_url: str: URL of the picture saved as its picture_url
+        """
+        await asyncio.get_running_loop().run_in_executor(upload_executor, partial(cls.destroy, picture_url))
 
     @staticmethod
     def get_url_for_picture(public_id, r):
-        src_url = cloudinary.CloudinaryImage(public_id) \
-            .build_url(width=250, height=250, crop='fill', version=r.get('version'))
-        return src_url
+        return get_storage().url(public_id, r)
 
     @staticmethod
     def get_transformed_url(image_url: str, transform_list: list[dict]):
-        picture_url = cloudinary.CloudinaryImage(image_url.split("/")[-1]).build_url(transformation=transform_list)
-        return picture_url
+        return get_storage().transformed_url(image_url, transform_list)
+
+    @staticmethod
+    def get_qrcode_image(pict_url: str, image_format: str = 'png', box_size: int = 10,
+                         error_correction: str = 'M') -> tuple[bytes, str]:
+        """
+        The get_qrcode_image function returns the image of the QR code for the URL.
+        Rendered images are kept in qrcode_cache, so the QR code for the same URL and options is rendered only once.
+
+        :param pict_url: str: URL encoded in the QR code
+        :param image_format: str: Format of the image, one of QRCODE_MEDIA_TYPES
+        :param box_size: int: Size of one box of the QR code in pixels
+        :param error_correction: str: Error correction level, one of QRCODE_ERROR_CORRECTION
+        :return: The image and its content key, which can be used as an ETag
+        """
+        key = qrcode_cache.make_key(pict_url, format=image_format, box_size=box_size,
+                                    error_correction=error_correction)
+        image = qrcode_cache.get(key)
+        if image is None:
+            qr = qrcode.QRCode(box_size=box_size, error_correction=QRCODE_ERROR_CORRECTION[error_correction])
+            qr.add_data(pict_url)
+            qr.make(fit=True)
+            image_factory = qrcode.image.svg.SvgPathImage if image_format == 'svg' else None
+            buf = io.BytesIO()
+            qr.make_image(image_factory=image_factory).save(buf)
+            image = buf.getvalue()
+            qrcode_cache.set(key, image)
+        return image, key
 
     @staticmethod
     def get_qrcode(pict_url: str):
         """
         The get_qrcode function takes a pict_url as an argument and returns the QR code for that URL.
-        The function uses the qrcode library to create a QR code object from the photo_url, then saves it to a buffer.
-        The buffer is encoded in base64 and returned as a string.
+        The PNG image of the QR code is taken from get_qrcode_image, encoded in base64 and returned as a string.
 
         :param pict_url: str: indicates type of data to expect
         :return: A base64 encoded string of a qr code image
         """
-        qr = qrcode.make(pict_url)
-        buf = io.BytesIO()
-        qr.save(buf)
-        qr_code = base64.b64encode(buf.getvalue()).decode('ascii')
+        image, _ = CloudImage.get_qrcode_image(pict_url)
+        qr_code = base64.b64encode(image).decode('ascii')
         return qr_code
 
@@ -0,0 +1,47 @@
+import threading
+from pathlib import Path
+
+
+class LocalObjectStore:
+    """
+    Objects kept as files under the root directory, addressed by keys like 'transformed/<hash>.png'.
+    The root is expected to be served by a StaticFiles mount at base_url, so an object is available
+    to the clients by its URL as soon as it is written.
+    """
+
+    def __init__(self, root: str, base_url: str):
+        self.root = Path(root)
+        self.base_url = base_url.rstrip('/')
+
+    def path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root.resolve()):
+            raise ValueError(f"Invalid object key: {key}")
+        return path
+
+    def url(self, key: str) -> str:
+        return f'{self.base_url}/{key}'
+
+    def key_for_url(self, url: str) -> str | None:
+        """
+        The key_for_url function returns the key of the object served by the URL or None for a foreign URL.
+
+        :param url: str: URL of an object
+        :return: Key of the object in this store or None
+        """
+        prefix = f'{self.base_url}/'
+        return url[len(prefix):] if url.startswith(prefix) else None
+
+    def exists(self, key: str) -> bool:
+        return self.path(key).is_file()
+
+    def put(self, key: str, data: bytes):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # readers never see a partly written object
+        tmp_path = path.with_name(f'{path.name}.{threading.get_ident()}.tmp')
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+
+    def delete(self, key: str):
+        self.path(key).unlink(missing_ok=True)
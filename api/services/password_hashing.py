@@ -0,0 +1,61 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context
+
+from passlib.context import CryptContext
+
+from api.conf.config import settings
+
+pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+
+
+class PasswordHashingBusy(Exception):
+    pass
+
+
+def hash_password(password: str, rounds: int) -> str:
+    return pwd_context.handler().using(rounds=rounds).hash(password)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a pool of settings.password_hash_workers processes, so hashing a password neither blocks
+    the event loop nor holds the GIL of the worker. Not more than settings.password_hash_max_pending hashes
+    wait for the pool, the next ones are rejected with PasswordHashingBusy instead of making the queue longer.
+    """
+
+    def __init__(self):
+        self.executor: ProcessPoolExecutor | None = None
+        self.pending = 0
+
+    async def run(self, func, *args):
+        if self.pending >= settings.password_hash_max_pending:
+            raise PasswordHashingBusy("Too many logins in progress. Try again later.")
+        if self.executor is None:
+            # fork is not safe in a process running threads, e.g. the thread pool of the sync routes
+            self.executor = ProcessPoolExecutor(max_workers=settings.password_hash_workers,
+                                                mp_context=get_context('spawn'))
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args))
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self.run(hash_password, password, settings.password_hash_rounds)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    def stop(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,99 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from fastapi import Request, Response, status
+
+
+class QRCodeCache:
+    """
+    Content-addressed cache of rendered QR code images. Images are keyed by the hash of the encoded URL
+    and the rendering options, the recently used ones are kept in memory (LRU), all of them optionally
+    in a directory which can be shared between workers.
+    """
+
+    def __init__(self, max_items: int, cache_dir: str = ''):
+        self.max_items = max_items
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self._items: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(url: str, **options) -> str:
+        """
+        The make_key function returns the content address of a QR code: sha256 of the URL and rendering options.
+
+        :param url: str: URL encoded in the QR code
+        :param options: Rendering options of the image
+        :return: Hex digest used as the cache key and the ETag of the image
+        """
+        signature = '|'.join([url] + [f'{name}={options[name]}' for name in sorted(options)])
+        return hashlib.sha256(signature.encode()).hexdigest()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            image = self._items.get(key)
+            if image is not None:
+                self._items.move_to_end(key)
+                return image
+        if self.cache_dir:
+            path = self.cache_dir / key
+            if path.is_file():
+                image = path.read_bytes()
+                self._remember(key, image)
+                return image
+        return None
+
+    def set(self, key: str, image: bytes):
+        self._remember(key, image)
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_dir / f'{key}.{threading.get_ident()}.tmp'
+            tmp_path.write_bytes(image)
+            tmp_path.replace(self.cache_dir / key)
+
+    def _remember(self, key: str, image: bytes):
+        with self._lock:
+            self._items[key] = image
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    The etag_matches function checks the If-None-Match request header against the ETag of the response.
+
+    :param if_none_match: str | None: Value of the If-None-Match header
+    :param etag: str: ETag of the response without quotes
+    :return: True if the client already has this version of the response
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix('W/').strip('"') for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+
+def conditional_response(request: Request, content: bytes | str, etag: str, cache_control: str,
+                         response_class: type[Response] = Response, **kwargs) -> Response:
+    """
+    The conditional_response function answers a GET request with the content or,
+    if the client already has this version of the content, with 304 status code and no body.
+
+    :param request: Request: Request with the optional If-None-Match header
+    :param content: bytes | str: Body of the response
+    :param etag: str: ETag of the content without quotes
+    :param cache_control: str: Value of the Cache-Control header
+    :param response_class: type[Response]: Class of the full response
+    :param kwargs: Other arguments of the response class, e.g. media_type
+    :return: The response
+    """
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': cache_control}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return response_class(content, headers=headers, **kwargs)
@@ -0,0 +1,219 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Iterable
+
+import redis.asyncio as redis
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+from api.conf.config import settings
+
+CACHE_HEADER = 'X-Cache'
+# labels of the cached responses, the write paths invalidate them
+PICTURES = 'pictures'
+TAGS = 'tags'
+
+
+def picture_label(picture_id: int) -> str:
+    return f'picture:{picture_id}'
+
+
+def tag_label(tag_name: str) -> str:
+    return f'tag:{tag_name}'
+
+
+class MemoryCacheBackend:
+    """
+    Responses kept in memory of the worker, the least recently used ones are evicted above max_items.
+    An invalidation is seen only by the worker which made it, so every worker of a deployment
+    serves its own copies for up to the TTL after a write made by another worker.
+    """
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items: OrderedDict[str, tuple[float, bytes, frozenset]] = OrderedDict()
+        self._labels: dict[str, set[str]] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> bytes | None:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                self._remove(key)
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    async def set(self, key: str, value: bytes, ttl: float, labels: Iterable[str]):
+        with self._lock:
+            self._remove(key)
+            self._items[key] = (time.monotonic() + ttl, value, frozenset(labels))
+            for label in labels:
+                self._labels.setdefault(label, set()).add(key)
+            while len(self._items) > self.max_items:
+                self._remove(next(iter(self._items)))
+
+    async def invalidate(self, labels: Iterable[str]):
+        with self._lock:
+            self._generation += 1
+            for label in labels:
+                for key in self._labels.pop(label, ()):
+                    self._remove(key)
+
+    async def generation(self) -> int:
+        return self._generation
+
+    def _remove(self, key: str):
+        item = self._items.pop(key, None)
+        if item is None:
+            return
+        for label in item[2]:
+            keys = self._labels.get(label)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._labels[label]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._labels.clear()
+
+
+class RedisCacheBackend:
+    """
+    Responses kept in Redis and shared by all workers, so an invalidation is seen by every worker at once.
+    Every label is a set of the keys of its responses. The size of the store is bounded by the server:
+    run it with maxmemory and an allkeys-lru policy. When the server is not available the cache is skipped.
+    """
+
+    prefix = 'picturest:cache:'
+
+    def __init__(self):
+        self.client = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=settings.redis_db)
+
+    async def get(self, key: str) -> bytes | None:
+        try:
+            return await self.client.get(f'{self.prefix}response:{key}')
+        except redis.RedisError:
+            return None
+
+    async def set(self, key: str, value: bytes, ttl: float, labels: Iterable[str]):
+        ttl_ms = int(ttl * 1000)
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.set(f'{self.prefix}response:{key}', value, px=ttl_ms)
+                for label in labels:
+                    # the set of a label lives as long as its newest response
+                    pipe.sadd(f'{self.prefix}label:{label}', key)
+                    pipe.pexpire(f'{self.prefix}label:{label}', ttl_ms)
+                await pipe.execute()
+        except redis.RedisError:
+            pass
+
+    async def invalidate(self, labels: Iterable[str]):
+        label_keys = [f'{self.prefix}label:{label}' for label in labels]
+        try:
+            keys = set()
+            for label_key in label_keys:
+                keys.update(await self.client.smembers(label_key))
+            await self.client.delete(*[f'{self.prefix}response:{key.decode()}' for key in keys], *label_keys)
+            await self.client.incr(f'{self.prefix}generation')
+        except redis.RedisError:
+            pass
+
+    async def generation(self) -> int:
+        try:
+            return int(await self.client.get(f'{self.prefix}generation') or 0)
+        except redis.RedisError:
+            return -1
+
+    def clear(self):
+        # the store is shared, its responses expire by themselves
+        pass
+
+
+class ResponseCache:
+    """
+    Cache of the JSON responses of the public read endpoints, keyed by the path and the sorted query parameters.
+    A cached response is labeled with the pictures and tags it shows, the write paths invalidate the labels
+    after commit. A response read from the database while an invalidation happened is not cached,
+    it may be older than the invalidation.
+    """
+
+    def __init__(self):
+        self._backends: dict[str, Any] = {}
+
+    @property
+    def backend(self):
+        name = settings.response_cache_backend
+        if name not in self._backends:
+            if name == 'redis':
+                self._backends[name] = RedisCacheBackend()
+            else:
+                self._backends[name] = MemoryCacheBackend(settings.response_cache_size)
+        return self._backends[name]
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.response_cache_backend) and settings.response_cache_ttl > 0
+
+    @staticmethod
+    def make_key(request: Request) -> str:
+        params = sorted((name, value) for name, value in request.query_params.multi_items() if value != '')
+        return request.url.path + '?' + '&'.join(f'{name}={value}' for name, value in params)
+
+    async def get(self, request: Request) -> Response | None:
+        """
+        The get function returns the cached response of the request or None.
+        On a miss the generation of the invalidations is noted in the request for set.
+
+        :param request: Request: Request of a public read endpoint
+        :return: The cached response with its headers or None
+        """
+        if not self.enabled:
+            return None
+        value = await self.backend.get(self.make_key(request))
+        if value is None:
+            request.state.cache_generation = await self.backend.generation()
+            return None
+        headers_size = int.from_bytes(value[:4], 'big')
+        headers = TypeAdapter(dict[str, str]).validate_json(value[4:4 + headers_size])
+        return Response(content=value[4 + headers_size:], media_type='application/json',
+                        headers={**headers, CACHE_HEADER: 'HIT'})
+
+    async def set(self, request: Request, response_model, content, labels: Iterable[str],
+                  headers: dict | None = None) -> Response:
+        """
+        The set function serializes the content by the response model and caches it with the given headers.
+
+        :param request: Request: Request of a public read endpoint
+        :param response_model: Response model of the endpoint
+        :param content: Result of the endpoint, e.g. a list of ORM objects
+        :param labels: Iterable[str]: Labels invalidating the response
+        :param headers: dict | None: Headers of the response, e.g. X-Next-Cursor
+        :return: The JSON response
+        """
+        adapter = TypeAdapter(response_model)
+        body = adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+        headers = dict(headers or {})
+        if self.enabled and await self.backend.generation() == getattr(request.state, 'cache_generation', None):
+            encoded_headers = TypeAdapter(dict[str, str]).dump_json(headers)
+            await self.backend.set(self.make_key(request), len(encoded_headers).to_bytes(4, 'big') + encoded_headers
+                                   + body, settings.response_cache_ttl, labels)
+        return Response(content=body, media_type='application/json', headers={**headers, CACHE_HEADER: 'MISS'})
+
+    async def invalidate(self, *labels: str):
+        if self.enabled:
+            await self.backend.invalidate(labels)
+
+    def clear(self):
+        for backend in self._backends.values():
+            backend.clear()
+
+
+response_cache = ResponseCache()
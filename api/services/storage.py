@@ -0,0 +1,195 @@
+import shutil
+import uuid
+from abc import ABC, abstractmethod
+
+import boto3
+import cloudinary
+import cloudinary.uploader
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from PIL import Image, UnidentifiedImageError
+
+from api.conf.config import settings
+from api.services.object_store import LocalObjectStore
+
+IMAGE_CONTENT_TYPES = {'jpeg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif', 'webp': 'image/webp',
+                       'bmp': 'image/bmp', 'tiff': 'image/tiff'}
+
+
+def image_format(file) -> str:
+    """
+    The image_format function checks that the uploaded file is an image and returns its format,
+    the file is read from the current position, which is restored.
+
+    :param file: file-like object or path of the picture
+    :return: Lower case format of the image, e.g. 'png'
+    """
+    position = file.tell() if hasattr(file, 'tell') else None
+    try:
+        with Image.open(file) as image:
+            name = (image.format or '').lower()
+    except (UnidentifiedImageError, OSError):
+        raise ValueError("Invalid image file")
+    finally:
+        if position is not None:
+            file.seek(position)
+    if name not in IMAGE_CONTENT_TYPES:
+        raise ValueError(f"Unsupported image format: {name}")
+    return name
+
+
+class Storage(ABC):
+    """
+    Where the pictures are kept. upload and destroy run in a thread of the upload executor, so a storage may block.
+    The URL returned by url is saved as the picture_url of the picture and given back to destroy.
+    """
+
+    @abstractmethod
+    def upload(self, file, public_id: str) -> dict:
+        pass
+
+    @abstractmethod
+    def url(self, public_id: str, uploaded: dict) -> str:
+        pass
+
+    @abstractmethod
+    def destroy(self, picture_url: str):
+        pass
+
+    def transformed_url(self, picture_url: str, transform_list: list[dict]) -> str:
+        raise ValueError("The storage does not transform pictures, use the local transformation backend")
+
+
+class CloudinaryStorage(Storage):
+    """
+    Pictures in Cloudinary, which also makes the transformations on request of their URLs.
+    """
+
+    def __init__(self):
+        cloudinary.config(
+            cloud_name=settings.cloudinary_name,
+            api_key=settings.cloudinary_api_key,
+            api_secret=settings.cloudinary_api_secret,
+            secure=True
+        )
+
+    def upload(self, file, public_id: str) -> dict:
+        """
+        The upload function sends the file to Cloudinary in chunks of settings.upload_chunk_size bytes,
+        so only one chunk of the file is kept in memory at a time.
+
+        :param file: file-like object or path of the picture
+        :param public_id: str: Public id of the picture in the cloud
+        :return: Cloudinary response for the uploaded picture
+        """
+        try:
+            return cloudinary.uploader.upload_large(file, public_id=public_id, overwrite=True, resource_type='image',
+                                                    chunk_size=settings.upload_chunk_size)
+        except cloudinary.exceptions.Error as cl_error:
+            raise ValueError(str(cl_error))
+
+    def url(self, public_id: str, uploaded: dict) -> str:
+        return cloudinary.CloudinaryImage(public_id) \
+            .build_url(width=250, height=250, crop='fill', version=uploaded.get('version'))
+
+    def destroy(self, picture_url: str):
+        cloudinary.uploader.destroy(public_id=picture_url.split("/")[-1])
+
+    def transformed_url(self, picture_url: str, transform_list: list[dict]) -> str:
+        return cloudinary.CloudinaryImage(picture_url.split("/")[-1]).build_url(transformation=transform_list)
+
+
+class LocalStorage(Storage):
+    """
+    Pictures in the local object store (settings.local_store_dir), served by the static files mount.
+    """
+
+    @property
+    def store(self) -> LocalObjectStore:
+        return LocalObjectStore(settings.local_store_dir, settings.local_store_url)
+
+    def upload(self, file, public_id: str) -> dict:
+        key = f'pictures/{public_id}-{uuid.uuid4().hex[:8]}.{image_format(file)}'
+        path = self.store.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'{path.name}.tmp')
+        if isinstance(file, str):
+            shutil.copyfile(file, tmp_path)
+        else:
+            with open(tmp_path, 'wb') as stored_file:
+                shutil.copyfileobj(file, stored_file, settings.upload_chunk_size)
+        tmp_path.replace(path)
+        return {'key': key}
+
+    def url(self, public_id: str, uploaded: dict) -> str:
+        return self.store.url(uploaded['key'])
+
+    def destroy(self, picture_url: str):
+        key = self.store.key_for_url(picture_url)
+        if key:
+            self.store.delete(key)
+
+
+class S3Storage(Storage):
+    """
+    Pictures in a bucket of an S3-compatible service: AWS S3, MinIO and the like (settings.s3_endpoint_url).
+    Files are uploaded in parts of settings.upload_chunk_size bytes and served from settings.s3_public_url.
+    """
+
+    def __init__(self):
+        self.client = boto3.client(
+            's3',
+            endpoint_url=settings.s3_endpoint_url or None,
+            aws_access_key_id=settings.s3_access_key,
+            aws_secret_access_key=settings.s3_secret_key,
+            region_name=settings.s3_region,
+            # MinIO-style services address buckets by path and do not take the checksums of newer SDKs
+            config=Config(s3={'addressing_style': 'path'}, request_checksum_calculation='when_required',
+                          response_checksum_validation='when_required'),
+        )
+
+    @property
+    def public_url(self) -> str:
+        return (settings.s3_public_url or f'{settings.s3_endpoint_url}/{settings.s3_bucket}').rstrip('/')
+
+    def upload(self, file, public_id: str) -> dict:
+        name = image_format(file)
+        key = f'pictures/{public_id}-{uuid.uuid4().hex[:8]}.{name}'
+        config = TransferConfig(multipart_threshold=settings.upload_chunk_size,
+                                multipart_chunksize=settings.upload_chunk_size)
+        extra_args = {'ContentType': IMAGE_CONTENT_TYPES[name]}
+        try:
+            if isinstance(file, str):
+                self.client.upload_file(file, settings.s3_bucket, key, ExtraArgs=extra_args, Config=config)
+            else:
+                self.client.upload_fileobj(file, settings.s3_bucket, key, ExtraArgs=extra_args, Config=config)
+        except (BotoCoreError, ClientError, S3UploadFailedError) as s3_error:
+            raise ValueError(str(s3_error))
+        return {'key': key}
+
+    def url(self, public_id: str, uploaded: dict) -> str:
+        return f"{self.public_url}/{uploaded['key']}"
+
+    def destroy(self, picture_url: str):
+        prefix = f'{self.public_url}/'
+        if picture_url.startswith(prefix):
+            self.client.delete_object(Bucket=settings.s3_bucket, Key=picture_url[len(prefix):])
+
+
+storage_backends = {'cloudinary': CloudinaryStorage, 'local': LocalStorage, 's3': S3Storage}
+_storages: dict[str, Storage] = {}
+
+
+def get_storage() -> Storage:
+    """
+    The get_storage function returns the storage selected by settings.storage_backend.
+    A storage is configured when it is used for the first time, not when the application is imported.
+
+    :return: The storage of the pictures
+    """
+    name = settings.storage_backend
+    if name not in _storages:
+        _storages[name] = storage_backends[name]()
+    return _storages[name]
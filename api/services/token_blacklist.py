@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from jose import JWTError, jwt
+from sqlalchemy import delete, select
+
+from api.conf.config import settings
+from api.database.db import SessionLocal
+from api.database.models import BlacklistToken
+
+logger = logging.getLogger(__name__)
+
+# lifetime of the longest token (refresh token), used when the token has no readable exp claim
+MAX_TOKEN_LIFETIME = 7 * 24 * 60 * 60
+
+
+def token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def token_expiry(token: str) -> float:
+    """
+    The token_expiry function returns the time when the token expires and stops being accepted anyway.
+
+    :param token: str: JWT token
+    :return: Unix timestamp of the exp claim of the token
+    """
+    try:
+        return float(jwt.get_unverified_claims(token)['exp'])
+    except (JWTError, KeyError, TypeError, ValueError):
+        return time.time() + MAX_TOKEN_LIFETIME
+
+
+def to_datetime(timestamp: float) -> datetime:
+    # the table keeps naive UTC datetimes
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+
+
+def to_timestamp(value: datetime) -> float:
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class BloomFilter:
+    """
+    Bit array answering "certainly not added" or "maybe added" for hex digests.
+    The bit positions are taken from the digest itself, no more hashing is needed.
+    """
+
+    def __init__(self, size: int, hashes: int):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray((size + 7) // 8)
+
+    def _positions(self, digest: str):
+        step = len(digest) // self.hashes
+        for i in range(self.hashes):
+            yield int(digest[i * step:(i + 1) * step], 16) % self.size
+
+    def add(self, digest: str):
+        for position in self._positions(digest):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, digest: str) -> bool:
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self._positions(digest))
+
+
+class TokenBlacklist:
+    """
+    Per-worker copy of the blacklist_tokens table, so the validation of a token does not query the database.
+    Almost every token is not blacklisted and is rejected by the Bloom filter alone, the exact set of
+    token hashes confirms the rest. An entry is dropped at the exp of its token, when the token is not
+    accepted anyway, so the structure holds only the tokens which are still alive.
+    The workers keep their copies in sync by polling the table for the rows added by other workers.
+    """
+
+    def __init__(self):
+        self.session_factory = SessionLocal
+        # the newest blacklisted_on seen by sync, None until a row is seen
+        self.synced_until: datetime | None = None
+        self._expiry: dict[str, float] = {}
+        self._queue: list[tuple[float, str]] = []
+        self._bloom = BloomFilter(settings.blacklist_bloom_bits, settings.blacklist_bloom_hashes)
+        self._expired_since_rebuild = 0
+        self._task: asyncio.Task | None = None
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def add(self, token: str, expires_at: float = None):
+        self.add_hash(token_hash(token), token_expiry(token) if expires_at is None else expires_at)
+
+    def add_hash(self, digest: str, expires_at: float):
+        if expires_at <= time.time() or digest in self._expiry:
+            return
+        self._expiry[digest] = expires_at
+        heapq.heappush(self._queue, (expires_at, digest))
+        self._bloom.add(digest)
+
+    def discard(self, token: str):
+        # the heap entry is skipped when it expires
+        self._expiry.pop(token_hash(token), None)
+
+    def is_blacklisted(self, token: str) -> bool:
+        digest = token_hash(token)
+        if digest not in self._bloom:
+            return False
+        expires_at = self._expiry.get(digest)
+        return expires_at is not None and expires_at > time.time()
+
+    def expire(self):
+        """
+        The expire function drops the entries of the expired tokens.
+        The Bloom filter can not forget, so it is rebuilt from the exact set when half of its entries are gone.
+        """
+        now = time.time()
+        while self._queue and self._queue[0][0] <= now:
+            _, digest = heapq.heappop(self._queue)
+            if self._expiry.pop(digest, None) is not None:
+                self._expired_since_rebuild += 1
+        if self._expired_since_rebuild and self._expired_since_rebuild >= len(self._expiry):
+            self._bloom = BloomFilter(settings.blacklist_bloom_bits, settings.blacklist_bloom_hashes)
+            for digest in self._expiry:
+                self._bloom.add(digest)
+            self._expired_since_rebuild = 0
+
+    async def sync(self):
+        """
+        The sync function loads the tokens blacklisted since the last sync, by this or any other worker.
+        The rows are not committed in the order of their blacklisted_on (nor of their ids), so every sync
+        reads again the last settings.blacklist_sync_overlap seconds before the newest row seen,
+        a row committed late by a concurrent logout is found by the next sync. Until a row is seen
+        the sync loads all the tokens which are still alive.
+        """
+        query = select(BlacklistToken.token_hash, BlacklistToken.expires_at, BlacklistToken.blacklisted_on)
+        if self.synced_until is None:
+            query = query.filter(BlacklistToken.expires_at > datetime.utcnow())
+        else:
+            query = query.filter(BlacklistToken.blacklisted_on >= self.synced_until
+                                 - timedelta(seconds=settings.blacklist_sync_overlap))
+        async with self.session_factory() as db:
+            for digest, expires_at, blacklisted_on in await db.execute(query):
+                self.add_hash(digest, to_timestamp(expires_at))
+                if blacklisted_on is not None and (self.synced_until is None or blacklisted_on > self.synced_until):
+                    self.synced_until = blacklisted_on
+        self.expire()
+
+    async def purge(self) -> int:
+        """
+        The purge function deletes the rows of the expired tokens from the blacklist table by one statement,
+        the expires_at index keeps it cheap however big the table is.
+
+        :return: Number of the deleted rows
+        """
+        async with self.session_factory() as db:
+            result = await db.execute(delete(BlacklistToken).filter(BlacklistToken.expires_at <= datetime.utcnow()))
+            await db.commit()
+        return result.rowcount
+
+    async def _sync_periodically(self):
+        purged_at = time.monotonic()
+        while True:
+            await asyncio.sleep(settings.blacklist_sync_interval)
+            try:
+                await self.sync()
+                if time.monotonic() - purged_at >= settings.blacklist_purge_interval:
+                    purged_at = time.monotonic()
+                    await self.purge()
+            except Exception:
+                logger.exception("Token blacklist sync failed")
+
+    async def start(self):
+        await self.sync()
+        self._task = asyncio.create_task(self._sync_periodically())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+token_blacklist = TokenBlacklist()
@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import io
+import math
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context
+
+import numpy as np
+from PIL import Image, ImageColor, ImageFilter, ImageOps
+
+from api.conf.config import settings
+from api.services.cloud_picture import CloudImage
+from api.services.object_store import LocalObjectStore
+from api.services.transformation_picture import transform_signature
+
+# centering of ImageOps.fit for the Cloudinary gravity, the others (auto, face, ...) crop the center
+GRAVITY_CENTERING = {
+    'north_west': (0, 0), 'north': (0.5, 0), 'north_east': (1, 0),
+    'west': (0, 0.5), 'center': (0.5, 0.5), 'east': (1, 0.5),
+    'south_west': (0, 1), 'south': (0.5, 1), 'south_east': (1, 1),
+}
+SOURCE_TIMEOUT = 30
+
+
+def _color(value: str | None, default: str = 'white') -> tuple:
+    value = (value or default).replace('rgb:', '#')
+    try:
+        return ImageColor.getrgb(value)
+    except ValueError:
+        return ImageColor.getrgb(default)
+
+
+def check_size(width: int, height: int, source: bool = False):
+    """
+    The check_size function rejects a picture bigger than settings.transform_max_side and
+    settings.transform_max_pixels, before its memory is allocated. A source picture is checked
+    against the larger settings.transform_max_source_side and settings.transform_max_source_pixels.
+
+    :param width: int: Width of the picture
+    :param height: int: Height of the picture
+    :param source: bool: Check the limits of a source picture
+    """
+    if source:
+        max_side, max_pixels = settings.transform_max_source_side, settings.transform_max_source_pixels
+    else:
+        max_side, max_pixels = settings.transform_max_side, settings.transform_max_pixels
+    if max(width, height) > max_side or width * height > max_pixels:
+        raise ValueError(f"The picture of {width}x{height} pixels is too big")
+
+
+def resize(image: Image.Image, step: dict) -> Image.Image:
+    """
+    The resize function applies the Cloudinary resize step (width, height, crop, gravity, background).
+    A missing side is taken from the aspect ratio of the image, the size is checked by check_size.
+
+    :param image: Image.Image: Source image
+    :param step: dict: Step of the transformation
+    :return: The resized image
+    """
+    width, height = step.get('width') or 0, step.get('height') or 0
+    if not width and not height:
+        return image
+    width = width or round(image.width * height / image.height)
+    height = height or round(image.height * width / image.width)
+    check_size(width, height)
+    crop = step.get('crop') or 'scale'
+    centering = GRAVITY_CENTERING.get(step.get('gravity'), (0.5, 0.5))
+    if crop == 'crop':
+        # a region of the image without scaling
+        width, height = min(width, image.width), min(height, image.height)
+        left = round((image.width - width) * centering[0])
+        top = round((image.height - height) * centering[1])
+        return image.crop((left, top, left + width, top + height))
+    if crop in ('fill', 'lfill', 'thumb', 'fill_pad'):
+        return ImageOps.fit(image, (width, height), centering=centering)
+    if crop in ('fit', 'limit', 'mfit'):
+        return ImageOps.contain(image, (width, height))
+    if crop in ('pad', 'lpad', 'mpad'):
+        return ImageOps.pad(image, (width, height), color=_color(step.get('background')), centering=centering)
+    return image.resize((width, height))
+
+
+def rotate(image: Image.Image, step: dict) -> Image.Image:
+    # the expanded image holds the rotated corners, it may be larger than the source
+    angle = math.radians(step['angle'])
+    cos, sin = abs(math.cos(angle)), abs(math.sin(angle))
+    check_size(math.ceil(image.width * cos + image.height * sin), math.ceil(image.width * sin + image.height * cos),
+               source=True)
+    # Cloudinary rotates clockwise
+    return image.rotate(-step['angle'], expand=True, fillcolor=(0, 0, 0, 0))
+
+
+def round_corners(image: Image.Image, step: dict) -> Image.Image:
+    """
+    The round_corners function makes the corners of the image transparent, like the Cloudinary radius step:
+    'max' for an ellipse, one radius for all corners or 'top_left:top_right:bottom_right:bottom_left'.
+
+    :param image: Image.Image: Source image
+    :param step: dict: Step of the transformation
+    :return: The image with an alpha channel
+    """
+    pixels = np.array(image)
+    height, width = pixels.shape[:2]
+    ys, xs = np.ogrid[:height, :width]
+    radius = step['radius']
+    if radius == 'max':
+        outside = ((xs + 0.5 - width / 2) / (width / 2)) ** 2 + ((ys + 0.5 - height / 2) / (height / 2)) ** 2 > 1
+    else:
+        radii = [int(r) for r in str(radius).split(':')]
+        top_left, top_right, bottom_right, bottom_left = (radii * 4)[:4]
+        outside = np.zeros((height, width), dtype=bool)
+        for r, left, top in ((top_left, True, True), (top_right, False, True),
+                             (bottom_right, False, False), (bottom_left, True, False)):
+            r = min(r, width // 2, height // 2)
+            if r <= 0:
+                continue
+            cx, cy = (r if left else width - r), (r if top else height - r)
+            corner = ((xs < r) if left else (xs >= width - r)) & ((ys < r) if top else (ys >= height - r))
+            outside |= corner & ((xs + 0.5 - cx) ** 2 + (ys + 0.5 - cy) ** 2 > r ** 2)
+    pixels[..., 3][outside] = 0
+    return Image.fromarray(pixels)
+
+
+def _luminance(rgb: np.ndarray) -> np.ndarray:
+    return rgb @ np.array([0.299, 0.587, 0.114])
+
+
+def apply_effect(image: Image.Image, step: dict) -> Image.Image:
+    """
+    The apply_effect function applies the simple effect 'name:strength' built from SimpleEffectTransformModel.
+    The strength means what it means for Cloudinary: the threshold of blackwhite, the thickness of the lines
+    of cartoonify and the brush size of oil_paint, grayscale and negate do not use it.
+
+    :param image: Image.Image: Source image
+    :param step: dict: Step of the transformation
+    :return: The image with the effect
+    """
+    name, _, strength = step['effect'].partition(':')
+    strength = int(strength or 50)
+    if name == 'oil_paint':
+        return image.filter(ImageFilter.ModeFilter(3 + 2 * round(strength / 25)))
+    pixels = np.array(image).astype(np.float32)
+    rgb = pixels[..., :3]
+    if name == 'grayscale':
+        rgb[:] = _luminance(rgb)[..., None]
+    elif name == 'negate':
+        rgb[:] = 255 - rgb
+    elif name == 'blackwhite':
+        rgb[:] = np.where(_luminance(rgb) > strength * 2.55, 255, 0)[..., None]
+    elif name == 'cartoonify':
+        edges = np.array(image.convert('L').filter(ImageFilter.FIND_EDGES)).astype(np.float32)
+        # flat colors with dark outlines
+        rgb[:] = rgb // 64 * 64 + 32
+        rgb[edges > 255 - strength * 2.55] = 0
+    else:
+        raise ValueError(f"Unknown effect: {name}")
+    return Image.fromarray(pixels.astype(np.uint8))
+
+
+def apply_step(image: Image.Image, step: dict) -> Image.Image:
+    if 'angle' in step:
+        return rotate(image, step)
+    if 'radius' in step:
+        return round_corners(image, step)
+    if 'effect' in step:
+        return apply_effect(image, step)
+    return resize(image, step)
+
+
+def render(source: str, transform_list: list[dict]) -> bytes:
+    """
+    The render function makes the transformed image, it runs in a process of the LocalTransformBackend pool.
+    The source may be larger than the result, e.g. a photo of a camera resized by the transformation,
+    the result is checked by check_size when it is made.
+
+    :param source: str: Path or http(s) URL of the source image
+    :param transform_list: list[dict]: Steps built by create_list_transformation
+    :return: PNG image
+    """
+    if source.startswith(('http://', 'https://')):
+        with urllib.request.urlopen(source, timeout=SOURCE_TIMEOUT) as response:
+            source = io.BytesIO(response.read())
+    with Image.open(source) as image:
+        # the size is known from the header, the pixels are not decoded yet
+        check_size(*image.size, source=True)
+        image = ImageOps.exif_transpose(image).convert('RGBA')
+    for step in transform_list:
+        image = apply_step(image, step)
+    check_size(*image.size)
+    buf = io.BytesIO()
+    image.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+class CloudinaryTransformBackend:
+    """
+    Transformations made by Cloudinary on request of the transformation URL, nothing is computed here.
+    """
+
+    async def transform(self, image_url: str, transform_list: list[dict]) -> str:
+        return CloudImage.get_transformed_url(image_url, transform_list)
+
+    def stop(self):
+        pass
+
+
+class LocalTransformBackend:
+    """
+    Transformations made with Pillow and NumPy in a pool of settings.transform_workers processes.
+    The result is kept in the local object store under the hash of the source URL and the transformation
+    signature, so an image is rendered once and can be rendered in advance.
+    """
+
+    def __init__(self):
+        self.executor: ProcessPoolExecutor | None = None
+
+    @property
+    def store(self) -> LocalObjectStore:
+        return LocalObjectStore(settings.local_store_dir, settings.local_store_url)
+
+    async def transform(self, image_url: str, transform_list: list[dict]) -> str:
+        """
+        The transform function returns the URL of the transformed image, rendering it if it is not stored yet.
+
+        :param image_url: str: URL of the source image
+        :param transform_list: list[dict]: Steps built by create_list_transformation
+        :return: URL of the image in the local object store
+        """
+        store = self.store
+        digest = hashlib.sha256(f'{image_url}|{transform_signature(transform_list, "local")}'.encode()).hexdigest()
+        key = f'transformed/{digest}.png'
+        if not store.exists(key):
+            source_key = store.key_for_url(image_url)
+            source = str(store.path(source_key)) if source_key else image_url
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=settings.transform_workers,
+                                                    mp_context=get_context('spawn'))
+            image = await asyncio.get_running_loop().run_in_executor(self.executor,
+                                                                     partial(render, source, transform_list))
+            store.put(key, image)
+        return store.url(key)
+
+    def stop(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+transform_backends = {'cloudinary': CloudinaryTransformBackend(), 'local': LocalTransformBackend()}
+
+
+def get_transform_backend():
+    return transform_backends[settings.transform_backend]
@@ -1,3 +1,5 @@
+import hashlib
+import json
 from typing import List
 
 from api.schemas.transformation import TransformPictureModel
@@ -43,3 +45,19 @@ def create_list_transformation(body: TransformPictureModel) -> List[dict]:
             transform_list.append(({'effect': f'{item.effect.name}:{item.strength}'}))
 
     return transform_list
+
+
+def transform_signature(transform_list: List[dict], backend: str) -> str:
+    """
+    The transform_signature function returns the signature of the transformation built by create_list_transformation.
+    The order of the steps is kept, the parameters of every step are sorted and the unset ones are dropped,
+    so equal transformations get the same signature however they were written in the request.
+    The transformation backend is signed too: the backends make different images of the same steps.
+
+    :param transform_list: List[dict]: Steps of the transformation
+    :param backend: str: Name of the transformation backend, see settings.transform_backend
+    :return: sha256 hex digest of the canonical form of the transformation
+    """
+    steps = [{name: value for name, value in sorted(step.items()) if value is not None} for step in transform_list]
+    canonical = json.dumps({'backend': backend, 'steps': steps}, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
@@ -0,0 +1,57 @@
+import threading
+from collections import defaultdict
+from typing import Iterable
+
+
+class TrigramIndex:
+    """
+    In-memory trigram index of short texts (usernames, emails) for the databases without pg_trgm.
+    A substring of three or more characters can only occur in the texts that contain all of its trigrams,
+    so the index narrows the search down to a few candidate rows which the database checks exactly.
+    """
+
+    size = 3
+
+    def __init__(self):
+        self.signature = None
+        self._postings: dict[str, set[int]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def ngrams(cls, text: str) -> set[str]:
+        text = text.lower()
+        return {text[i:i + cls.size] for i in range(len(text) - cls.size + 1)}
+
+    def rebuild(self, rows: Iterable[tuple], signature=None):
+        """
+        The rebuild function indexes all the rows anew.
+
+        :param rows: Iterable[tuple]: Rows of (id, text, ...) to index
+        :param signature: State of the indexed table the index corresponds to
+        """
+        postings = defaultdict(set)
+        for item_id, *texts in rows:
+            for text in texts:
+                for gram in self.ngrams(text or ''):
+                    postings[gram].add(item_id)
+        with self._lock:
+            self._postings = dict(postings)
+            self.signature = signature
+
+    def invalidate(self):
+        with self._lock:
+            self.signature = None
+
+    def candidates(self, query: str) -> set[int] | None:
+        """
+        The candidates function returns ids of the rows which may contain the query.
+
+        :param query: str: Searched substring
+        :return: Ids of the candidate rows or None if the query is too short to use the index
+        """
+        grams = self.ngrams(query)
+        if not grams:
+            return None
+        postings = self._postings
+        matches = sorted((postings.get(gram, set()) for gram in grams), key=len)
+        return matches[0].intersection(*matches[1:])
@@ -0,0 +1,206 @@
+import asyncio
+import os
+import shutil
+import socket
+import time
+import uuid
+from pathlib import Path
+
+from faker import Faker
+from fastapi import HTTPException, UploadFile
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from api.conf.config import settings
+from api.database.db import SessionLocal
+from api.database.models import User, UploadJob, UploadJobStatus
+from api.repository import pictures as repository_pictures
+from api.repository import upload_jobs as repository_upload_jobs
+from api.services.cloud_picture import CloudImage
+
+
+# a spooled file is registered as a job right after it is copied, an older unregistered file is left by a crash
+ORPHAN_SPOOL_AGE = 600
+
+
+class UploadQueueFull(Exception):
+    pass
+
+
+def worker_name() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _copy_to_spool(source, destination: Path):
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    with open(destination, 'wb') as spool_file:
+        shutil.copyfileobj(source, spool_file, settings.upload_chunk_size)
+
+
+class UploadJobQueue:
+    """
+    Queue of pictures accepted by the API and not yet uploaded to the cloud.
+    A fixed number of worker tasks take jobs from the queue, upload the spooled file and create the picture,
+    reporting every stage to the upload_jobs table. The queue itself is in memory, the jobs interrupted
+    by a restart are queued again from the table when the queue starts, see recover.
+    """
+
+    def __init__(self):
+        self.session_factory = SessionLocal
+        self.queue: asyncio.Queue | None = None
+        self.workers: list[asyncio.Task] = []
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=settings.upload_job_queue_size)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(settings.upload_job_workers)]
+        await self.recover()
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def check_capacity(self):
+        if self.queue is None or self.queue.full():
+            raise UploadQueueFull("Upload queue is full. Try again later.")
+
+    async def spool(self, file: UploadFile) -> Path:
+        """
+        The spool function copies the uploaded file to the local spool directory in a thread,
+        so the request can be answered before the picture reaches the cloud.
+
+        :param file: UploadFile: Uploaded picture
+        :return: Path of the spooled file
+        """
+        path = Path(settings.upload_spool_dir) / uuid.uuid4().hex
+        await run_in_threadpool(_copy_to_spool, file.file, path)
+        return path
+
+    async def submit(self, file: UploadFile, description: str, tags: list[str], shared: bool, user: User,
+                     db: AsyncSession) -> UploadJob:
+        """
+        The submit function spools the file, registers the upload job and puts it to the queue.
+        If the queue is full the function raises UploadQueueFull, a job registered by then is marked as failed.
+
+        :param file: UploadFile: Uploaded picture
+        :param description: str: Description of the picture
+        :param tags: list[str]: Tag names of the picture
+        :param shared: bool: Indicate if the picture is shared or not
+        :param user: User: Owner of the picture
+        :param db: AsyncSession: Access the database
+        :return: The queued upload job
+        """
+        self.check_capacity()
+        path = await self.spool(file)
+        job = await repository_upload_jobs.create_upload_job(user, db, description=description, tags=tags,
+                                                             shared=shared, spool_path=str(path),
+                                                             worker=worker_name())
+        try:
+            self.check_capacity()
+            self.queue.put_nowait({'job_id': job.id, 'user_id': user.id, 'path': path, 'description': description,
+                                   'tags': tags, 'shared': shared})
+        except UploadQueueFull as queue_err:
+            path.unlink(missing_ok=True)
+            await repository_upload_jobs.set_upload_job_status(job.id, UploadJobStatus.failed, db, error=str(queue_err))
+            raise
+        return job
+
+    async def recover(self) -> int:
+        """
+        The recover function queues again the unfinished jobs of this host whose process is gone,
+        e.g. after a restart or a crash. A queued or uploading job whose spooled file is still there
+        is started over, the other ones are marked failed: a job interrupted while saving
+        may have created its picture already. A job is taken over with claim_upload_job first,
+        so of the workers recovering together only one handles it. Then the spool directory is cleaned of the files
+        no unfinished job refers to. The jobs of other hosts and of running processes are left to them.
+
+        :return: Number of the jobs queued again
+        """
+        host, kept, dropped, queued = socket.gethostname(), set(), [], 0
+        async with self.session_factory() as db:
+            for job in await repository_upload_jobs.get_unfinished_upload_jobs(db):
+                job_host, _, pid = (job.worker or '').rpartition(':')
+                if job.worker and (job_host != host or int(pid) != os.getpid() and _process_alive(int(pid))):
+                    kept.add(job.spool_path)
+                    continue
+                # the workers of the host start together, the job is recovered by the one which claims it first
+                if not await repository_upload_jobs.claim_upload_job(job.id, job.worker, worker_name(), db):
+                    kept.add(job.spool_path)
+                    continue
+                path = Path(job.spool_path) if job.spool_path else None
+                restartable = job.status in (UploadJobStatus.queued.name, UploadJobStatus.uploading.name)
+                if restartable and path is not None and path.exists() and not self.queue.full():
+                    await repository_upload_jobs.set_upload_job_status(job.id, UploadJobStatus.queued, db)
+                    self.queue.put_nowait({'job_id': job.id, 'user_id': job.user_id, 'path': path,
+                                           'description': job.description, 'tags': job.tags or [],
+                                           'shared': job.shared})
+                    kept.add(job.spool_path)
+                    queued += 1
+                else:
+                    await repository_upload_jobs.set_upload_job_status(
+                        job.id, UploadJobStatus.failed, db, error="The upload was interrupted by a restart")
+                    if path is not None:
+                        dropped.append(path)
+        spool_dir = Path(settings.upload_spool_dir)
+        if spool_dir.is_dir():
+            orphaned_before = time.time() - ORPHAN_SPOOL_AGE
+            dropped.extend(path for path in spool_dir.iterdir()
+                           if str(path) not in kept and path.stat().st_mtime < orphaned_before)
+        for path in dropped:
+            path.unlink(missing_ok=True)
+        return queued
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.process(job)
+            finally:
+                self.queue.task_done()
+
+    async def process(self, job: dict):
+        """
+        The process function runs one upload job: uploads the spooled file to the cloud
+        and creates the picture for the job owner. If the picture is not created, the uploaded file is destroyed.
+
+        :param job: dict: Job parameters put to the queue by the API
+        """
+        picture_url = None
+        async with self.session_factory() as db:
+            try:
+                await repository_upload_jobs.set_upload_job_status(job['job_id'], UploadJobStatus.uploading, db)
+                public_id = Faker().first_name().lower()
+                r = await CloudImage.upload_waiting(str(job['path']), public_id)
+                picture_url = CloudImage.get_url_for_picture(public_id, r)
+
+                await repository_upload_jobs.set_upload_job_status(job['job_id'], UploadJobStatus.saving, db)
+                user = await db.get(User, job['user_id'])
+                picture = await repository_pictures.create_picture(job['description'], job['tags'], picture_url,
+                                                                   job['shared'], db, user)
+            except Exception as err:
+                await db.rollback()
+                if picture_url is not None:
+                    # the picture is not saved, the uploaded file would be left in the storage
+                    await asyncio.gather(CloudImage.destroy_async(picture_url), return_exceptions=True)
+                error = err.detail if isinstance(err, HTTPException) else str(err)
+                await repository_upload_jobs.set_upload_job_status(job['job_id'], UploadJobStatus.failed, db,
+                                                                   error=error)
+            else:
+                await repository_upload_jobs.set_upload_job_status(job['job_id'], UploadJobStatus.done, db,
+                                                                   picture_id=picture.id)
+            finally:
+                job['path'].unlink(missing_ok=True)
+
+
+upload_queue = UploadJobQueue()
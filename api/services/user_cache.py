@@ -0,0 +1,108 @@
+import threading
+import time
+
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from api.conf.config import settings
+from api.database.models import Role, User
+
+
+# the columns of the user checked by the authentication and rendered for the current user; the secrets
+# (password, refresh_token) and the counters are read from the database where they are needed
+CACHED_USER_COLUMNS = frozenset(['id', 'username', 'email', 'role_id', 'confirmed', 'is_active', 'slug', 'avatar',
+                                 'created_at', 'updated_at'])
+
+
+def _column_values(instance, keys: frozenset = None) -> dict:
+    return {attr.key: instance.__dict__[attr.key] for attr in inspect(type(instance)).column_attrs
+            if attr.key in instance.__dict__ and (keys is None or attr.key in keys)}
+
+
+def _detached(model, values: dict):
+    instance = model(**values)
+    make_transient_to_detached(instance)
+    return instance
+
+
+class UserCache:
+    """
+    Short-lived cache of the authenticated users with their roles, keyed by email (the subject of the tokens).
+    The cache keeps plain values of CACHED_USER_COLUMNS; a hit is merged into the session of the request
+    without a query, so the route gets an ordinary persistent User whose other columns are not loaded.
+    Users and roles changed through any session of the worker are dropped from the cache on commit,
+    the TTL bounds the staleness of the changes made by other workers.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._items: dict[str, tuple[float, dict, dict | None]] = {}
+        self._emails: dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    async def get(self, email: str, db: AsyncSession) -> User | None:
+        """
+        The get function returns the cached user attached to the session or None if the user is not cached.
+
+        :param email: str: Email of the user
+        :param db: AsyncSession: Session of the request
+        :return: The user with the loaded role or None
+        """
+        item = self._items.get(email)
+        if item is None or item[0] < time.monotonic():
+            return None
+        _, user_values, role_values = item
+        user = _detached(User, user_values)
+        set_committed_value(user, 'role', _detached(Role, role_values) if role_values else None)
+        return await db.merge(user, load=False)
+
+    def set(self, user: User):
+        role = user.__dict__.get('role')
+        with self._lock:
+            self._items[user.email] = (time.monotonic() + self.ttl, _column_values(user, CACHED_USER_COLUMNS),
+                                       _column_values(role) if role else None)
+            self._emails[user.id] = user.email
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            email = self._emails.pop(user_id, None)
+            self._items.pop(email, None)
+
+    def invalidate_role(self, role_id: int):
+        with self._lock:
+            for email, (_, user_values, _) in list(self._items.items()):
+                if user_values.get('role_id') == role_id:
+                    del self._items[email]
+                    self._emails.pop(user_values.get('id'), None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._emails.clear()
+
+
+user_cache = UserCache(settings.user_cache_ttl)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_users(session, flush_context):
+    changed = session.info.setdefault('user_cache_changed', set())
+    for instance in session.dirty | session.deleted:
+        if isinstance(instance, (User, Role)):
+            changed.add((type(instance), instance.id))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    for model, instance_id in session.info.pop('user_cache_changed', ()):
+        if model is User:
+            user_cache.invalidate(instance_id)
+        else:
+            user_cache.invalidate_role(instance_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_users(session):
+    session.info.pop('user_cache_changed', None)
@@ -5,21 +5,26 @@ from typing import Optional
 from fastapi import Request, APIRouter, Form, HTTPException, Depends, UploadFile, File, status, BackgroundTasks
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
-from psycopg2 import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 import api.routes.profile
+from api.conf.config import settings
 from api.database.db import get_db
-from api.database.models import User, RoleNames
+from api.database.models import Comment, User, RoleNames
 from api.repository.comments import create_comment
-from api.repository.pictures import get_user_pictures, get_all_pictures
+from api.repository.pagination import next_cursor
+from api.repository.pictures import get_user_pictures, get_all_pictures, picture_page_loading
 from api.repository.users import add_to_blacklist
 from api.routes import auth as auth_route, pictures
-from api.schemas.essential import CommentCreate, UserModel, UserStatusChange
+from api.schemas.essential import CommentCreate, UserDbAdmin, UserModel, UserStatusChange
 from api.services.auth import auth_service
 from api.services.cloud_picture import CloudImage
-from api.routes.search import search_by_description, search_by_tag, search_pictures_by_user
-from api.repository.users import get_all_users, get_user_profile
+from api.services.qrcode_cache import conditional_response
+from api.repository.transformations import get_visible_transform_picture
+from api.routes.search import search_by_tag, search_pictures
+from api.repository.users import get_users_status, get_user_profile
 from api.routes.profile import get_user_by_slug
 from front.routes.web_forms import LoginForm, UserCreateForm
 
@@ -35,7 +40,7 @@ async def get_user_token(request: Request) -> str:
         return request.cookies["access_token"].split()[1].strip()
 
 
-async def get_logged_in_user(request: Request, db: Session) -> User:
+async def get_logged_in_user(request: Request, db: AsyncSession) -> User:
     access_token = await get_user_token(request)
     try:
         logged_in_user = await auth_service.get_current_user(access_token, db)
@@ -44,12 +49,16 @@ async def get_logged_in_user(request: Request, db: Session) -> User:
     else:
         return logged_in_user
 
-# TODO: pagination instead hardcode
-PER_PAGE = 100
+PER_PAGE = 20
+
+
+def user_profile_loading() -> tuple:
+    # relationships rendered by parts/user_profile.html
+    return selectinload(User.comments).joinedload(Comment.user),
 
 
 @router.get("/admin/{action}/{user_slug}", response_class=HTMLResponse)
-async def admin_action(request: Request, user_slug: str, action: str, db: Session = Depends(get_db)):
+async def admin_action(request: Request, user_slug: str, action: str, db: AsyncSession = Depends(get_db)):
     logged_in_user = await get_logged_in_user(request, db)
 
     user = await get_user_by_slug(slug=user_slug, db=db)
@@ -66,14 +75,15 @@ async def admin_action(request: Request, user_slug: str, action: str, db: Sessio
 
 
 @router.get("/admin", response_class=HTMLResponse)
-async def admin(request: Request, db: Session = Depends(get_db)):
+async def admin(request: Request, cursor: Optional[str] = None, db: AsyncSession = Depends(get_db)):
     logged_in_user = await get_logged_in_user(request, db)
 
     if logged_in_user.role.name == RoleNames.admin.name:
-        users = await get_all_users(limit=PER_PAGE, offset=0, user=logged_in_user, db=db)
+        users = await get_users_status(PER_PAGE, 0, db, cursor=cursor, fields=UserDbAdmin)
         response = templates.TemplateResponse("admin_area.html", {
             "request": request,
             "users": users,
+            "next_cursor": next_cursor(users, PER_PAGE),
             "is_admin": logged_in_user.role.name == RoleNames.admin.name,
             "your_id": logged_in_user.id
         })
@@ -85,8 +95,8 @@ async def admin(request: Request, db: Session = Depends(get_db)):
 
 
 @router.get("/profile/{user_slug}", response_class=HTMLResponse)
-async def profile(request: Request, user_slug: str, db: Session = Depends(get_db)):
-    user = await get_user_by_slug(slug=user_slug, db=db)
+async def profile(request: Request, user_slug: str, db: AsyncSession = Depends(get_db)):
+    user = await get_user_by_slug(slug=user_slug, db=db, options=user_profile_loading())
     response = templates.TemplateResponse("profile.html", {
         "request": request,
         "user": user,
@@ -96,56 +106,72 @@ async def profile(request: Request, user_slug: str, db: Session = Depends(get_db
 
 
 @router.get("/tag/{tag_name}", response_class=HTMLResponse)
-async def search(request: Request, tag_name: str, db: Session = Depends(get_db)):
-    result2 = await search_by_tag(db=db, tag_name=tag_name) or []
+async def search(request: Request, tag_name: str, db: AsyncSession = Depends(get_db)):
+    result2 = await search_by_tag(db=db, tag_name=tag_name, options=picture_page_loading()) or []
     response = templates.TemplateResponse("index.html", {
         "request": request,
-        "photos": result2,
-        "get_qrcode_func": CloudImage.get_qrcode
+        "photos": result2
     })
     return response
 
 
 @router.post("/search", response_class=HTMLResponse)
-async def search(request: Request, query: str = Form(...), db: Session = Depends(get_db)):
+async def search(request: Request, query: str = Form(...), db: AsyncSession = Depends(get_db)):
     # logged_in_user = await get_logged_in_user(request, db)
-    result1 = search_by_description(db=db, search_query=query) or []
-    result2 = await search_by_tag(db=db, tag_name=query) or []
-    result3 = search_pictures_by_user(db=db, user_query=query) or []
+    photos = await search_pictures(db=db, search_query=query, limit=PER_PAGE, options=picture_page_loading())
     response = templates.TemplateResponse("index.html", {
         "request": request,
-        "photos": list(set([i for i in result1] + [i for i in result2] + [i for i in result3])),
-        "get_qrcode_func": CloudImage.get_qrcode
+        "photos": photos
     })
     return response
 
 
 @router.get("/", response_class=HTMLResponse)
-async def root(request: Request, db: Session = Depends(get_db)):
-    all_pictures = await get_all_pictures(limit=PER_PAGE, offset=0, db=db)
+async def root(request: Request, cursor: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    all_pictures = await get_all_pictures(limit=PER_PAGE, db=db, options=picture_page_loading(), cursor=cursor)
     return templates.TemplateResponse("index.html", {
         "request": request,
         "photos": all_pictures,
-        "get_qrcode_func": CloudImage.get_qrcode
+        "next_cursor": next_cursor(all_pictures, PER_PAGE)
     })
 
 
 @router.get("/authorized", response_class=HTMLResponse)
-async def home_page(request: Request, db: Session = Depends(get_db)):
+async def home_page(request: Request, cursor: Optional[str] = None, my_cursor: Optional[str] = None,
+                    db: AsyncSession = Depends(get_db)):
     logged_in_user = await get_logged_in_user(request, db)
 
-    all_pictures = await get_all_pictures(limit=PER_PAGE, offset=0, db=db)
-    pictures_user = await get_user_pictures(user_id=logged_in_user.id, db=db)
+    all_pictures = await get_all_pictures(limit=PER_PAGE, db=db, options=picture_page_loading(), cursor=cursor)
+    pictures_user = await get_user_pictures(user_id=logged_in_user.id, limit=PER_PAGE, db=db,
+                                            options=picture_page_loading(), cursor=my_cursor)
     response = templates.TemplateResponse("authorized.html", {
         "request": request,
         "photos_user": pictures_user,
         "photos": all_pictures,
-        "get_qrcode_func": CloudImage.get_qrcode,
+        "next_cursor": next_cursor(all_pictures, PER_PAGE),
+        "next_my_cursor": next_cursor(pictures_user, PER_PAGE),
         "user": logged_in_user
     })
     return response
 
 
+@router.get("/qrcode/{transform_picture_id}")
+async def transform_qrcode(request: Request, transform_picture_id: int, db: AsyncSession = Depends(get_db)):
+    logged_in_user = None
+    if await get_user_token(request):
+        try:
+            logged_in_user = await get_logged_in_user(request, db)
+        except HTTPException:
+            pass
+    transformation = await get_visible_transform_picture(transform_picture_id, logged_in_user, db)
+    if transformation is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transformation not found")
+    url, shared = transformation
+    image, etag = CloudImage.get_qrcode_image(url)
+    cache_control = f'{"public" if shared else "private"}, max-age={settings.qrcode_max_age}'
+    return conditional_response(request, image, etag, cache_control, media_type="image/png")
+
+
 @router.get("/register", response_class=HTMLResponse)
 async def register_page(request: Request):
     return templates.TemplateResponse("register.html", {"request": request})
@@ -166,7 +192,7 @@ async def add_comment(
         request: Request,
         comment_text: str = Form(...),
         picture_id: int = Form(...),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
     logged_in_user = await get_logged_in_user(request, db)
     comment = await create_comment(comment_data=CommentCreate(text=comment_text, picture_id=picture_id),
@@ -180,7 +206,7 @@ async def add_comment(
 
 
 @router.post("/login", response_class=HTMLResponse)
-async def login(request: Request, db: Session = Depends(get_db)):
+async def login(request: Request, db: AsyncSession = Depends(get_db)):
     form = LoginForm(request)
     await form.load_data()
     if await form.is_valid():
@@ -202,7 +228,7 @@ async def login(request: Request, db: Session = Depends(get_db)):
 
 
 @router.post("/register", response_class=HTMLResponse)
-async def register(request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+async def register(request: Request, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_db)):
     form = UserCreateForm(request)
     await form.load_data()
     if await form.is_valid():
@@ -226,7 +252,7 @@ async def upload_photo_view(request: Request,
                             description: str = Form(),
                             tags: str = Form(''),
                             file: UploadFile = File(...),
-                            db: Session = Depends(get_db)
+                            db: AsyncSession = Depends(get_db)
                             ):
     try:
         logged_in_user = await get_logged_in_user(request, db)
@@ -246,7 +272,7 @@ async def upload_photo_view(request: Request,
 
 
 @router.get("/logout_user")
-async def logout_user(request: Request, db: Session = Depends(get_db)):
+async def logout_user(request: Request, db: AsyncSession = Depends(get_db)):
     access_token = await get_user_token(request)
     if not access_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
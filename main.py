@@ -1,10 +1,18 @@
-from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, Depends, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.staticfiles import StaticFiles
 from api.routes import pictures, transformations, comments, auth, tags, rating, search, profile, users
 from front.routes import web_route
 from sqlalchemy import text
-from api.database.db import get_db
+from api.database.db import get_db, engine
+from api.database.models import RoleNames, User
+from api.database.pool import pool_metrics
+from api.schemas.essential import PoolStatusResponse
+from api.services.auth import auth_service
+from api.services.password_hashing import password_hasher
+from api.services.token_blacklist import token_blacklist
+from api.services.transform_engine import transform_backends
+from api.services.upload_jobs import upload_queue
 import uvicorn
 
 
@@ -23,11 +31,26 @@ app.include_router(profile.router, prefix='/api')
 # app.include_router(users.router, prefix='/api')
 
 
+@app.on_event("startup")
+async def startup():
+    await token_blacklist.start()
+    await upload_queue.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await upload_queue.stop()
+    await token_blacklist.stop()
+    password_hasher.stop()
+    for backend in transform_backends.values():
+        backend.stop()
+
+
 @app.get("/api/healthchecker")
-def healthchecker(db: Session = Depends(get_db)):
+async def healthchecker(db: AsyncSession = Depends(get_db)):
     try:
         # Make request
-        result = db.execute(text("SELECT 1")).fetchone()
+        result = (await db.execute(text("SELECT 1"))).fetchone()
         if result is None:
             raise HTTPException(status_code=500, detail="Database is not configured correctly")
         return {"message": "Welcome to PictuREST API!"}
@@ -36,6 +59,21 @@ def healthchecker(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="Error connecting to the database")
 
 
+@app.get("/api/healthchecker/pool", response_model=PoolStatusResponse, include_in_schema=False)
+async def pool_status(current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The pool_status function reports the state of the database connection pool: connections checked out,
+    overflow, total checkouts, timeouts and the time requests waited for a free connection (in seconds).
+    The internals of the deployment are shown to the administrators only.
+
+    :param current_user: User: Current user, who must be an administrator
+    :return: Pool counters
+    """
+    if not current_user.role.name == RoleNames.admin.name:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return pool_metrics.snapshot(engine)
+
+
 @app.get("/api/", include_in_schema=False)
 def root():
     return {"message": "Welcome to PictuREST API!"}
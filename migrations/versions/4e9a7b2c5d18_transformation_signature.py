@@ -0,0 +1,28 @@
+"""transformation signature
+
+Revision ID: 4e9a7b2c5d18
+Revises: 8b2f6d0e4c13
+Create Date: 2026-10-18 19:11:45.820513
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e9a7b2c5d18'
+down_revision = '8b2f6d0e4c13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # the existing transformations have no signature, they are still found by pic_trans_url_uniq
+    op.add_column('transformed_pictures', sa.Column('signature', sa.String(length=64), nullable=True))
+    op.create_index('ix_transformed_pictures_picture_id_signature', 'transformed_pictures',
+                    ['picture_id', 'signature'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_transformed_pictures_picture_id_signature', table_name='transformed_pictures')
+    op.drop_column('transformed_pictures', 'signature')
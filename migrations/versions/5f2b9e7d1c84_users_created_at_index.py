@@ -0,0 +1,23 @@
+"""users created_at index
+
+Revision ID: 5f2b9e7d1c84
+Revises: e81c4d7a2f35
+Create Date: 2026-10-19 00:41:26.532718
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2b9e7d1c84'
+down_revision = 'e81c4d7a2f35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_users_created_at_id', 'users', ['created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_created_at_id', table_name='users')
@@ -0,0 +1,34 @@
+"""rating aggregates
+
+Revision ID: 7c1e5a3f9b60
+Revises: 4e9a7b2c5d18
+Create Date: 2026-10-18 21:04:12.306547
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1e5a3f9b60'
+down_revision = '4e9a7b2c5d18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('pictures', sa.Column('rating_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('pictures', sa.Column('rating_sum', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        "UPDATE pictures SET "
+        "rating_count = (SELECT count(*) FROM rating WHERE rating.picture_id = pictures.id), "
+        "rating_sum = (SELECT coalesce(sum(rate), 0) FROM rating WHERE rating.picture_id = pictures.id), "
+        "avg_rating = coalesce((SELECT avg(rate) FROM rating WHERE rating.picture_id = pictures.id), 0)"
+    )
+    op.create_index('ix_pictures_avg_rating_id', 'pictures', ['avg_rating', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_pictures_avg_rating_id', table_name='pictures')
+    op.drop_column('pictures', 'rating_sum')
+    op.drop_column('pictures', 'rating_count')
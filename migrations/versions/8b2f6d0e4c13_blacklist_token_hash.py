@@ -0,0 +1,71 @@
+"""blacklist token hash
+
+Revision ID: 8b2f6d0e4c13
+Revises: d5b3e1c97a24
+Create Date: 2026-10-18 18:24:07.312846
+
+"""
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+from alembic import op
+import sqlalchemy as sa
+from jose import JWTError, jwt
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2f6d0e4c13'
+down_revision = 'd5b3e1c97a24'
+branch_labels = None
+depends_on = None
+
+blacklist_tokens = sa.table(
+    'blacklist_tokens',
+    sa.column('id', sa.Integer),
+    sa.column('token', sa.String),
+    sa.column('token_hash', sa.String),
+    sa.column('expires_at', sa.DateTime),
+)
+
+
+def token_expires_at(token: str) -> datetime:
+    try:
+        return datetime.fromtimestamp(float(jwt.get_unverified_claims(token)['exp']), timezone.utc).replace(tzinfo=None)
+    except (JWTError, KeyError, TypeError, ValueError):
+        # the lifetime of the refresh token, the longest one
+        return datetime.utcnow() + timedelta(days=7)
+
+
+def upgrade() -> None:
+    op.add_column('blacklist_tokens', sa.Column('token_hash', sa.String(length=64), nullable=True))
+    op.add_column('blacklist_tokens', sa.Column('expires_at', sa.DateTime(), nullable=True))
+
+    connection = op.get_bind()
+    now = datetime.utcnow()
+    for row_id, token in connection.execute(sa.select(blacklist_tokens.c.id, blacklist_tokens.c.token)).all():
+        expires_at = token_expires_at(token)
+        if expires_at <= now:
+            # the token is not accepted anyway
+            connection.execute(blacklist_tokens.delete().where(blacklist_tokens.c.id == row_id))
+            continue
+        connection.execute(blacklist_tokens.update().where(blacklist_tokens.c.id == row_id).values(
+            token_hash=hashlib.sha256(token.encode()).hexdigest(), expires_at=expires_at))
+
+    with op.batch_alter_table('blacklist_tokens') as batch_op:
+        batch_op.alter_column('token_hash', existing_type=sa.String(length=64), nullable=False)
+        batch_op.alter_column('expires_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.drop_column('token')
+    op.create_index('ix_blacklist_tokens_token_hash', 'blacklist_tokens', ['token_hash'], unique=True)
+    op.create_index('ix_blacklist_tokens_expires_at', 'blacklist_tokens', ['expires_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_blacklist_tokens_expires_at', table_name='blacklist_tokens')
+    op.drop_index('ix_blacklist_tokens_token_hash', table_name='blacklist_tokens')
+    # the tokens can not be restored from the hashes
+    op.execute(blacklist_tokens.delete())
+    with op.batch_alter_table('blacklist_tokens') as batch_op:
+        batch_op.add_column(sa.Column('token', sa.String(length=500), nullable=False))
+        batch_op.create_unique_constraint('blacklist_tokens_token_key', ['token'])
+        batch_op.drop_column('expires_at')
+        batch_op.drop_column('token_hash')
@@ -0,0 +1,34 @@
+"""unique vote
+
+Revision ID: a3d6f0b8c249
+Revises: 7c1e5a3f9b60
+Create Date: 2026-10-18 22:37:51.148902
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d6f0b8c249'
+down_revision = '7c1e5a3f9b60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # the first vote of a user for a picture is kept, the ones which passed the old check concurrently are dropped
+    op.execute(
+        "DELETE FROM rating WHERE id NOT IN "
+        "(SELECT min(id) FROM rating GROUP BY picture_id, user_id)"
+    )
+    op.execute(
+        "UPDATE pictures SET "
+        "rating_count = (SELECT count(*) FROM rating WHERE rating.picture_id = pictures.id), "
+        "rating_sum = (SELECT coalesce(sum(rate), 0) FROM rating WHERE rating.picture_id = pictures.id), "
+        "avg_rating = coalesce((SELECT avg(rate) FROM rating WHERE rating.picture_id = pictures.id), 0)"
+    )
+    op.create_index('ix_rating_picture_id_user_id', 'rating', ['picture_id', 'user_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_rating_picture_id_user_id', table_name='rating')
@@ -0,0 +1,30 @@
+"""keyset pagination indexes
+
+Revision ID: a7c4e2f19b30
+Revises: 3f1c2a9d8e71
+Create Date: 2026-10-18 14:05:12.704311
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c4e2f19b30'
+down_revision = '3f1c2a9d8e71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_pictures_created_at_id', 'pictures', ['created_at', 'id'])
+    op.create_index('ix_pictures_user_id_created_at_id', 'pictures', ['user_id', 'created_at', 'id'])
+    op.create_index('ix_tags_created_at_id', 'tags', ['created_at', 'id'])
+    op.create_index('ix_transformed_pictures_picture_id_created_at_id', 'transformed_pictures',
+                    ['picture_id', 'created_at', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_transformed_pictures_picture_id_created_at_id', table_name='transformed_pictures')
+    op.drop_index('ix_tags_created_at_id', table_name='tags')
+    op.drop_index('ix_pictures_user_id_created_at_id', table_name='pictures')
+    op.drop_index('ix_pictures_created_at_id', table_name='pictures')
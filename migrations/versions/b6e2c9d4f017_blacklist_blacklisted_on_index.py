@@ -0,0 +1,23 @@
+"""blacklist blacklisted_on index
+
+Revision ID: b6e2c9d4f017
+Revises: 5f2b9e7d1c84
+Create Date: 2026-10-19 10:12:47.108354
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e2c9d4f017'
+down_revision = '5f2b9e7d1c84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_blacklist_tokens_blacklisted_on', 'blacklist_tokens', ['blacklisted_on'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_blacklist_tokens_blacklisted_on', table_name='blacklist_tokens')
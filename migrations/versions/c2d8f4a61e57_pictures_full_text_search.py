@@ -0,0 +1,49 @@
+"""pictures full text search
+
+Revision ID: c2d8f4a61e57
+Revises: a7c4e2f19b30
+Create Date: 2026-10-18 15:21:47.118392
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2d8f4a61e57'
+down_revision = 'a7c4e2f19b30'
+branch_labels = None
+depends_on = None
+
+
+SQLITE_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS pictures_fts USING fts5("
+    "description, content='pictures', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS pictures_fts_ai AFTER INSERT ON pictures BEGIN "
+    "INSERT INTO pictures_fts(rowid, description) VALUES (new.id, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS pictures_fts_ad AFTER DELETE ON pictures BEGIN "
+    "INSERT INTO pictures_fts(pictures_fts, rowid, description) VALUES ('delete', old.id, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS pictures_fts_au AFTER UPDATE OF description ON pictures BEGIN "
+    "INSERT INTO pictures_fts(pictures_fts, rowid, description) VALUES ('delete', old.id, old.description); "
+    "INSERT INTO pictures_fts(rowid, description) VALUES (new.id, new.description); END",
+    "INSERT INTO pictures_fts(pictures_fts) VALUES ('rebuild')",
+]
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == 'sqlite':
+        for statement in SQLITE_FTS_DDL:
+            op.execute(statement)
+        return
+    op.execute("ALTER TABLE pictures ADD COLUMN search_vector tsvector "
+               "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(description, ''))) STORED")
+    op.execute("CREATE INDEX ix_pictures_search_vector ON pictures USING gin (search_vector)")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'sqlite':
+        for trigger in ('pictures_fts_ai', 'pictures_fts_ad', 'pictures_fts_au'):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS pictures_fts")
+        return
+    op.execute("DROP INDEX IF EXISTS ix_pictures_search_vector")
+    op.execute("ALTER TABLE pictures DROP COLUMN IF EXISTS search_vector")
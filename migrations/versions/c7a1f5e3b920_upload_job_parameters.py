@@ -0,0 +1,32 @@
+"""upload job parameters
+
+Revision ID: c7a1f5e3b920
+Revises: b6e2c9d4f017
+Create Date: 2026-10-19 11:03:15.472961
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7a1f5e3b920'
+down_revision = 'b6e2c9d4f017'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('upload_jobs', sa.Column('description', sa.String(length=10000), nullable=True))
+    op.add_column('upload_jobs', sa.Column('tags', sa.JSON(), nullable=True))
+    op.add_column('upload_jobs', sa.Column('shared', sa.Boolean(), nullable=True))
+    op.add_column('upload_jobs', sa.Column('spool_path', sa.String(length=1024), nullable=True))
+    op.add_column('upload_jobs', sa.Column('worker', sa.String(length=255), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('upload_jobs', 'worker')
+    op.drop_column('upload_jobs', 'spool_path')
+    op.drop_column('upload_jobs', 'shared')
+    op.drop_column('upload_jobs', 'tags')
+    op.drop_column('upload_jobs', 'description')
@@ -0,0 +1,31 @@
+"""users trigram indexes
+
+Revision ID: d5b3e1c97a24
+Revises: c2d8f4a61e57
+Create Date: 2026-10-18 16:02:33.551940
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5b3e1c97a24'
+down_revision = 'c2d8f4a61e57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # SQLite searches users through the in-memory trigram index of the application
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE INDEX ix_users_username_trgm ON users USING gin (username gin_trgm_ops)")
+    op.execute("CREATE INDEX ix_users_email_trgm ON users USING gin (email gin_trgm_ops)")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("DROP INDEX IF EXISTS ix_users_email_trgm")
+    op.execute("DROP INDEX IF EXISTS ix_users_username_trgm")
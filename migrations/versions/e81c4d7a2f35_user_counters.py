@@ -0,0 +1,35 @@
+"""user counters
+
+Revision ID: e81c4d7a2f35
+Revises: a3d6f0b8c249
+Create Date: 2026-10-18 23:52:09.417380
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81c4d7a2f35'
+down_revision = 'a3d6f0b8c249'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('pictures_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('comments_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('ratings_received', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        "UPDATE users SET "
+        "pictures_count = (SELECT count(*) FROM pictures WHERE pictures.user_id = users.id), "
+        "comments_count = (SELECT count(*) FROM comments WHERE comments.user_id = users.id), "
+        "ratings_received = (SELECT count(*) FROM rating JOIN pictures ON pictures.id = rating.picture_id "
+        "WHERE pictures.user_id = users.id)"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'ratings_received')
+    op.drop_column('users', 'comments_count')
+    op.drop_column('users', 'pictures_count')
@@ -0,0 +1,123 @@
+"""
+Latency of the login under concurrent load.
+
+Runs a storm of concurrent logins against the application in this process (SQLite test database) while
+a probe requests a cheap endpoint, and prints p50/p99 of both. The probe shows how much the logins
+slow down everything else in the worker. Compare with hashing on the event loop::
+
+    python -m tests.benchmark_login --logins 200 --concurrency 50
+    python -m tests.benchmark_login --logins 200 --concurrency 50 --inline
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import httpx
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from api.conf.config import settings
+from api.database.db import get_db
+from api.database.models import Base, User
+from api.services.password_hashing import hash_password, password_hasher
+from main import app
+from tests.conftest import (ASYNC_SQLALCHEMY_DATABASE_URL, TEST_DB_FILE_NAME, TestingSessionLocal, engine,
+                            seed_roles)
+
+EMAIL = "benchmark@example.com"
+PASSWORD = "benchmark-password"
+
+
+def percentile(values: list[float], percent: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def report(name: str, latencies: list[float]):
+    print(f"{name:>6}: {len(latencies):5} requests, p50 {statistics.median(latencies) * 1000:8.1f} ms, "
+          f"p99 {percentile(latencies, 99) * 1000:8.1f} ms, max {max(latencies) * 1000:8.1f} ms")
+
+
+async def timed(client: httpx.AsyncClient, method: str, url: str, **kwargs) -> float:
+    started = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    assert response.status_code == 200, response.text
+    return time.perf_counter() - started
+
+
+async def storm(logins: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    login_latencies, probe_latencies = [], []
+    data = {"username": EMAIL, "password": PASSWORD}
+
+    async with httpx.AsyncClient(app=app, base_url="http://benchmark") as client:
+        async def login():
+            async with semaphore:
+                login_latencies.append(await timed(client, "POST", "/api/auth/login", data=data))
+
+        async def probe(done: asyncio.Event):
+            while not done.is_set():
+                probe_latencies.append(await timed(client, "GET", "/api/"))
+                await asyncio.sleep(0.01)
+
+        # the first login starts the hashing processes
+        await timed(client, "POST", "/api/auth/login", data=data)
+        done = asyncio.Event()
+        probe_task = asyncio.create_task(probe(done))
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await probe_task
+
+    print(f"{logins} logins, {concurrency} at a time, {elapsed:.1f} s, {logins / elapsed:.1f} logins/s")
+    report("login", login_latencies)
+    report("probe", probe_latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--inline", action="store_true", help="hash on the event loop as the handlers used to")
+    args = parser.parse_args()
+
+    if settings.password_hash_max_pending < args.concurrency:
+        settings.password_hash_max_pending = args.concurrency
+    if args.inline:
+        async def run_inline(func, *func_args):
+            return func(*func_args)
+
+        password_hasher.run = run_inline
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    seed_roles(db)
+    db.add(User(username="benchmark", email=EMAIL, slug="benchmark", confirmed=True, is_active=True,
+                password=hash_password(PASSWORD, settings.password_hash_rounds)))
+    db.commit()
+    db.close()
+
+    # the logins update the refresh tokens, writers wait for the lock of SQLite as long as the storm lasts
+    async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool,
+                                       connect_args={"timeout": 600})
+    session_factory = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def override_get_db():
+        async with session_factory() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        asyncio.run(storm(args.logins, args.concurrency))
+    finally:
+        password_hasher.stop()
+        engine.dispose()
+        os.remove(TEST_DB_FILE_NAME)
+
+
+if __name__ == "__main__":
+    main()
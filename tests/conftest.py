@@ -1,13 +1,32 @@
+import hashlib
+import json
 import os
+import socketserver
+import threading
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+from unittest.mock import patch
 
+import cloudinary
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
 from main import app
-from api.database.models import Base
+from api.conf.config import settings
+from api.database.models import Base, Role, RoleNames, User
 from api.database.db import get_db
+from api.services import storage
+from api.services.response_cache import response_cache
+from api.services.token_blacklist import token_blacklist
+from api.services.upload_jobs import upload_queue
+from api.services.user_cache import user_cache
 
 from pathlib import Path
 
@@ -15,12 +34,46 @@ from pathlib import Path
 TEST_DB_FILE_NAME = Path(__file__).parent / "test.db"
 
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{TEST_DB_FILE_NAME}"
+ASYNC_SQLALCHEMY_DATABASE_URL = f"sqlite+aiosqlite:///{TEST_DB_FILE_NAME}"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# every test module runs the app in its own event loop, so connections must not be pooled between them
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+ROLE_FLAGS = [column.name for column in Role.__table__.columns if column.name.startswith('can_')]
+
+
+def seed_roles(db):
+    # roles are created by migration in a real database
+    db.add_all([
+        Role(name=RoleNames.admin.name, **{flag: True for flag in ROLE_FLAGS}),
+        Role(name=RoleNames.moderator.name, **{flag: flag != 'can_change_user_role' for flag in ROLE_FLAGS}),
+        Role(name=RoleNames.user.name),
+    ])
+    db.commit()
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # the token blacklist is synced in the background every few seconds, the requests do not query it
+        if "FROM blacklist_tokens" not in statement:
+            statements.append(statement)
+
+    # every engine of the process, whichever instance of this module created it
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, "before_cursor_execute", before_cursor_execute)
+
 
 @pytest.fixture(scope="module")
 def session():
@@ -30,10 +83,12 @@ def session():
     Base.metadata.create_all(bind=engine)
 
     db = TestingSessionLocal()
+    seed_roles(db)
     try:
         yield db
     finally:
         db.close()
+        engine.dispose()
         os.remove(TEST_DB_FILE_NAME)
 
 
@@ -41,17 +96,228 @@ def session():
 def client(session):
     # Dependency override
 
-    def override_get_db():
-        try:
-            yield session
-        finally:
-            session.close()
+    async def override_get_db():
+        async with TestingAsyncSessionLocal() as db:
+            yield db
 
     app.dependency_overrides[get_db] = override_get_db
+    upload_queue.session_factory = TestingAsyncSessionLocal
+    token_blacklist.session_factory = TestingAsyncSessionLocal
+    token_blacklist.synced_until = None
+    # the database is created again for every module, the users cached by the previous one are gone
+    user_cache.clear()
+    response_cache.clear()
 
-    yield TestClient(app)
+    with TestClient(app) as test_client:
+        yield test_client
 
 
 @pytest.fixture(scope="module")
 def user():
     return {"username": "testuser", "email": "testuser@example.com", "password": "123456789"}
+
+
+@pytest.fixture(scope="module")
+def auth_headers(client, session, user):
+    with patch("api.routes.auth.send_confirmation_email"):
+        client.post("/api/auth/register", json=user)
+    current_user: User = session.query(User).filter(User.email == user.get('email')).first()
+    current_user.confirmed = True
+    current_user.is_active = True
+    session.commit()
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+class FakeCloudinary(BaseHTTPRequestHandler):
+    """Answers Cloudinary upload API calls like the real service, keeping the received chunks."""
+
+    requests = []
+    release = threading.Event()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.requests.append({"path": self.path, "content_range": self.headers.get("Content-Range"),
+                              "size": len(body)})
+        self.release.wait(timeout=5)
+        response = json.dumps({"public_id": "fake", "version": 1, "resource_type": "image"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_cloudinary(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeCloudinary)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    FakeCloudinary.requests = []
+    FakeCloudinary.release.set()
+    monkeypatch.setattr(cloudinary.config(), "upload_prefix", f"http://127.0.0.1:{server.server_port}", raising=False)
+    yield FakeCloudinary
+    FakeCloudinary.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+class FakeS3(BaseHTTPRequestHandler):
+    """Answers the S3 object calls like MinIO with path-style buckets, keeping the objects in memory."""
+
+    protocol_version = "HTTP/1.1"
+    objects = {}
+    uploads = {}
+    requests = []
+
+    def _respond(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _split(self):
+        path, _, query = self.path.partition("?")
+        return path, dict(parse_qsl(query, keep_blank_values=True))
+
+    def do_PUT(self):
+        path, query = self._split()
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.requests.append(("PUT", path, query.get("partNumber")))
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if "uploadId" in query:
+            self.uploads[query["uploadId"]][int(query["partNumber"])] = body
+        else:
+            self.objects[path] = {"body": body, "content_type": self.headers.get("Content-Type")}
+        self._respond(200, headers={"ETag": etag})
+
+    def do_POST(self):
+        path, query = self._split()
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.requests.append(("POST", path, None))
+        bucket, _, key = path.lstrip("/").partition("/")
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            self.uploads[upload_id] = {}
+            body = (f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                    f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+        else:
+            parts = self.uploads.pop(query["uploadId"])
+            self.objects[path] = {"body": b"".join(parts[n] for n in sorted(parts)), "content_type": None}
+            body = (f"<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                    f"<ETag>\"multipart\"</ETag></CompleteMultipartUploadResult>")
+        self._respond(200, body.encode(), {"Content-Type": "application/xml"})
+
+    def do_GET(self):
+        path, _ = self._split()
+        stored = self.objects.get(path)
+        if stored is None:
+            self._respond(404)
+        else:
+            self._respond(200, stored["body"], {"Content-Type": stored["content_type"] or "binary/octet-stream"})
+
+    def do_DELETE(self):
+        path, _ = self._split()
+        self.requests.append(("DELETE", path, None))
+        self.objects.pop(path, None)
+        self._respond(204)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_s3(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeS3)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    FakeS3.objects, FakeS3.uploads, FakeS3.requests = {}, {}, []
+    monkeypatch.setattr(settings, "storage_backend", "s3")
+    monkeypatch.setattr(settings, "s3_endpoint_url", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(settings, "s3_access_key", "minioadmin")
+    monkeypatch.setattr(settings, "s3_secret_key", "minioadmin")
+    # the client of the storage is made for the endpoint of this server
+    monkeypatch.setattr(storage, "_storages", {})
+    yield FakeS3
+    server.shutdown()
+    server.server_close()
+
+
+class FakeRedis(socketserver.StreamRequestHandler):
+    """Answers the Redis commands of the response cache over RESP2, keeping the keys in memory without expiry."""
+
+    data = {}
+    commands = []
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def _reply(self, value):
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, bytes):
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if isinstance(value, (list, set)):
+            return b"*%d\r\n" % len(value) + b"".join(self._reply(item) for item in value)
+        return f"+{value}\r\n".encode()
+
+    def handle(self):
+        while (args := self._read_command()) is not None:
+            name, args = args[0].decode().upper(), args[1:]
+            self.commands.append(name)
+            if name == "GET":
+                reply = self.data.get(args[0])
+            elif name == "SET":
+                self.data[args[0]] = args[1]
+                reply = "OK"
+            elif name == "SADD":
+                members = self.data.setdefault(args[0], set())
+                reply = len(set(args[1:]) - members)
+                members.update(args[1:])
+            elif name == "SMEMBERS":
+                reply = self.data.get(args[0], set())
+            elif name == "PEXPIRE":
+                reply = int(args[0] in self.data)
+            elif name == "DEL":
+                reply = len([self.data.pop(key) for key in args if key in self.data])
+            elif name == "INCR":
+                self.data[args[0]] = str(int(self.data.get(args[0], 0)) + 1).encode()
+                reply = int(self.data[args[0]])
+            else:
+                self.wfile.write(f"-ERR unknown command '{name}'\r\n".encode())
+                continue
+            self.wfile.write(self._reply(reply))
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeRedis)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    FakeRedis.data, FakeRedis.commands = {}, []
+    monkeypatch.setattr(settings, "response_cache_backend", "redis")
+    monkeypatch.setattr(settings, "redis_host", "127.0.0.1")
+    monkeypatch.setattr(settings, "redis_port", server.server_address[1])
+    # the client of the backend is made for the port of this server
+    monkeypatch.setattr(response_cache, "_backends", {})
+    yield FakeRedis
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from api.database.models import Role, RoleNames, User
+from api.database.pool import MeteredQueuePool, PoolMetrics, pool_metrics
+from api.services.auth import auth_service
+from tests.conftest import ASYNC_SQLALCHEMY_DATABASE_URL
+
+
+def test_pool_status(client, session, auth_headers):
+    assert client.get("/api/healthchecker/pool").status_code == 401
+    # the first registered user is the administrator
+    response = client.get("/api/healthchecker/pool", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["pool_class"]
+    assert data["checked_out"] == 0
+
+
+def test_metered_pool_counts_checkouts_and_timeouts(session):
+    async def exhaust_pool():
+        engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=MeteredQueuePool,
+                                     pool_size=1, max_overflow=0, pool_timeout=0.1)
+        metrics = PoolMetrics()
+        metrics.bind(engine)
+        timeouts_before = pool_metrics.timeouts
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+            assert metrics.snapshot(engine)["checked_out"] == 1
+            with pytest.raises(PoolTimeoutError):
+                async with engine.connect():
+                    pass
+        status = metrics.snapshot(engine)
+        await engine.dispose()
+        return status, pool_metrics.timeouts - timeouts_before
+
+    status, timeouts = asyncio.run(exhaust_pool())
+    assert status["checked_out"] == 0
+    assert status["checkouts"] == 1
+    assert status["size"] == 1
+    assert timeouts == 1
+    assert pool_metrics.wait_time_max >= 0.1
+
+
+def test_pool_status_hidden_from_users(client, session, auth_headers):
+    user_role = session.query(Role).filter(Role.name == RoleNames.user.name).first()
+    session.add(User(username="pooluser", email="pooluser@example.com", password="secret", slug="pooluser",
+                     confirmed=True, is_active=True, role_id=user_role.id))
+    session.commit()
+    token = asyncio.run(auth_service.create_access_token(data={"sub": "pooluser@example.com"}))
+    response = client.get("/api/healthchecker/pool", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 404, response.text
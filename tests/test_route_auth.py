@@ -1,6 +1,13 @@
+import asyncio
+import time
+from datetime import timedelta
 from unittest.mock import MagicMock
 
-from api.database.models import User
+from api.conf.config import settings
+from api.database.models import BlacklistToken, Role, RoleNames, User
+from api.services.auth import auth_service
+from api.services.token_blacklist import TokenBlacklist, to_datetime, token_blacklist, token_expiry, token_hash
+from api.services.user_cache import user_cache
 
 
 def test_user_registration(client, user, monkeypatch):
@@ -39,6 +46,7 @@ def test_login_user_not_confirmed(client, user):
 def test_login_user(client, session, user):
     current_user: User = session.query(User).filter(User.email == user.get('email')).first()
     current_user.confirmed = True
+    current_user.is_active = True
     session.commit()
     response = client.post(
         "/api/auth/login",
@@ -67,3 +75,117 @@ def test_login_wrong_email(client, user):
     assert response.status_code == 401, response.text
     data = response.json()
     assert data["detail"] == "Incorrect login or password"
+
+
+def test_login_rejected_when_hashing_is_busy(client, user, monkeypatch):
+    monkeypatch.setattr(settings, "password_hash_max_pending", 0)
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    assert response.status_code == 503, response.text
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_logout_blacklists_token(client, user):
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    assert client.get("/api/profile/who_am_i", headers=headers).status_code == 200
+
+    response = client.post("/api/auth/logout", headers=headers)
+    assert response.status_code == 200, response.text
+    response = client.get("/api/profile/who_am_i", headers=headers)
+    assert response.status_code == 401, response.text
+
+
+def test_blacklist_sync_from_other_worker(client, session):
+    token = asyncio.run(auth_service.create_access_token(data={"sub": "other-worker@example.com"}))
+    assert not token_blacklist.is_blacklisted(token)
+    # another worker logs the token out
+    session.add(BlacklistToken(token_hash=token_hash(token), expires_at=to_datetime(token_expiry(token))))
+    session.commit()
+    asyncio.run(token_blacklist.sync())
+    assert token_blacklist.is_blacklisted(token)
+
+
+def test_blacklist_sync_finds_rows_committed_late(client, session):
+    first, late = [asyncio.run(auth_service.create_access_token(data={"sub": f"{name}@example.com"}))
+                   for name in ("first", "late")]
+    seen = session.query(BlacklistToken).order_by(BlacklistToken.id.desc()).first()
+    session.add(BlacklistToken(id=seen.id + 10, token_hash=token_hash(first),
+                               expires_at=to_datetime(token_expiry(first)), blacklisted_on=seen.blacklisted_on))
+    session.commit()
+    asyncio.run(token_blacklist.sync())
+    assert token_blacklist.is_blacklisted(first)
+    # a concurrent logout commits a lower id, blacklisted a moment before the row already seen
+    session.add(BlacklistToken(id=seen.id + 5, token_hash=token_hash(late), expires_at=to_datetime(token_expiry(late)),
+                               blacklisted_on=seen.blacklisted_on - timedelta(seconds=1)))
+    session.commit()
+    asyncio.run(token_blacklist.sync())
+    assert token_blacklist.is_blacklisted(late)
+
+
+def test_blacklist_entries_expire():
+    blacklist = TokenBlacklist()
+    blacklist.add("expired", expires_at=time.time() - 1)
+    blacklist.add("short", expires_at=time.time() + 0.05)
+    assert not blacklist.is_blacklisted("expired")
+    assert blacklist.is_blacklisted("short")
+    time.sleep(0.1)
+    blacklist.expire()
+    assert not blacklist.is_blacklisted("short")
+    assert len(blacklist) == 0
+
+
+def test_blacklist_purge_deletes_expired_tokens(client, session):
+    session.add_all([BlacklistToken(token_hash="expired", expires_at=to_datetime(time.time() - 60)),
+                     BlacklistToken(token_hash="alive", expires_at=to_datetime(time.time() + 60))])
+    session.commit()
+    assert asyncio.run(token_blacklist.purge()) >= 1
+    session.expire_all()
+    token_hashes = [row.token_hash for row in session.query(BlacklistToken)]
+    assert "expired" not in token_hashes
+    assert "alive" in token_hashes
+
+
+def test_ban_invalidates_cached_user(client, session, user):
+    admin_role = session.query(Role).filter(Role.name == RoleNames.admin.name).first()
+    session.add(User(username="admin", email="admin@example.com", password="secret", slug="admin",
+                     confirmed=True, is_active=True, role_id=admin_role.id))
+    session.commit()
+    admin_token = asyncio.run(auth_service.create_access_token(data={"sub": "admin@example.com"}))
+    admin_headers = {"Authorization": f"Bearer {admin_token}"}
+    # the token of the login is blacklisted by the logout test
+    token = asyncio.run(auth_service.create_access_token(data={"sub": user["email"]}, expires_delta=3600))
+    auth_headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.get("/api/profile/who_am_i", headers=auth_headers)
+    assert response.status_code == 200, response.text
+
+    response = client.put("/api/profile/deactivate", headers=admin_headers, json={"email": user["email"]})
+    assert response.status_code == 200, response.text
+    response = client.get("/api/profile/who_am_i", headers=auth_headers)
+    assert response.status_code == 403, response.text
+
+    response = client.put("/api/profile/activate", headers=admin_headers, json={"email": user["email"]})
+    assert response.status_code == 200, response.text
+    response = client.get("/api/profile/who_am_i", headers=auth_headers)
+    assert response.status_code == 200, response.text
+
+
+def test_cached_user_keeps_no_secrets(client, session, user):
+    token = asyncio.run(auth_service.create_access_token(data={"sub": user["email"]}, expires_delta=3600))
+    user_cache.clear()
+    response = client.get("/api/profile/who_am_i", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    _, user_values, role_values = user_cache._items[user["email"]]
+    assert user_values["email"] == user["email"] and role_values["name"]
+    assert not {"password", "refresh_token", "pictures_count", "comments_count"} & set(user_values)
+
+    # a hit serves the current user without the columns left out
+    response = client.get("/api/profile/who_am_i", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert response.json()["email"] == user["email"]
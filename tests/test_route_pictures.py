@@ -0,0 +1,417 @@
+import asyncio
+import io
+import os
+import subprocess
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from api.conf.config import settings
+from api.database.models import Comment, Picture, Tag, TransformedPicture, UploadJob, User
+from api.repository import pictures as repository_pictures
+from api.services.cloud_picture import CloudImage, UploadLimitExceeded
+from api.services.response_cache import MemoryCacheBackend, response_cache
+from api.services.storage import Storage, get_storage
+from api.services.upload_jobs import UploadJobQueue, worker_name
+from tests.conftest import TestingAsyncSessionLocal, count_queries
+
+
+def test_create_picture_uploads_in_chunks(client, auth_headers, fake_cloudinary, monkeypatch):
+    monkeypatch.setattr(settings, "upload_chunk_size", 1024)
+    response = client.post(
+        "/api/pictures/",
+        headers=auth_headers,
+        data={"description": "chunked picture", "tags": "cat,dog"},
+        files={"file": ("picture.png", io.BytesIO(b"x" * 2500), "image/png")},
+    )
+    assert response.status_code == 201, response.text
+    data = response.json()
+    assert data["description"] == "chunked picture"
+    assert sorted(tag["name"] for tag in data["tags"]) == ["cat", "dog"]
+    assert [r["content_range"] for r in fake_cloudinary.requests] == [
+        "bytes 0-1023/2500", "bytes 1024-2047/2500", "bytes 2048-2499/2500"
+    ]
+    assert all(r["path"].endswith("/image/upload") for r in fake_cloudinary.requests)
+
+
+def test_create_picture_upload_limit(client, auth_headers, fake_cloudinary, monkeypatch):
+    monkeypatch.setattr(settings, "max_concurrent_uploads", 1)
+    monkeypatch.setattr(CloudImage, "uploads_in_progress", 1)
+    response = client.post(
+        "/api/pictures/",
+        headers=auth_headers,
+        data={"description": "rejected picture"},
+        files={"file": ("picture.png", io.BytesIO(b"x" * 100), "image/png")},
+    )
+    assert response.status_code == 503, response.text
+    assert response.headers["Retry-After"] == "1"
+    assert fake_cloudinary.requests == []
+
+
+def test_upload_async_does_not_block_event_loop(fake_cloudinary, monkeypatch):
+    monkeypatch.setattr(settings, "max_concurrent_uploads", 1)
+    fake_cloudinary.release.clear()
+
+    async def upload_twice():
+        first = asyncio.create_task(CloudImage.upload_async(io.BytesIO(b"x" * 10), "first"))
+        while not fake_cloudinary.requests:
+            # the loop keeps running while the upload waits for the cloud
+            await asyncio.sleep(0.01)
+        with pytest.raises(UploadLimitExceeded):
+            await CloudImage.upload_async(io.BytesIO(b"x" * 10), "second")
+        fake_cloudinary.release.set()
+        return await first
+
+    result = asyncio.run(upload_twice())
+    assert result["version"] == 1
+    assert CloudImage.uploads_in_progress == 0
+
+
+def test_upload_waiting_takes_freed_slot(fake_cloudinary, monkeypatch):
+    monkeypatch.setattr(settings, "max_concurrent_uploads", 1)
+    fake_cloudinary.release.clear()
+
+    async def upload_in_turn():
+        first = asyncio.create_task(CloudImage.upload_async(io.BytesIO(b"x" * 10), "first"))
+        while not fake_cloudinary.requests:
+            await asyncio.sleep(0.01)
+        waiting = asyncio.create_task(CloudImage.upload_waiting(io.BytesIO(b"x" * 10), "waiting"))
+        await asyncio.sleep(0.05)
+        # the waiting upload does not reach the cloud while the slot is taken
+        assert not waiting.done() and len(fake_cloudinary.requests) == 1
+        fake_cloudinary.release.set()
+        return await asyncio.gather(first, waiting)
+
+    assert [result["version"] for result in asyncio.run(upload_in_turn())] == [1, 1]
+    assert len(fake_cloudinary.requests) == 2
+    assert CloudImage.uploads_in_progress == 0
+
+
+def wait_for_job(client, auth_headers, job_id):
+    for _ in range(100):
+        response = client.get(f"/api/pictures/jobs/{job_id}", headers=auth_headers)
+        assert response.status_code == 200, response.text
+        if response.json()["status"] in ("done", "failed"):
+            return response.json()
+        time.sleep(0.05)
+    raise AssertionError(f"Upload job {job_id} is not finished")
+
+
+def test_create_picture_job(client, auth_headers, fake_cloudinary):
+    fake_cloudinary.release.clear()
+    response = client.post(
+        "/api/pictures/jobs/",
+        headers=auth_headers,
+        data={"description": "background picture", "tags": "bird"},
+        files={"file": ("picture.png", io.BytesIO(b"x" * 100), "image/png")},
+    )
+    assert response.status_code == 202, response.text
+    job_id = response.json()["id"]
+    # the response does not wait for the cloud
+    assert response.json()["status"] == "queued"
+
+    fake_cloudinary.release.set()
+    job = wait_for_job(client, auth_headers, job_id)
+    assert job["status"] == "done", job
+    response = client.get(f"/api/pictures/{job['picture_id']}", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["description"] == "background picture"
+    assert [tag["name"] for tag in response.json()["tags"]] == ["bird"]
+
+
+def test_create_picture_job_failed(client, auth_headers, monkeypatch):
+    def cloud_error(file, public_id):
+        raise ValueError("Cloud is not available")
+
+    monkeypatch.setattr(CloudImage, "upload", cloud_error)
+    response = client.post(
+        "/api/pictures/jobs/",
+        headers=auth_headers,
+        files={"file": ("picture.png", io.BytesIO(b"x" * 100), "image/png")},
+    )
+    assert response.status_code == 202, response.text
+    job = wait_for_job(client, auth_headers, response.json()["id"])
+    assert job["status"] == "failed"
+    assert job["error"] == "Cloud is not available"
+
+
+def test_get_picture_job_not_found(client, auth_headers):
+    response = client.get("/api/pictures/jobs/unknown", headers=auth_headers)
+    assert response.status_code == 404, response.text
+
+
+def test_recover_upload_jobs_after_restart(client, session, user, auth_headers, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "upload_spool_dir", str(tmp_path))
+    owner = session.query(User).filter(User.email == user.get("email")).first()
+    dead = subprocess.Popen(["true"])
+    dead.wait()
+    crashed = f"{worker_name().rpartition(':')[0]}:{dead.pid}"
+    jobs = {}
+    for name, status, spooled, worker in [("queued", "queued", True, crashed), ("lost", "uploading", False, crashed),
+                                          ("saving", "saving", True, crashed), ("other", "queued", True, "other:1")]:
+        path = tmp_path / name
+        if spooled:
+            path.write_bytes(b"x")
+        jobs[name] = UploadJob(id=f"recover-{name}", user_id=owner.id, status=status, description=name,
+                               tags=["recovered"], shared=True, spool_path=str(path), worker=worker)
+    session.add_all(jobs.values())
+    session.commit()
+    orphan = tmp_path / "orphan"
+    orphan.write_bytes(b"x")
+    os.utime(orphan, (time.time() - 3600, time.time() - 3600))
+
+    async def recover():
+        # two workers of the host start together
+        queues = [UploadJobQueue() for _ in range(2)]
+        for queue in queues:
+            queue.session_factory = TestingAsyncSessionLocal
+            queue.queue = asyncio.Queue()
+        queued = await asyncio.gather(*[queue.recover() for queue in queues])
+        return sum(queued), [queue.queue.get_nowait()["job_id"] for queue in queues
+                             for _ in range(queue.queue.qsize())]
+
+    assert asyncio.run(recover()) == (1, ["recover-queued"])
+    session.expire_all()
+    statuses = {name: session.get(UploadJob, job.id).status for name, job in jobs.items()}
+    assert statuses == {"queued": "queued", "lost": "failed", "saving": "failed", "other": "queued"}
+    assert session.get(UploadJob, "recover-queued").worker == worker_name()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["other", "queued"]
+
+
+def test_create_picture_job_destroys_unsaved_upload(client, auth_headers, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "storage_backend", "local")
+    monkeypatch.setattr(settings, "local_store_dir", str(tmp_path))
+
+    async def save_error(*args, **kwargs):
+        raise ValueError("Database is not available")
+
+    monkeypatch.setattr(repository_pictures, "create_picture", save_error)
+    response = client.post(
+        "/api/pictures/jobs/",
+        headers=auth_headers,
+        files={"file": ("picture.png", io.BytesIO(png_bytes()), "image/png")},
+    )
+    assert response.status_code == 202, response.text
+    job = wait_for_job(client, auth_headers, response.json()["id"])
+    assert job["status"] == "failed"
+    assert job["error"] == "Database is not available"
+    assert not list(tmp_path.rglob("*.png"))
+
+
+def add_pictures(session, user, count):
+    owner = session.query(User).filter(User.email == user.get("email")).first()
+    first = session.query(Picture).count()
+    for i in range(first, first + count):
+        picture = Picture(picture_url=f"https://example.com/{i}.png", description="listed picture", user_id=owner.id,
+                          tags=[Tag(name=f"listed-{i}-{n}") for n in range(2)])
+        picture.comments = [Comment(text="nice", user_id=owner.id) for _ in range(2)]
+        picture.transformed_pictures = [TransformedPicture(url=f"https://example.com/{i}-{n}.png") for n in range(2)]
+        session.add(picture)
+    session.commit()
+    # the pictures are added past the repository, which invalidates the cached listings
+    response_cache.clear()
+
+
+@pytest.mark.parametrize("url", ["/api/pictures/pictures/?limit=100", "/"])
+def test_picture_list_query_count(client, session, user, auth_headers, url):
+    add_pictures(session, user, 3)
+    with count_queries() as few_pictures:
+        response = client.get(url)
+    assert response.status_code == 200, response.text
+
+    add_pictures(session, user, 10)
+    with count_queries() as many_pictures:
+        response = client.get(url)
+    assert response.status_code == 200, response.text
+    # every relationship of the page is loaded by one query, whatever the number of pictures
+    assert len(many_pictures) == len(few_pictures) <= 5
+
+
+def test_authenticated_request_uses_cached_user(client, auth_headers):
+    response = client.get("/api/pictures/user_pictures/", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    with count_queries() as statements:
+        response = client.get("/api/pictures/user_pictures/", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    assert statements
+    assert not [statement for statement in statements if "FROM users" in statement]
+
+
+def png_bytes(size=(8, 8), noise=False):
+    pixels = np.random.randint(0, 256, (*size, 3), dtype=np.uint8) if noise else np.zeros((*size, 3), np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_create_picture_local_storage(client, auth_headers, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "storage_backend", "local")
+    monkeypatch.setattr(settings, "local_store_dir", str(tmp_path))
+    image = png_bytes()
+    response = client.post("/api/pictures/", headers=auth_headers, data={"description": "local picture"},
+                           files={"file": ("picture.png", io.BytesIO(image), "image/png")})
+    assert response.status_code == 201, response.text
+    url = response.json()["picture_url"]
+    assert url.startswith(f"{settings.local_store_url}/pictures/") and url.endswith(".png")
+    path = tmp_path / url.removeprefix(f"{settings.local_store_url}/")
+    assert path.read_bytes() == image
+
+    get_storage().destroy(url)
+    assert not path.exists()
+
+    response = client.post("/api/pictures/", headers=auth_headers,
+                           files={"file": ("picture.png", io.BytesIO(b"not an image"), "image/png")})
+    assert response.status_code == 400, response.text
+    assert response.json()["detail"] == "Invalid image file"
+
+
+def test_create_picture_s3_storage(client, auth_headers, fake_s3):
+    image = png_bytes()
+    response = client.post("/api/pictures/", headers=auth_headers, data={"description": "s3 picture"},
+                           files={"file": ("picture.png", io.BytesIO(image), "image/png")})
+    assert response.status_code == 201, response.text
+    url = response.json()["picture_url"]
+    path = url.removeprefix(settings.s3_endpoint_url)
+    assert path.startswith(f"/{settings.s3_bucket}/pictures/")
+    assert fake_s3.objects[path] == {"body": image, "content_type": "image/png"}
+
+    get_storage().destroy(url)
+    assert path not in fake_s3.objects
+
+
+def test_remove_picture_destroys_in_upload_thread(client, auth_headers, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "storage_backend", "local")
+    monkeypatch.setattr(settings, "local_store_dir", str(tmp_path))
+    response = client.post("/api/pictures/", headers=auth_headers, data={"description": "removed picture"},
+                           files={"file": ("picture.png", io.BytesIO(png_bytes()), "image/png")})
+    assert response.status_code == 201, response.text
+    storage, threads = get_storage(), []
+    destroy = storage.destroy
+    monkeypatch.setattr(storage, "destroy", lambda url: threads.append(threading.current_thread().name) or destroy(url))
+    response = client.delete(f"/api/pictures/{response.json()['id']}", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    assert len(threads) == 1 and threads[0].startswith("cloud-upload")
+    assert not list(tmp_path.rglob("*.png"))
+
+    with pytest.raises(TypeError):
+        Storage()
+
+
+def test_s3_storage_uploads_in_parts(fake_s3, monkeypatch):
+    # the smallest part S3 takes
+    monkeypatch.setattr(settings, "upload_chunk_size", 5 * 1024 * 1024)
+    image = png_bytes((1600, 1600), noise=True)
+    uploaded = CloudImage.upload(io.BytesIO(image), "big")
+    path = f"/{settings.s3_bucket}/{uploaded['key']}"
+    assert fake_s3.objects[path]["body"] == image
+    assert sorted(part for method, _, part in fake_s3.requests if method == "PUT") == ["1", "2"]
+
+
+def test_create_pictures_batch(client, session, auth_headers, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "storage_backend", "local")
+    monkeypatch.setattr(settings, "local_store_dir", str(tmp_path))
+    session.add(Tag(name="batch-old"))
+    session.commit()
+    files = [("files", (f"{name}.png", io.BytesIO(data), "image/png"))
+             for name, data in [("first", png_bytes()), ("broken", b"not an image"), ("second", png_bytes())]]
+    with count_queries() as statements:
+        response = client.post("/api/pictures/batch/", headers=auth_headers, files=files,
+                               data={"descriptions": ["first picture", "broken picture", "second picture"],
+                                     "tags": ["batch-old,batch-new", "batch-new", "batch-new, batch-other"]})
+    assert response.status_code == 201, response.text
+    first, broken, second = response.json()
+    assert first["picture"]["description"] == "first picture"
+    assert sorted(tag["name"] for tag in first["picture"]["tags"]) == ["batch-new", "batch-old"]
+    assert sorted(tag["name"] for tag in second["picture"]["tags"]) == ["batch-new", "batch-other"]
+    assert broken == {"filename": "broken.png", "picture": None, "error": "Invalid image file"}
+    assert len([statement for statement in statements if statement.startswith("SELECT tags.")]) == 1
+    assert session.query(Tag).filter(Tag.name == "batch-new").count() == 1
+
+
+def test_add_tags_to_picture_in_one_round_trip(client, session, user, auth_headers):
+    owner = session.query(User).filter(User.email == user.get("email")).first()
+    picture = Picture(picture_url="https://example.com/tagged.png", user_id=owner.id)
+    session.add_all([picture, Tag(name="bulk-old")])
+    session.commit()
+    with count_queries() as statements:
+        response = client.post(f"/api/tags/pictures/{picture.id}/tags", headers=auth_headers,
+                               data={"tags": ["bulk-old, bulk-new", "bulk-other"]})
+    assert response.status_code == 200, response.text
+    assert sorted(tag["name"] for tag in response.json()["tags"]) == ["bulk-new", "bulk-old", "bulk-other"]
+    assert len([statement for statement in statements if "WHERE tags.name IN" in statement]) == 1
+    assert len([statement for statement in statements if statement.startswith("INSERT INTO tags")]) == 1
+
+
+def test_picture_list_cached_until_comment(client, session, user, auth_headers):
+    add_pictures(session, user, 2)
+    url = "/api/pictures/pictures/?limit=2&offset=0"
+    response = client.get(url)
+    assert response.status_code == 200, response.text
+    assert response.headers["X-Cache"] == "MISS"
+    with count_queries() as statements:
+        cached = client.get("/api/pictures/pictures/?offset=0&limit=2&cursor=")
+    assert cached.headers["X-Cache"] == "HIT"
+    assert cached.json() == response.json()
+    assert cached.headers["X-Next-Cursor"] == response.headers["X-Next-Cursor"]
+    assert statements == []
+
+    picture_id = response.json()[0]["id"]
+    response = client.post("/api/comments/", headers=auth_headers, json={"text": "fresh", "picture_id": picture_id})
+    assert response.status_code == 200, response.text
+    response = client.get(url)
+    assert response.headers["X-Cache"] == "MISS"
+    assert "fresh" in [comment["text"] for comment in response.json()[0]["comments"]]
+
+
+def test_memory_cache_evicts_least_recently_used():
+    async def fill():
+        backend = MemoryCacheBackend(max_items=2)
+        await backend.set("first", b"1", 30, ["pictures"])
+        await backend.set("second", b"2", 30, ["picture:1"])
+        await backend.get("first")
+        await backend.set("third", b"3", 30, ["pictures"])
+        kept = [await backend.get(key) for key in ("first", "second", "third")]
+        await backend.invalidate(["pictures"])
+        return kept, [await backend.get(key) for key in ("first", "third")], await backend.generation()
+
+    kept, invalidated, generation = asyncio.run(fill())
+    assert kept == [b"1", None, b"3"]
+    assert invalidated == [None, None]
+    assert generation == 1
+
+
+def test_picture_list_cached_in_redis(client, session, user, auth_headers, fake_redis):
+    add_pictures(session, user, 1)
+    url = "/api/pictures/pictures/?limit=1"
+    assert client.get(url).headers["X-Cache"] == "MISS"
+    assert client.get(url).headers["X-Cache"] == "HIT"
+    assert b"picturest:cache:label:pictures" in fake_redis.data
+
+    picture_id = client.get(url).json()[0]["id"]
+    response = client.put(f"/api/pictures/{picture_id}", headers=auth_headers,
+                          json={"description": "changed in redis", "tags": []})
+    assert response.status_code == 200, response.text
+    response = client.get(url)
+    assert response.headers["X-Cache"] == "MISS"
+    assert response.json()[0]["description"] == "changed in redis"
+
+
+def test_tags_cursor_pagination_with_default_timestamps(client, session):
+    # the tags get the default created_at, all of them in the same second
+    session.add_all([Tag(name=f"paged-{n}") for n in range(6)])
+    session.commit()
+    response_cache.clear()
+    expected = [tag.id for tag in session.query(Tag).order_by(Tag.created_at.desc(), Tag.id.desc())]
+
+    pages, cursor = [], None
+    while True:
+        response = client.get("/api/tags/", params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200, response.text
+        pages.append([tag["id"] for tag in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None or len(pages) > len(expected):
+            break
+    assert sum(pages, []) == expected
@@ -0,0 +1,164 @@
+import asyncio
+import io
+from datetime import datetime, timedelta
+
+from api.conf.config import settings
+from api.database.models import Comment, Picture, Rating, Role, RoleNames, User
+from api.repository.counters import reconcile_user_counters
+from api.services.auth import auth_service
+from tests.conftest import TestingAsyncSessionLocal, count_queries
+from tests.test_route_pictures import png_bytes
+
+
+def profile(client, auth_headers):
+    response = client.get("/api/profile/who_am_i", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    return data["photos_count"], data["comments_count"], data["ratings_received"]
+
+
+def test_profile_counters_follow_writes(client, session, user, auth_headers, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "storage_backend", "local")
+    monkeypatch.setattr(settings, "local_store_dir", str(tmp_path))
+    assert profile(client, auth_headers) == (0, 0, 0)
+
+    response = client.post("/api/pictures/", headers=auth_headers, data={"description": "counted"},
+                           files={"file": ("picture.png", io.BytesIO(png_bytes()), "image/png")})
+    assert response.status_code == 201, response.text
+    picture_id = response.json()["id"]
+    for text in ("first", "second"):
+        response = client.post("/api/comments/", headers=auth_headers, json={"text": text, "picture_id": picture_id})
+        assert response.status_code == 200, response.text
+    comment_id = response.json()["id"]
+    assert profile(client, auth_headers) == (1, 2, 0)
+
+    response = client.delete(f"/api/comments/{comment_id}", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    with count_queries() as statements:
+        assert profile(client, auth_headers) == (1, 1, 0)
+    # the profile is one fetch of the user by its primary key
+    assert len(statements) == 1 and "FROM users" in statements[0]
+
+    response = client.delete(f"/api/pictures/{picture_id}", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    assert profile(client, auth_headers) == (0, 0, 0)
+
+
+def test_votes_count_for_the_owner_of_the_picture(client, session, auth_headers):
+    owner = User(username="voted", email="voted@example.com", password="secret", slug="voted")
+    session.add(owner)
+    session.commit()
+    picture = Picture(picture_url="https://example.com/voted.png", user_id=owner.id)
+    session.add(picture)
+    session.commit()
+
+    response = client.post(f"/api/rating/pictures/{picture.id}/5", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    response = client.get(f"/api/profile/{owner.slug}")
+    assert response.status_code == 200, response.text
+    assert response.json()["ratings_received"] == 1
+
+
+def test_reconcile_user_counters(client, session, user):
+    async def reconcile():
+        async with TestingAsyncSessionLocal() as db:
+            return await reconcile_user_counters(db)
+
+    # the pictures added by the tests without the repositories are counted
+    asyncio.run(reconcile())
+    current = session.query(User).filter(User.email == user.get("email")).first()
+    expected = (current.pictures_count, current.comments_count, current.ratings_received)
+    current.pictures_count, current.comments_count = 7, -1
+    session.commit()
+
+    assert asyncio.run(reconcile()) == 1
+    session.refresh(current)
+    assert (current.pictures_count, current.comments_count, current.ratings_received) == expected
+    assert asyncio.run(reconcile()) == 0
+
+
+def test_remove_picture_with_comments_and_votes(client, session, auth_headers, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "storage_backend", "local")
+    monkeypatch.setattr(settings, "local_store_dir", str(tmp_path))
+    user_role = session.query(Role).filter(Role.name == RoleNames.user.name).first()
+    commenter = User(username="commenter", email="commenter@example.com", password="secret", slug="commenter",
+                     confirmed=True, is_active=True, role_id=user_role.id)
+    session.add(commenter)
+    session.commit()
+    token = asyncio.run(auth_service.create_access_token(data={"sub": commenter.email}))
+    commenter_headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.post("/api/pictures/", headers=auth_headers, data={"description": "discussed"},
+                           files={"file": ("picture.png", io.BytesIO(png_bytes()), "image/png")})
+    assert response.status_code == 201, response.text
+    picture_id = response.json()["id"]
+    response = client.post("/api/comments/", headers=commenter_headers, json={"text": "nice", "picture_id": picture_id})
+    assert response.status_code == 200, response.text
+    response = client.post(f"/api/rating/pictures/{picture_id}/4", headers=commenter_headers)
+    assert response.status_code == 200, response.text
+    session.refresh(commenter)
+    assert commenter.comments_count == 1
+
+    response = client.delete(f"/api/pictures/{picture_id}", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    assert session.query(Comment).filter(Comment.user_id == commenter.id).count() == 0
+    assert session.query(Rating).filter(Rating.user_id == commenter.id).count() == 0
+    session.refresh(commenter)
+    assert commenter.comments_count == 0
+
+    async def reconcile():
+        async with TestingAsyncSessionLocal() as db:
+            return await reconcile_user_counters(db)
+
+    # the counters match the rows left
+    assert asyncio.run(reconcile()) == 0
+
+
+def test_admin_user_listing_pages_and_filters(client, session, auth_headers):
+    # newer than the users of the other tests
+    first = datetime(2100, 1, 1)
+    role = session.query(Role).filter(Role.name == "user").one()
+    for i in range(5):
+        session.add(User(username=f"listed{i}", email=f"listed{i}@example.com", password="secret", slug=f"listed{i}",
+                         is_active=i % 2 == 0, confirmed=True, role_id=role.id, created_at=first + timedelta(days=i)))
+    session.commit()
+
+    def listing(**params):
+        response = client.get("/api/profile/admin/all_users", headers=auth_headers, params=params)
+        assert response.status_code == 200, response.text
+        return [user["username"] for user in response.json()], response.headers.get("X-Next-Cursor")
+
+    with count_queries() as statements:
+        page, cursor = listing(limit=2, is_active=False)
+    assert page == ["listed3", "listed1"] and cursor
+    assert "password" not in statements[-1] and "refresh_token" not in statements[-1]
+    page, _ = listing(limit=2, is_active=False, cursor=cursor)
+    assert not [name for name in page if name.startswith("listed")]
+
+    names = []
+    cursor = None
+    while True:
+        page, cursor = listing(limit=2, role="user", confirmed=True, **({"cursor": cursor} if cursor else {}))
+        names += page
+        if not cursor:
+            break
+    assert [name for name in names if name.startswith("listed")] == [f"listed{i}" for i in range(4, -1, -1)]
+    assert listing(role="admin")[0] == [session.query(User).order_by(User.id).first().username]
+
+    response = client.get("/api/profile/admin/all_users", headers=auth_headers, params={"role": "nobody"})
+    assert response.status_code == 422, response.text
+
+
+def test_admin_page_renders_the_listing_columns(client, session, auth_headers):
+    client.cookies.set("access_token", auth_headers["Authorization"])
+    try:
+        with count_queries() as statements:
+            response = client.get("/admin")
+    finally:
+        client.cookies.clear()
+    assert response.status_code == 200, response.text
+    assert "listed4" in response.text and "Коментарі:" in response.text
+    listing = [statement for statement in statements if "FROM users" in statement and "LIMIT" in statement]
+    assert len(listing) == 1
+    assert "password" not in listing[0] and "refresh_token" not in listing[0]
+    assert not [statement for statement in statements if "FROM comments" in statement]
@@ -0,0 +1,133 @@
+import asyncio
+
+from fastapi import HTTPException
+from sqlalchemy.dialects import postgresql
+
+from api.database.models import Picture, Rating, Role, RoleNames, User
+from api.repository import rating as repository_rating
+from api.services.auth import auth_service
+from tests.conftest import TestingAsyncSessionLocal, count_queries
+
+
+def add_picture(session, description):
+    owner = session.query(User).filter(User.email == "owner@example.com").first()
+    if owner is None:
+        owner = User(username="owner", email="owner@example.com", password="secret", slug="owner")
+        session.add(owner)
+        session.commit()
+    picture = Picture(picture_url=f"https://example.com/{description}.png", description=description,
+                      user_id=owner.id)
+    session.add(picture)
+    session.commit()
+    return picture.id
+
+
+def aggregates(session, picture_id):
+    session.expire_all()
+    picture = session.get(Picture, picture_id)
+    return picture.rating_count, picture.rating_sum, float(picture.avg_rating)
+
+
+def test_vote_updates_rating_aggregates(client, session, auth_headers):
+    picture_id = add_picture(session, "voted")
+    with count_queries() as statements:
+        response = client.post(f"/api/rating/pictures/{picture_id}/4", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    assert aggregates(session, picture_id) == (1, 4, 4.0)
+    # the aggregates are incremented in place, the votes of the picture are not read again
+    assert not [statement for statement in statements if "avg(" in statement.lower()]
+
+    rate_id = response.json()["id"]
+    response = client.put(f"/api/rating/edit/{rate_id}/2", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    assert aggregates(session, picture_id) == (1, 2, 2.0)
+
+    response = client.delete(f"/api/rating/delete/{rate_id}", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    assert aggregates(session, picture_id) == (0, 0, 0.0)
+
+
+def test_vote_is_changed_by_its_author_and_moderators(client, session, auth_headers):
+    picture_id = add_picture(session, "guarded")
+    user_role = session.query(Role).filter(Role.name == RoleNames.user.name).first()
+    voter, author = [User(username=name, email=f"{name}@example.com", password="secret", slug=name, confirmed=True,
+                          is_active=True, role_id=user_role.id) for name in ("voter", "author")]
+    session.add_all([voter, author])
+    session.commit()
+    rate = Rating(picture_id=picture_id, user_id=author.id, rate=3)
+    session.add(rate)
+    session.commit()
+    token = asyncio.run(auth_service.create_access_token(data={"sub": voter.email}))
+    voter_headers = {"Authorization": f"Bearer {token}"}
+
+    # the vote of another user is not available to a user
+    assert client.put(f"/api/rating/edit/{rate.id}/1", headers=voter_headers).status_code == 404
+    assert client.delete(f"/api/rating/delete/{rate.id}", headers=voter_headers).status_code == 404
+    session.expire_all()
+    assert session.get(Rating, rate.id).rate == 3
+
+    # the first registered user is the admin
+    response = client.put(f"/api/rating/edit/{rate.id}/1", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["rate"] == 1
+
+
+def test_search_orders_and_filters_by_rating(client, session, auth_headers):
+    low, high = add_picture(session, "lake low"), add_picture(session, "lake high")
+    assert client.post(f"/api/rating/pictures/{low}/2", headers=auth_headers).status_code == 200
+    assert client.post(f"/api/rating/pictures/{high}/5", headers=auth_headers).status_code == 200
+
+    response = client.get("/api/search/description/", headers=auth_headers,
+                          params={"search_query": "lake", "order_by": "rating"})
+    assert response.status_code == 200, response.text
+    assert [picture["id"] for picture in response.json()] == [high, low]
+
+
+def test_vote_is_one_insert_and_rejections_are_reported(client, session, user, auth_headers):
+    picture_id = add_picture(session, "once")
+    with count_queries() as statements:
+        response = client.post(f"/api/rating/pictures/{picture_id}/3", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    # the checks are part of the insert, an accepted vote only writes
+    assert not [statement for statement in statements if statement.startswith("SELECT")]
+    assert statements[0].startswith("INSERT INTO rating") and "ON CONFLICT" in statements[0]
+
+    response = client.post(f"/api/rating/pictures/{picture_id}/5", headers=auth_headers)
+    assert response.status_code == 423, response.text
+    assert response.json()["detail"] == "Sorry, you have already voted"
+
+    own = session.query(User).filter(User.email == user.get("email")).first()
+    own_picture = Picture(picture_url="https://example.com/own.png", user_id=own.id)
+    session.add(own_picture)
+    session.commit()
+    response = client.post(f"/api/rating/pictures/{own_picture.id}/5", headers=auth_headers)
+    assert response.status_code == 423, response.text
+    assert response.json()["detail"] == "You cannot vote on your own picture"
+
+    response = client.post("/api/rating/pictures/999999/5", headers=auth_headers)
+    assert response.status_code == 404, response.text
+    assert aggregates(session, picture_id) == (1, 3, 3.0)
+
+
+def test_concurrent_votes_of_a_user_count_once(client, session, user):
+    picture_id = add_picture(session, "concurrent")
+    voter_id = session.query(User).filter(User.email == user.get("email")).first().id
+
+    async def vote(rate):
+        async with TestingAsyncSessionLocal() as db:
+            return await repository_rating.create_rate(picture_id, rate, db, await db.get(User, voter_id))
+
+    async def vote_twice():
+        return await asyncio.gather(vote(4), vote(2), return_exceptions=True)
+
+    results = asyncio.run(vote_twice())
+    assert sorted(type(result).__name__ for result in results) == ["HTTPException", "Rating"]
+    assert [result.status_code for result in results if isinstance(result, HTTPException)] == [423]
+    assert session.query(Rating).filter(Rating.picture_id == picture_id).count() == 1
+    assert aggregates(session, picture_id)[0] == 1
+
+
+def test_edited_vote_is_locked():
+    statement = str(repository_rating.locked_rate(1).compile(dialect=postgresql.dialect()))
+    # a concurrent edit waits for the commit and reads the rate it replaces
+    assert statement.endswith("FOR UPDATE")
@@ -0,0 +1,97 @@
+import pytest
+
+from api.database.models import Picture, Tag, User
+
+
+@pytest.fixture(scope="module")
+def pictures(session, auth_headers, user):
+    owner = session.query(User).filter(User.email == user.get("email")).first()
+    descriptions = {
+        "beach": "Sunset on the beach, sunset over the sea",
+        "city": "Sunset in the city",
+        "forest": "Morning in the forest",
+    }
+    items = {name: Picture(picture_url=f"https://example.com/{name}.png", description=text, user_id=owner.id)
+             for name, text in descriptions.items()}
+    session.add_all(items.values())
+    session.commit()
+    return {name: picture.id for name, picture in items.items()}
+
+
+def search(client, auth_headers, **params):
+    response = client.get("/api/search/description/", headers=auth_headers, params=params)
+    assert response.status_code == 200, response.text
+    return [picture["id"] for picture in response.json()]
+
+
+def test_search_ranked_by_relevance(client, auth_headers, pictures):
+    assert search(client, auth_headers, search_query="sunset") == [pictures["beach"], pictures["city"]]
+    # every word has to match, words match by prefix
+    assert search(client, auth_headers, search_query="sun sea") == [pictures["beach"]]
+    assert search(client, auth_headers, search_query="sunset", limit=1, offset=1) == [pictures["city"]]
+
+
+def test_filtered_search_pages(client, auth_headers, pictures):
+    def search_page(**params):
+        response = client.get("/api/search/filter/", headers=auth_headers, params=params)
+        assert response.status_code == 200, response.text
+        return [picture["id"] for picture in response.json()]
+
+    assert search_page(search_query="sunset", limit=1) == [pictures["beach"]]
+    assert search_page(search_query="sunset", limit=1, offset=1) == [pictures["city"]]
+    assert search_page(search_query="sunset", limit=1, offset=2) == []
+    # without the words the newest pictures go first
+    assert search_page(rating=0, limit=2, offset=1)[0] == pictures["city"]
+
+
+def test_search_query_syntax_is_ignored(client, auth_headers, pictures):
+    assert search(client, auth_headers, search_query='"forest" OR -city*') == []
+    assert search(client, auth_headers, search_query='forest!') == [pictures["forest"]]
+    assert search(client, auth_headers, search_query='***') == []
+
+
+def test_search_index_follows_updates(client, session, auth_headers, pictures):
+    picture = session.get(Picture, pictures["forest"])
+    picture.description = "Sunrise in the mountains"
+    session.commit()
+    assert search(client, auth_headers, search_query="forest") == []
+    assert search(client, auth_headers, search_query="mountains") == [pictures["forest"]]
+
+
+def search_by_username(client, auth_headers, user_query):
+    response = client.get("/api/search/search_by_username", headers=auth_headers, params={"user_query": user_query})
+    assert response.status_code == 200, response.text
+    return {picture["id"] for picture in response.json()}
+
+
+def test_search_pictures_by_username_substring(client, session, auth_headers, pictures):
+    # the first registered user is the admin
+    assert search_by_username(client, auth_headers, "stuse") == set(pictures.values())
+    assert search_by_username(client, auth_headers, "TU") == set(pictures.values())
+    assert search_by_username(client, auth_headers, "%") == set()
+    assert search_by_username(client, auth_headers, "nobody") == set()
+
+    owner = session.get(User, session.get(Picture, pictures["city"]).user_id)
+    owner.username = "renamed"
+    session.commit()
+    assert search_by_username(client, auth_headers, "stuse") == set()
+    assert search_by_username(client, auth_headers, "rename") == set(pictures.values())
+
+
+def test_unified_search(client, session, auth_headers, pictures):
+    forest = session.get(Picture, pictures["forest"])
+    forest.tags.append(Tag(name="sunset"))
+    session.add(Picture(picture_url="https://example.com/hidden.png", description="Sunset", shared=False))
+    session.commit()
+
+    response = client.get("/api/search/", headers=auth_headers, params={"search_query": "sunset"})
+    assert response.status_code == 200, response.text
+    # the tag match scores higher than the description matches, not shared pictures of others are not found
+    assert [picture["id"] for picture in response.json()] == [pictures["forest"], pictures["city"], pictures["beach"]]
+
+    response = client.get("/api/search/", headers=auth_headers, params={"search_query": "sunset", "limit": 1,
+                                                                         "offset": 1})
+    assert [picture["id"] for picture in response.json()] == [pictures["city"]]
+
+    response = client.post("/search", data={"query": "sunset"})
+    assert response.status_code == 200, response.text
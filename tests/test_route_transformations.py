@@ -0,0 +1,225 @@
+import base64
+import io
+from datetime import datetime
+
+import pytest
+from PIL import Image
+
+from api.database.models import Picture, TransformedPicture, User
+from api.conf.config import settings
+from api.services.cloud_picture import qrcode_cache
+from api.services.transform_engine import render
+from tests.conftest import count_queries
+
+
+@pytest.fixture(scope="module")
+def transform_id(session, auth_headers, user):
+    owner = session.query(User).filter(User.email == user.get("email")).first()
+    picture = Picture(picture_url="https://res.cloudinary.com/demo/image/upload/v1/cat", user_id=owner.id)
+    session.add(picture)
+    session.commit()
+    transform = TransformedPicture(url="https://res.cloudinary.com/demo/image/upload/a_90/v1/cat",
+                                   picture_id=picture.id)
+    session.add(transform)
+    session.commit()
+    return transform.id
+
+
+def test_get_qrcode_cached(client, auth_headers, transform_id, monkeypatch):
+    qrcode_cache.clear()
+    response = client.get(f"/api/picture/transforms/qrcode/{transform_id}", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    assert base64.b64decode(response.json()).startswith(b"\x89PNG")
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"].startswith("private, max-age=")
+
+    # the second request is served from the cache without rendering
+    monkeypatch.setattr("api.services.cloud_picture.qrcode.QRCode", None)
+    response = client.get(f"/api/picture/transforms/qrcode/{transform_id}", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    assert response.headers["ETag"] == etag
+
+    response = client.get(f"/api/picture/transforms/qrcode/{transform_id}",
+                          headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_qrcode_disk_cache(tmp_path):
+    from api.services.qrcode_cache import QRCodeCache
+
+    key = QRCodeCache.make_key("https://example.com", format="png")
+    QRCodeCache(1, str(tmp_path)).set(key, b"image")
+    # another worker finds the image on disk
+    assert QRCodeCache(1, str(tmp_path)).get(key) == b"image"
+    assert QRCodeCache(1).get(key) is None
+
+
+@pytest.mark.parametrize("image_format, media_type, signature", [
+    ("png", "image/png", b"\x89PNG"),
+    ("svg", "image/svg+xml", b"<?xml"),
+])
+def test_get_qrcode_image(client, auth_headers, transform_id, image_format, media_type, signature):
+    response = client.get(f"/api/picture/transforms/qrcode/{transform_id}", headers=auth_headers,
+                          params={"format": image_format, "box_size": 4, "error_correction": "H"})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith(media_type)
+    assert response.content.startswith(signature)
+
+    response = client.get(f"/api/picture/transforms/qrcode/{transform_id}",
+                          headers={**auth_headers, "If-None-Match": response.headers["ETag"]},
+                          params={"format": image_format, "box_size": 4, "error_correction": "H"})
+    assert response.status_code == 304
+
+
+def test_web_qrcode_of_shared_picture(client, transform_id):
+    response = client.get(f"/qrcode/{transform_id}")
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["Cache-Control"].startswith("public")
+
+
+def test_transformations_cursor_pagination(client, session, auth_headers, transform_id):
+    picture_id = session.get(TransformedPicture, transform_id).picture_id
+    # equal timestamps are ordered by id
+    for i, minute in enumerate([1, 2, 2, 2, 3, 4, 4]):
+        session.add(TransformedPicture(url=f"https://example.com/{i}", picture_id=picture_id,
+                                       created_at=datetime(2026, 1, 1, 12, minute)))
+    session.commit()
+    expected = [t.id for t in sorted(session.get(Picture, picture_id).transformed_pictures,
+                                     key=lambda t: (t.created_at, t.id), reverse=True)]
+
+    pages, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        response = client.get(f"/api/picture/transforms/all/{picture_id}", headers=auth_headers, params=params)
+        assert response.status_code == 200, response.text
+        pages.append([t["id"] for t in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert sum(pages, []) == expected
+    assert [len(page) for page in pages] == [3, 3, 2]
+
+    response = client.get(f"/api/picture/transforms/all/{picture_id}", headers=auth_headers,
+                          params={"limit": 3, "skip": 3})
+    assert [t["id"] for t in response.json()] == pages[1]
+
+    response = client.get(f"/api/picture/transforms/all/{picture_id}", headers=auth_headers,
+                          params={"cursor": "broken"})
+    assert response.status_code == 400, response.text
+
+
+def test_repeated_transformation_is_one_lookup(client, session, auth_headers, transform_id):
+    picture_id = session.get(TransformedPicture, transform_id).picture_id
+    url = f"/api/picture/transforms/resize?base_image_id={picture_id}"
+    response = client.post(url, headers=auth_headers, json={"width": 200, "height": 100})
+    assert response.status_code == 200, response.text
+    first = response.json()
+
+    with count_queries() as statements:
+        # the same transformation written in another order of the parameters
+        response = client.post(url, headers=auth_headers, json={"height": 100, "crop": "fill", "width": 200})
+    assert response.status_code == 200, response.text
+    assert response.json() == first
+    assert len(statements) == 1
+    assert session.query(TransformedPicture).filter(TransformedPicture.url == first["url"]).count() == 1
+
+
+def save_image(path, size=(60, 30), color=(255, 0, 0)):
+    Image.new("RGB", size, color).save(path)
+    return str(path)
+
+
+def open_image(data):
+    return Image.open(io.BytesIO(data)).convert("RGBA")
+
+
+@pytest.mark.parametrize("transform_list, size", [
+    ([{"width": 20, "height": 20, "crop": "fill", "gravity": "auto"}], (20, 20)),
+    ([{"width": 20, "height": 20, "crop": "fit"}], (20, 10)),
+    ([{"width": 40, "height": 40, "crop": "pad", "background": "lightblue"}], (40, 40)),
+    ([{"width": 30, "height": 50, "crop": "crop", "gravity": "west"}], (30, 30)),
+    ([{"angle": 90}], (30, 60)),
+])
+def test_local_engine_geometry(tmp_path, transform_list, size):
+    image = open_image(render(save_image(tmp_path / "source.png"), transform_list))
+    assert image.size == size
+
+
+def test_transformation_size_is_limited(client, session, auth_headers, transform_id, tmp_path, monkeypatch):
+    picture_id = session.get(TransformedPicture, transform_id).picture_id
+    url = f"/api/picture/transforms/resize?base_image_id={picture_id}"
+    for size in ({"width": settings.transform_max_side + 1, "height": 10}, {"width": 4000, "height": 4500}):
+        response = client.post(url, headers=auth_headers, json=size)
+        assert response.status_code == 422, response.text
+
+    source = save_image(tmp_path / "source.png", size=(10, 1000))
+    monkeypatch.setattr(settings, "transform_max_pixels", 100_000)
+    # the height taken from the aspect ratio is too big
+    with pytest.raises(ValueError):
+        render(source, [{"width": 200}])
+    monkeypatch.setattr(settings, "transform_max_side", 500)
+    with pytest.raises(ValueError):
+        render(source, [{"angle": 90}])
+
+
+def test_transformation_of_a_big_source(tmp_path, monkeypatch):
+    # a photo of a camera is bigger than the largest result
+    source = save_image(tmp_path / "photo.png", size=(6000, 40))
+    assert open_image(render(source, [{"width": 600}])).size == (600, 4)
+    assert open_image(render(source, [{"width": 3000, "crop": "fit"}, {"angle": 90}])).size == (20, 3000)
+    # the result is limited
+    with pytest.raises(ValueError):
+        render(source, [])
+    monkeypatch.setattr(settings, "transform_max_side", 1000)
+    # the rotated corners do not fit
+    with pytest.raises(ValueError):
+        render(source, [{"width": 900, "height": 900, "crop": "pad"}, {"angle": 45}])
+    # the source is limited too
+    monkeypatch.setattr(settings, "transform_max_source_side", 5000)
+    with pytest.raises(ValueError):
+        render(source, [{"width": 600}])
+
+
+def test_local_engine_radius_and_effects(tmp_path):
+    source = save_image(tmp_path / "source.png")
+    image = open_image(render(source, [{"radius": "max"}]))
+    assert image.getpixel((0, 0))[3] == 0
+    assert image.getpixel((30, 15)) == (255, 0, 0, 255)
+    image = open_image(render(source, [{"radius": "10:0:0:0"}]))
+    assert image.getpixel((0, 0))[3] == 0
+    assert image.getpixel((59, 0))[3] == 255
+
+    assert open_image(render(source, [{"effect": "negate:0"}])).getpixel((5, 5)) == (0, 255, 255, 255)
+    red, green, blue, _ = open_image(render(source, [{"effect": "grayscale:0"}])).getpixel((5, 5))
+    assert red == green == blue == 76
+    assert open_image(render(source, [{"effect": "blackwhite:20"}])).getpixel((5, 5)) == (255, 255, 255, 255)
+    assert open_image(render(source, [{"effect": "blackwhite:50"}])).getpixel((5, 5)) == (0, 0, 0, 255)
+    for effect in ("cartoonify:50", "oil_paint:30"):
+        assert open_image(render(source, [{"effect": effect}])).size == (60, 30)
+
+
+def test_local_transformation_backend(client, session, auth_headers, user, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "transform_backend", "local")
+    monkeypatch.setattr(settings, "local_store_dir", str(tmp_path))
+    save_image(tmp_path / "source.png")
+    owner = session.query(User).filter(User.email == user.get("email")).first()
+    picture = Picture(picture_url=f"{settings.local_store_url}/source.png", user_id=owner.id)
+    session.add(picture)
+    session.commit()
+
+    response = client.post(f"/api/picture/transforms/rotate?base_image_id={picture.id}", headers=auth_headers,
+                           json={"degree": 90})
+    assert response.status_code == 200, response.text
+    url, response_id = response.json()["url"], response.json()["id"]
+    assert url.startswith(f"{settings.local_store_url}/transformed/")
+    with Image.open(tmp_path / url.removeprefix(f"{settings.local_store_url}/")) as image:
+        assert image.size == (30, 60)
+
+    # the image made by the other backend is not reused
+    monkeypatch.setattr(settings, "transform_backend", "cloudinary")
+    response = client.post(f"/api/picture/transforms/rotate?base_image_id={picture.id}", headers=auth_headers,
+                           json={"degree": 90})
+    assert response.status_code == 200, response.text
+    assert response.json()["url"] != url and response.json()["id"] != response_id